@@ -1,9 +1,14 @@
-from functools import reduce
-from typing import Iterable, Tuple, Type
+import math
+import re
+from functools import partial, reduce
+from typing import Callable, Iterable, Optional, Tuple, Type
 
 from django.conf import settings
-from django.db import models
-from django.db.models import QuerySet
+from django.db import connections, models
+from django.db.backends.signals import connection_created
+from django.db.models import F, OuterRef, QuerySet
+from django.db.models.functions import (Cast, DenseRank, Floor, Lag, Lead, Least, Rank,
+                                        RowNumber, Trunc)
 
 from . import utils
 from .censor import Censor
@@ -21,6 +26,145 @@ class DistinctCount(models.Count):
         super().__init__(*args, distinct=True, **kwargs)
 
 
+
+class _SQLitePercentile:
+    """Continuous percentile aggregate registered on SQLite connections."""
+    
+    
+    def __init__(self):
+        self.values = list()
+        self.percentile = None
+    
+    
+    def step(self, value, percentile):
+        self.percentile = percentile
+        if value is not None:
+            self.values.append(value)
+    
+    
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        return interpolate(self.values, self.percentile)
+
+
+
+def _register_sqlite_functions(connection, **kwargs):
+    """Register `_SQLitePercentile` on new SQLite connections."""
+    if connection.vendor == "sqlite":
+        connection.connection.create_aggregate("DGEQ_PERCENTILE", 2, _SQLitePercentile)
+
+
+
+connection_created.connect(_register_sqlite_functions, dispatch_uid="dgeq_sqlite_functions")
+# Connections opened before this module was imported
+for _connection in connections.all():
+    if _connection.connection is not None:
+        _register_sqlite_functions(_connection)
+
+
+
+def interpolate(values: list, percentile: float) -> float:
+    """Return the continuous `percentile` of the sorted `values`, using linear
+    interpolation between the two closest values like `PERCENTILE_CONT`."""
+    position = (len(values) - 1) * percentile
+    low, high = values[math.floor(position)], values[math.ceil(position)]
+    return float(low) + (float(high) - float(low)) * (position - math.floor(position))
+
+
+
+class Percentile(models.Aggregate):
+    """Continuous percentile (between `0` and `1`) of the values of a field.
+    
+    Use `PERCENTILE_CONT` on PostgreSQL and Oracle, and an aggregate function
+    registered on the connection on SQLite. On other databases, `native()`
+    returns `False` and the percentile must be computed with `sorted_offset()`.
+    """
+    
+    name = "Percentile"
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = models.FloatField()
+    
+    # Vendors computing the percentile in the database
+    native_vendors = ("postgresql", "oracle", "sqlite")
+    
+    
+    def __init__(self, expression, percentile: float, **extra):
+        if not 0 <= percentile <= 1:
+            raise ValueError(f"percentile must be between 0 and 1 (received '{percentile}')")
+        self.percentile = percentile
+        super().__init__(expression, **extra)
+    
+    
+    @classmethod
+    def native(cls, connection) -> bool:
+        """Return whether the percentile can be computed by the database."""
+        return connection.vendor in cls.native_vendors
+    
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, percentile=repr(float(self.percentile)), **extra_context
+        )
+    
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # 'DGEQ_PERCENTILE' is registered when the connection is created
+        copy = self.copy()
+        copy.function = "DGEQ_PERCENTILE"
+        copy.template = "%(function)s(%(expressions)s, %(percentile)s)"
+        return copy.as_sql(compiler, connection, **extra_context)
+    
+    
+    def sorted_offset(self, queryset: QuerySet) -> Optional[float]:
+        """Compute the percentile on `queryset` without relying on the database,
+        by counting the values then fetching the one or two values at the
+        corresponding offset once sorted."""
+        field = self.get_source_expressions()[0].name
+        queryset = queryset.order_by().filter(**{f"{field}__isnull": False})
+        if self.filter is not None:
+            queryset = queryset.filter(self.filter)
+        
+        count = queryset.count()
+        if not count:
+            return None
+        position = (count - 1) * self.percentile
+        values = list(
+            queryset.order_by(field).values_list(field, flat=True)
+            [math.floor(position):math.ceil(position) + 1]
+        )
+        return interpolate(values, position - math.floor(position))
+
+
+
+class Median(Percentile):
+    """50th percentile of the values of a field."""
+    
+    
+    def __init__(self, expression, **extra):
+        super().__init__(expression, 0.5, **extra)
+
+
+
+class P90(Percentile):
+    """90th percentile of the values of a field."""
+    
+    
+    def __init__(self, expression, **extra):
+        super().__init__(expression, 0.9, **extra)
+
+
+
+class P99(Percentile):
+    """99th percentile of the values of a field."""
+    
+    
+    def __init__(self, expression, **extra):
+        super().__init__(expression, 0.99, **extra)
+
+
 # Function used in aggregation and annotation.
 DGEQ_AGGREGATION_FUNCTION = {
     k: import_class(a) for k, a in getattr(settings, "DGEQ_AGGREGATION_FUNCTION", {
@@ -32,11 +176,94 @@ DGEQ_AGGREGATION_FUNCTION = {
         "var":    models.Variance,
         "count":  models.Count,
         "dcount": "dgeq.aggregations.DistinctCount",
+        "median": "dgeq.aggregations.Median",
+        "p90": "dgeq.aggregations.P90",
+        "p99": "dgeq.aggregations.P99",
+        "percentile": "dgeq.aggregations.Percentile",
     }.items())
 }
 
 
 
+def get_function(command: str, name: str) -> Callable[..., models.Aggregate]:
+    """Return the aggregate function corresponding to `name` in
+    `DGEQ_AGGREGATION_FUNCTION`.
+    
+    `percentile(q)` returns the `percentile` function with its percentile set
+    to `q`, which must be a number between `0` and `1`.
+    
+    Raise `InvalidCommandError` if the function does not exist."""
+    match = re.fullmatch(r"percentile\((.*)\)", name)
+    if match:
+        name = "percentile"
+    if name not in DGEQ_AGGREGATION_FUNCTION:
+        raise InvalidCommandError(
+            command,
+            f"Unknown function '{name}', valid functions are : "
+            f"{list(DGEQ_AGGREGATION_FUNCTION.keys())}"
+        )
+    if name != "percentile":
+        return DGEQ_AGGREGATION_FUNCTION[name]
+    
+    try:
+        percentile = float(match.group(1)) if match else None
+    except ValueError:
+        percentile = None
+    if percentile is None or not 0 <= percentile <= 1:
+        raise InvalidCommandError(
+            command,
+            f"'percentile' function must be used as 'percentile(q)', with 'q' a number between "
+            f"0 and 1 (received '{match.group(0) if match else name}')"
+        )
+    return partial(DGEQ_AGGREGATION_FUNCTION[name], percentile=percentile)
+
+
+# Functions only available to window annotations, along with whether they
+# need a field. Aggregation functions can also be used to compute running
+# aggregates.
+WINDOW_FUNCTIONS = {
+    "rank":       (Rank, False),
+    "dense_rank": (DenseRank, False),
+    "row_number": (RowNumber, False),
+    "lag":        (Lag, True),
+    "lead":       (Lead, True),
+}
+
+# Strategies used to compute annotations
+ANNOTATION_STRATEGIES = ("join", "subquery")
+
+# Fields that can be used to compute the buckets of an histogram
+NUMERIC_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField)
+
+# Intervals available for time series, according to the type of the field
+DATE_INTERVALS = ("year", "quarter", "month", "week", "day")
+INTERVALS = DATE_INTERVALS + ("hour", "minute")
+
+
+
+def _check_to(command: str, to: str, model: Type[models.Model], censor: Censor,
+              arbitrary_fields: Iterable[str] = ()):
+    """Check that `to` can be used as the name of a new field of `model`.
+    
+    Raise `InvalidCommandError` if `to` is not a valid identifier or if it is
+    already used by a field."""
+    if not to.isidentifier():
+        raise InvalidCommandError(
+            command,
+            f"'to' value isn't a valid identifier ('{to}'). Valid identifiers "
+            f"can use uppercase and lowercase letters 'A' through 'Z', the underscore "
+            f"'_' and (except for the first character) the digits '0' through '9'."
+        )
+    try:
+        # Use check_fields to check that a field DOES NOT exists by
+        # expecting the exception it raises.
+        utils.check_field(to, model, censor, arbitrary_fields)
+        raise InvalidCommandError(command, f"'to' value ('{to}') is a already used by a field")
+    except UnknownFieldError:
+        pass
+
+
+
 class Aggregation:
     """Represents an aggregation.
     
@@ -45,18 +272,23 @@ class Aggregation:
         * `to` (`str`) - Name of the field where the result of the aggregation
                 will be stored.
         * `func` (`Type[models.Aggregate]`) - Function used for the aggregation.
+        * `filters` (`Iterable[Filter]`) - Filters restricting the rows used to
+                compute the aggregation.
     """
     
     
-    def __init__(self, field: str, to: str, func: Type[models.Aggregate]):
+    def __init__(self, field: str, to: str, func: Type[models.Aggregate],
+                 filters: Iterable[Filter] = ()):
         self.field = field
         self.to = to
         self.func = func
+        self.filters = filters
     
     
     @classmethod
     def from_query_value(cls, value: str, model: Type[models.Model], censor: Censor,
-                         arbitrary_fields: Iterable[str] = ()) -> 'Aggregation':
+                         arbitrary_fields: Iterable[str] = (), case: bool = True
+                         ) -> 'Aggregation':
         """Create an `Aggregation` from a 'c:aggregate` query string."""
         try:
             query_dict = utils.subquery_to_querydict(value)
@@ -72,36 +304,28 @@ class Aggregation:
         # Retrieve the function used to compute the aggregation
         if "func" not in query_dict:
             raise InvalidCommandError("c:aggregate", "'func' argument is missing")
-        if query_dict["func"] not in DGEQ_AGGREGATION_FUNCTION:
-            raise InvalidCommandError(
-                "c:aggregate",
-                f"Unknown function '{query_dict['func']}', valid functions are : "
-                f"{list(DGEQ_AGGREGATION_FUNCTION.keys())}"
-            )
-        func = DGEQ_AGGREGATION_FUNCTION[query_dict["func"]]
+        func = get_function("c:aggregate", query_dict["func"])
         
         # Retrieve the field where to put the computed aggregation
         if "to" not in query_dict:
             raise InvalidCommandError("c:aggregate", "'to' argument is missing")
-        if not query_dict["to"].isidentifier():
-            raise InvalidCommandError(
-                "c:aggregate",
-                f"'to' value isn't a valid identifier ('{query_dict['to']}'). Valid identifiers "
-                f"can use uppercase and lowercase letters 'A' through 'Z', the underscore "
-                f"'_' and (except for the first character) the digits '0' through '9'."
-            )
-        try:
-            # Use check_fields to check that a field DOES NOT exists by
-            # expecting the exception it raises.
-            utils.check_field(query_dict["to"], model, censor, arbitrary_fields)
-            raise InvalidCommandError(
-                "c:aggregate", f"'to' value ('{query_dict['to']}') is a already used by a field"
-            )
-        except UnknownFieldError:
-            pass
+        _check_to("c:aggregate", query_dict["to"], model, censor, arbitrary_fields)
         to = query_dict["to"]
         
-        return cls(field, to, func)
+        # Retrieve optional filters used for the aggregation
+        filters = list()
+        for f in utils.split_list_values(query_dict.getlist("filters"), "'"):
+            kwarg = f.split('=', 1)
+            if len(kwarg) < 2:
+                raise InvalidCommandError(
+                    "c:aggregate", f"Filters must contains an equal '=', received '{kwarg[0]}'"
+                )
+            k, v = kwarg
+            utils.check_field(k, model, censor, arbitrary_fields)
+            target = utils.target_field(k, model, arbitrary_fields)
+            filters.append(Filter(k, v, case, target))
+        
+        return cls(field, to, func, filters)
     
     
     def get(self) -> Tuple[str, models.Aggregate]:
@@ -112,7 +336,15 @@ class Aggregation:
         kwargs = dict([a.get() for a in aggregations])
         queryset.aggregate(**kwargs)
         ```
+        
+        Filters, if any, are compiled into the `filter` argument of the
+        aggregate function, allowing multiple conditional aggregations to be
+        computed in a single query.
         """
+        if self.filters:
+            return self.to, self.func(
+                self.field, filter=reduce(lambda i, j: i & j, (f.get() for f in self.filters))
+            )
         return self.to, self.func(self.field)
 
 
@@ -129,18 +361,27 @@ class Annotation:
         * `early` (`bool`) - Whether the annotation will be applied before
             (`True`) or after (`False`) the filtering of the main query. See [1]
             for more information. Default is False.
+        * `strategy` (`Optional[str]`) - Either `"join"` to compute the
+            annotation by joining the related table, or `"subquery"` to compute
+            it in a correlated subquery. `None` let `Annotate` choose, which
+            sets it to `"stored"` when reading a maintained annotation.
+        * `arbitrary` (`bool`) - Whether the annotation uses fields created by
+            other commands, in which case it cannot be computed in a subquery.
             
     [1] https://docs.djangoproject.com/en/3.1/topics/db/aggregation/#order-of-annotate-and-filter-clauses
     """  # noqa
     
     
     def __init__(self, field: str, to: str, func: Type[models.Aggregate],
-                 filters: Iterable[Filter] = (), early: bool = False):
+                 filters: Iterable[Filter] = (), early: bool = False,
+                 strategy: Optional[str] = None, arbitrary: bool = False):
         self.field = field
         self.to = to
         self.func = func
         self.filters = filters
         self.early = early
+        self.strategy = strategy
+        self.arbitrary = arbitrary
     
     
     @classmethod
@@ -161,37 +402,16 @@ class Annotation:
         # Retrieve the function used to compute the annotation
         if "func" not in query_dict:
             raise InvalidCommandError("c:annotate", "'func' argument is missing")
-        if query_dict["func"] not in DGEQ_AGGREGATION_FUNCTION:
-            raise InvalidCommandError(
-                "c:annotate",
-                f"Unknown function '{query_dict['func']}', valid functions are : "
-                f"{list(DGEQ_AGGREGATION_FUNCTION.keys())}"
-            )
-        func = DGEQ_AGGREGATION_FUNCTION[query_dict["func"]]
+        func = get_function("c:annotate", query_dict["func"])
         
         # Retrieve the field where to put the computed annotation
         if "to" not in query_dict:
             raise InvalidCommandError("c:annotate", "'to' argument is missing")
-        if not query_dict["to"].isidentifier():
-            raise InvalidCommandError(
-                "c:annotate",
-                f"'to' value isn't a valid identifier ('{query_dict['to']}'). Valid identifiers "
-                f"can use uppercase and lowercase letters 'A' through 'Z', the underscore "
-                f"'_' and (except for the first character) the digits '0' through '9'."
-            )
-        try:
-            # Use check_fields to check that a field DOES NOT exists by
-            # expecting the exception it raises.
-            utils.check_field(query_dict["to"], model, censor, arbitrary_fields)
-            raise InvalidCommandError(
-                "c:annotate", f"'to' value ('{query_dict['to']}') is a already used by a field"
-            )
-        except UnknownFieldError:
-            pass
+        _check_to("c:annotate", query_dict["to"], model, censor, arbitrary_fields)
         to = query_dict["to"]
         
         # Retrieve optional filters used for the annotation
-        filters = list()
+        filters, used = list(), [query_dict["field"]]
         for f in utils.split_list_values(query_dict.getlist("filters"), "'"):
             kwarg = f.split('=', 1)
             if len(kwarg) < 2:
@@ -199,7 +419,10 @@ class Annotation:
                     "c:annotate", f"Filters must contains an equal '=', received '{kwarg[0]}'"
                 )
             k, v = kwarg
-            filters.append(Filter(k, v, case))
+            utils.check_field(k, model, censor, arbitrary_fields)
+            target = utils.target_field(k, model, arbitrary_fields)
+            filters.append(Filter(k, v, case, target))
+            used.append(k)
         
         # Check if this annotation must be delayed
         early = query_dict.get("early", "0")
@@ -207,18 +430,360 @@ class Annotation:
             raise InvalidCommandError("c:annotate", "'early' argument must be '0' or '1'")
         early = bool(int(early))
         
-        return cls(field, to, func, filters, early)
+        # Retrieve the strategy used to compute the annotation, if given
+        strategy = query_dict.get("strategy")
+        if strategy not in [None, *ANNOTATION_STRATEGIES]:
+            raise InvalidCommandError(
+                "c:annotate", f"'strategy' argument must be one of {list(ANNOTATION_STRATEGIES)}"
+            )
+        # Subqueries are built from the rows of the model, which do not have
+        # the fields created by other commands
+        arbitrary = [f for f in used if f.split(".")[0] in arbitrary_fields]
+        if arbitrary and strategy == "subquery":
+            raise InvalidCommandError(
+                "c:annotate",
+                f"'subquery' strategy cannot use a field created by another command "
+                f"('{arbitrary[0]}')"
+            )
+        
+        return cls(field, to, func, filters, early, strategy, bool(arbitrary))
+    
+    
+    def spans_many(self, model: Type[models.Model], arbitrary_fields: Iterable[str] = ()) -> bool:
+        """Return whether the field of this annotation spans a list of related
+        models of `model`."""
+        return utils.spans_many(self.field, model, arbitrary_fields, sep="__")
     
     
     def apply(self, queryset: QuerySet) -> QuerySet:
         """Return a new `QuerySet` with this `Annotation` applied."""
         if self.filters:
-            kwargs = {
-                self.to: self.func(
-                    self.field, filter=reduce(lambda i, j: i & j, (f.get() for f in self.filters))
+            expression = self.func(
+                self.field, filter=reduce(lambda i, j: i & j, (f.get() for f in self.filters))
+            )
+        else:
+            expression = self.func(self.field)
+        
+        if isinstance(expression, Percentile) and not expression.native(connections[queryset.db]):
+            raise InvalidCommandError(
+                "c:annotate", f"percentiles ('{self.to}') are not supported by this database"
+            )
+        
+        if self.strategy == "subquery":
+            # Aggregate the related rows of each row in its own subquery, so
+            # that other joins of the main query cannot multiply them.
+            subquery = (
+                queryset.model._default_manager.filter(pk=OuterRef("pk"))
+                .order_by().values("pk").annotate(_dgeq_value=expression)
+                .values("_dgeq_value")
+            )
+            expression = models.Subquery(subquery)
+        
+        return queryset.annotate(**{self.to: expression})
+
+
+
+class WindowAnnotation:
+    """Represents an annotation computed with a window function.
+    
+    Fields:
+        * `to` (`str`) - Name of the field where the result of the window
+                function will be stored.
+        * `func` (`str`) - Name of the function, either a key of
+                `WINDOW_FUNCTIONS` or `DGEQ_AGGREGATION_FUNCTION`.
+        * `field` (`Optional[str]`) - Field used by the function, if any.
+        * `partition` (`Iterable[str]`) - Fields used to partition the rows.
+        * `order` (`Iterable[str]`) - Fields used to sort the rows of each
+                partition, prefixed by an hyphen `-` for descending order.
+        * `offset` (`int`) - Offset used by `lag` and `lead`.
+    """
+    
+    
+    def __init__(self, to: str, func: str, field: Optional[str] = None,
+                 partition: Iterable[str] = (), order: Iterable[str] = (), offset: int = 1):
+        self.to = to
+        self.func = func
+        self.field = field
+        self.partition = partition
+        self.order = order
+        self.offset = offset
+    
+    
+    @classmethod
+    def from_query_value(cls, value: str, model: Type[models.Model], censor: Censor,
+                         arbitrary_fields: Iterable[str] = ()) -> 'WindowAnnotation':
+        """Create a `WindowAnnotation` from a 'c:window` query string."""
+        try:
+            query_dict = utils.subquery_to_querydict(value)
+        except ValueError as e:
+            raise InvalidCommandError("c:window", str(e))
+        
+        # Retrieve the function
+        if "func" not in query_dict:
+            raise InvalidCommandError("c:window", "'func' argument is missing")
+        func = query_dict["func"]
+        if func in WINDOW_FUNCTIONS:
+            needs_field = WINDOW_FUNCTIONS[func][1]
+        else:
+            aggregate = get_function("c:window", func)("pk")
+            if isinstance(aggregate, Percentile) or aggregate.distinct:
+                raise InvalidCommandError(
+                    "c:window", f"'{func}' cannot be used as a window function"
+                )
+            needs_field = True
+        
+        # Retrieve the field used by the function
+        field = query_dict.get("field")
+        if needs_field and field is None:
+            raise InvalidCommandError("c:window", f"'field' argument is missing for '{func}'")
+        if not needs_field and field is not None:
+            raise InvalidCommandError("c:window", f"'{func}' does not use a 'field'")
+        if field is not None:
+            utils.check_field(field, model, censor, arbitrary_fields)
+            field = field.replace(".", "__")
+        
+        # Retrieve the field where to put the result
+        if "to" not in query_dict:
+            raise InvalidCommandError("c:window", "'to' argument is missing")
+        _check_to("c:window", query_dict["to"], model, censor, arbitrary_fields)
+        to = query_dict["to"]
+        
+        # Retrieve the partition and the order of the rows
+        partition = utils.split_list_values(query_dict.getlist("partition"), "'")
+        order = utils.split_list_values(query_dict.getlist("order"), "'")
+        for f in partition + [o[1:] if o.startswith("-") else o for o in order]:
+            utils.check_field(f, model, censor, arbitrary_fields)
+            if utils.spans_many(f, model, arbitrary_fields):
+                raise InvalidCommandError(
+                    "c:window", f"cannot use a list of related models ('{f}')"
                 )
-            }
+        if func in WINDOW_FUNCTIONS and not order:
+            raise InvalidCommandError("c:window", f"'order' argument is missing for '{func}'")
+        partition = [f.replace(".", "__") for f in partition]
+        order = [f.replace(".", "__") for f in order]
+        
+        # Retrieve the offset of 'lag' and 'lead'
+        offset = query_dict.get("offset", "1")
+        if func not in ("lag", "lead") and "offset" in query_dict:
+            raise InvalidCommandError("c:window", f"'{func}' does not use an 'offset'")
+        if not offset.isdigit() or not int(offset):
+            raise InvalidCommandError(
+                "c:window", f"'offset' value must be a positive integer (received '{offset}')"
+            )
+        
+        return cls(to, func, field, partition, order, int(offset))
+    
+    
+    def get(self) -> Tuple[str, models.Window]:
+        """Return a tuple (keyword, window expression)."""
+        if self.func in ("lag", "lead"):
+            expression = WINDOW_FUNCTIONS[self.func][0](self.field, self.offset)
+        elif self.func in WINDOW_FUNCTIONS:
+            expression = WINDOW_FUNCTIONS[self.func][0]()
         else:
-            kwargs = {self.to: self.func(self.field)}
+            expression = get_function("c:window", self.func)(self.field)
+        
+        partition = [F(f) for f in self.partition]
+        order = [F(o[1:]).desc() if o.startswith("-") else F(o).asc() for o in self.order]
+        return self.to, models.Window(
+            expression, partition_by=partition or None, order_by=order or None
+        )
+    
+    
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        """Return a new `QuerySet` with this `WindowAnnotation` applied."""
+        if not connections[queryset.db].features.supports_over_clause:
+            raise InvalidCommandError(
+                "c:window", "window functions are not supported by this database"
+            )
+        return queryset.annotate(**dict([self.get()]))
+
+
+
+class Buckets:
+    """Represents the buckets of an histogram.
+    
+    Fields:
+        * `field` (`str`) - Numeric field used to compute the buckets.
+        * `to` (`str`) - Name of the field where the index of the bucket will
+                be stored.
+        * `buckets` (`int`) - Number of buckets.
+        * `min` (`Optional[float]`) - Lower bound of the first bucket, the
+                minimum value of `field` is used if `None`.
+        * `max` (`Optional[float]`) - Upper bound of the last bucket, the
+                maximum value of `field` is used if `None`.
+    """
+    
+    
+    def __init__(self, field: str, to: str, buckets: int, min_: Optional[float] = None,
+                 max_: Optional[float] = None):
+        self.field = field
+        self.to = to
+        self.buckets = buckets
+        self.min = min_
+        self.max = max_
+    
+    
+    @property
+    def width(self) -> Optional[float]:
+        """Width of each bucket, `None` if the bounds are not known yet."""
+        if self.min is None or self.max is None:
+            return None
+        return (self.max - self.min) / self.buckets or 1
+    
+    
+    @classmethod
+    def from_query_value(cls, value: str, model: Type[models.Model], censor: Censor,
+                         arbitrary_fields: Iterable[str] = ()) -> 'Buckets':
+        """Create `Buckets` from a 'c:histogram` query string."""
+        from .constants import DGEQ_MAX_LIMIT
+        
+        try:
+            query_dict = utils.subquery_to_querydict(value)
+        except ValueError as e:
+            raise InvalidCommandError("c:histogram", str(e))
+        
+        # Retrieve the field used to compute the buckets
+        if "field" not in query_dict:
+            raise InvalidCommandError("c:histogram", "'field' argument is missing")
+        second_last_model, last_field_name = utils.check_field(
+            query_dict["field"], model, censor, arbitrary_fields
+        )
+        if query_dict["field"] not in arbitrary_fields:
+            target = utils.get_field(last_field_name, second_last_model)
+            if not isinstance(target, NUMERIC_FIELDS):
+                raise InvalidCommandError(
+                    "c:histogram", f"'field' must be a numeric field ('{query_dict['field']}')"
+                )
+        field = query_dict["field"].replace(".", "__")
+        
+        # Retrieve the number of buckets
+        buckets = query_dict.get("buckets", "10")
+        if not buckets.isdigit() or not int(buckets):
+            raise InvalidCommandError(
+                "c:histogram", f"'buckets' value must be a positive integer (received '{buckets}')"
+            )
+        buckets = int(buckets)
+        if DGEQ_MAX_LIMIT and buckets > DGEQ_MAX_LIMIT:
+            raise InvalidCommandError(
+                "c:histogram",
+                f"'buckets' value cannot be higher than '{DGEQ_MAX_LIMIT}' (received '{buckets}')"
+            )
+        
+        # Retrieve optional bounds
+        bounds = list()
+        for key in ("min", "max"):
+            bound = query_dict.get(key)
+            if bound is not None:
+                try:
+                    bound = float(bound)
+                except ValueError:
+                    raise InvalidCommandError(
+                        "c:histogram", f"'{key}' value must be a number (received '{bound}')"
+                    )
+            bounds.append(bound)
+        min_, max_ = bounds
+        if min_ is not None and max_ is not None and min_ > max_:
+            raise InvalidCommandError("c:histogram", "'min' cannot be higher than 'max'")
+        
+        # Retrieve the field where to put the index of the bucket
+        to = query_dict.get("to", "bucket")
+        _check_to("c:histogram", to, model, censor, arbitrary_fields)
+        
+        return cls(field, to, buckets, min_, max_)
+    
+    
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        """Return a new `QuerySet` annotated with the index of the bucket of
+        each row.
+        
+        Missing bounds are computed with a single aggregation on `queryset`.
+        Rows outside the bounds are filtered out."""
+        if self.min is None or self.max is None:
+            bounds = queryset.aggregate(
+                _dgeq_min=models.Min(self.field), _dgeq_max=models.Max(self.field)
+            )
+            if self.min is None:
+                self.min = bounds["_dgeq_min"] or 0
+            if self.max is None:
+                self.max = bounds["_dgeq_max"] or 0
+            if self.min > self.max:
+                self.max = self.min
+        
+        index = models.ExpressionWrapper(
+            (models.F(self.field) - models.Value(self.min)) / models.Value(float(self.width)),
+            output_field=models.FloatField(),
+        )
+        # Values equal to `max` belong to the last bucket
+        bucket = Least(Cast(Floor(index), models.IntegerField()), self.buckets - 1)
+        
+        queryset = queryset.filter(**{
+            f"{self.field}__gte": self.min, f"{self.field}__lte": self.max
+        })
+        return queryset.annotate(**{self.to: bucket})
+
+
+
+class Periods:
+    """Represents the periods of a time series.
+    
+    Fields:
+        * `field` (`str`) - Date field used to compute the periods.
+        * `to` (`str`) - Name of the field where the start of the period will
+                be stored.
+        * `interval` (`str`) - Length of the periods, must be a kind accepted
+                by `Trunc`.
+    """
+    
+    
+    def __init__(self, field: str, to: str, interval: str):
+        self.field = field
+        self.to = to
+        self.interval = interval
+    
+    
+    @classmethod
+    def from_query_value(cls, value: str, model: Type[models.Model], censor: Censor,
+                         arbitrary_fields: Iterable[str] = ()) -> 'Periods':
+        """Create `Periods` from a 'c:timeseries` query string."""
+        try:
+            query_dict = utils.subquery_to_querydict(value)
+        except ValueError as e:
+            raise InvalidCommandError("c:timeseries", str(e))
+        
+        # Retrieve the field used to compute the periods
+        if "field" not in query_dict:
+            raise InvalidCommandError("c:timeseries", "'field' argument is missing")
+        second_last_model, last_field_name = utils.check_field(
+            query_dict["field"], model, censor, arbitrary_fields
+        )
+        # The type of created fields is not known, they cannot be used
+        target = None
+        if query_dict["field"] not in arbitrary_fields:
+            target = utils.get_field(last_field_name, second_last_model)
+        if not isinstance(target, models.DateField):
+            raise InvalidCommandError(
+                "c:timeseries", f"'field' must be a date field ('{query_dict['field']}')"
+            )
+        field = query_dict["field"].replace(".", "__")
         
-        return queryset.annotate(**kwargs)
+        # Retrieve the interval
+        interval = query_dict.get("interval", "month")
+        intervals = INTERVALS if isinstance(target, models.DateTimeField) else DATE_INTERVALS
+        if interval not in intervals:
+            raise InvalidCommandError(
+                "c:timeseries",
+                f"Unknown interval '{interval}', valid intervals are : {list(intervals)}"
+            )
+        
+        # Retrieve the field where to put the start of the period
+        to = query_dict.get("to", "period")
+        _check_to("c:timeseries", to, model, censor, arbitrary_fields)
+        
+        return cls(field, to, interval)
+    
+    
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        """Return a new `QuerySet` annotated with the start of the period of
+        each row."""
+        return queryset.annotate(**{self.to: Trunc(self.field, self.interval)})
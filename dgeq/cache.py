@@ -0,0 +1,205 @@
+import hashlib
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, BaseCache, caches
+from django.db import models, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from . import utils
+
+
+# List of models (or their dotted path / label) whose serialized rows are
+# cached. The rows of a query are then retrieved by primary key, only the rows
+# missing from the cache being fetched and serialized. Cached rows are
+# invalidated when they (or rows related to them) are saved or deleted.
+DGEQ_ROW_CACHE = getattr(settings, "DGEQ_ROW_CACHE", [])
+
+# Alias of the cache (in `CACHES`) storing the rows
+DGEQ_ROW_CACHE_ALIAS = getattr(settings, "DGEQ_ROW_CACHE_ALIAS", DEFAULT_CACHE_ALIAS)
+
+# Prefix of every key used by the row cache
+PREFIX = "dgeq:rows"
+
+
+
+def cached(model: Type[models.Model]) -> bool:
+    """Return whether the rows of `model` are cached."""
+    return utils.get_model_setting({m: True for m in DGEQ_ROW_CACHE}, model, False)
+
+
+
+def _cache() -> BaseCache:
+    return caches[DGEQ_ROW_CACHE_ALIAS]
+
+
+
+def _version_key(model: Type[models.Model], pk: Any = None) -> str:
+    """Return the key of the version of the row of `model` whose primary key
+    is `pk`, or of the version of every row of `model` if `pk` is `None`."""
+    if pk is None:
+        return f"{PREFIX}:{model._meta.label_lower}"
+    return f"{PREFIX}:{model._meta.label_lower}:{pk}"
+
+
+
+def fingerprint(fields: Iterable[str], one_fields: Iterable[str],
+                many_fields: Iterable[str]) -> str:
+    """Return a fingerprint of the projection of the rows."""
+    projection = repr((sorted(fields), sorted(one_fields), sorted(many_fields)))
+    return hashlib.sha1(projection.encode()).hexdigest()[:16]
+
+
+
+def _versions(cache: BaseCache, keys: List[str]) -> Dict[str, str]:
+    """Return the versions stored at `keys`, creating the missing ones."""
+    versions = cache.get_many(keys)
+    missing = [k for k in keys if k not in versions]
+    if missing:
+        # Another process may have created a version in the meantime, keep it
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+
+def rows(queryset: QuerySet, fields: Set[str], one_fields: Set[str],
+         many_fields: Set[str]) -> List[Dict[str, Any]]:
+    """Return the serialized rows of `queryset`, in order.
+    
+    Only the primary keys of the rows are retrieved from `queryset`. Rows are
+    then taken from the cache, the missing ones being fetched with a single
+    query (plus the queries prefetching their list of related models),
+    serialized and cached.
+    
+    Entries are keyed by model, primary key, projection and versions. The
+    version of a row (and the version of every row of the model) is replaced
+    when it is invalidated, so that outdated entries are never read again."""
+    model = queryset.model
+    cache = _cache()
+    pks = list(queryset.values_list("pk", flat=True))
+    if not pks:
+        return []
+    
+    version_keys = {pk: _version_key(model, pk) for pk in pks}
+    versions = _versions(cache, [_version_key(model), *version_keys.values()])
+    projection = fingerprint(fields, one_fields, many_fields)
+    keys = {
+        pk: f"{key}:{versions[_version_key(model)]}:{versions[key]}:{projection}"
+        for pk, key in version_keys.items()
+    }
+    entries = cache.get_many(list(keys.values()))
+    
+    missing = {pk for pk, key in keys.items() if key not in entries}
+    if missing:
+        instances = model._default_manager.using(queryset.db).filter(pk__in=missing)
+        instances = instances.select_related(*one_fields).prefetch_related(*many_fields)
+        fetched = {
+            keys[i.pk]: utils.serialize_row(i, fields, one_fields, many_fields)
+            for i in instances
+        }
+        cache.set_many(fetched)
+        entries.update(fetched)
+    
+    # Rows may have been deleted since the primary keys were retrieved
+    return [dict(entries[keys[pk]]) for pk in pks if keys[pk] in entries]
+
+
+
+def invalidate(model: Type[models.Model], pks: Optional[Iterable[Any]] = None,
+               using: Optional[str] = None):
+    """Invalidate the cached rows of `model` whose primary key is in `pks`, or
+    every row of `model` if `pks` is `None`.
+    
+    Rows are invalidated immediately, then again once the current transaction
+    of `using` is committed so that rows read from another transaction before
+    the commit are not kept."""
+    if pks is None:
+        keys = [_version_key(model)]
+    else:
+        keys = [_version_key(model, pk) for pk in pks if pk is not None]
+    if not keys:
+        return
+    
+    cache = _cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+
+def _related(sender: Type[models.Model], values: Dict[str, Any]
+             ) -> List[Tuple[Type[models.Model], Optional[Any]]]:
+    """Return the rows of cached models referenced by the foreign keys of
+    `sender`, given the values of these foreign keys.
+    
+    Rows referenced through a field other than the primary key are returned as
+    `(model, None)`, their whole model has to be invalidated."""
+    related = list()
+    for field in sender._meta.concrete_fields:
+        if field.is_relation and cached(field.related_model) and field.attname in values:
+            pk = values[field.attname] if field.target_field.primary_key else None
+            related.append((field.related_model, pk))
+    return related
+
+
+
+def _invalidate_related(related: List[Tuple[Type[models.Model], Optional[Any]]], using: str):
+    for model, pk in related:
+        invalidate(model, None if pk is None else [pk], using)
+
+
+
+def _foreign_keys(sender: Type[models.Model]) -> List[str]:
+    """Return the attributes of the foreign keys of `sender` to cached
+    models."""
+    return [
+        f.attname for f in sender._meta.concrete_fields
+        if f.is_relation and cached(f.related_model)
+    ]
+
+
+
+def _on_pre_save(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    # Rows previously referenced by the foreign keys of the instance lose it
+    # from their list of related models
+    attnames = _foreign_keys(sender) if DGEQ_ROW_CACHE and instance.pk is not None else []
+    if attnames:
+        values = sender._default_manager.using(using).filter(pk=instance.pk)
+        values = values.values(*attnames).first()
+        if values is not None:
+            _invalidate_related(_related(sender, values), using)
+
+
+
+def _on_save_or_delete(sender: Type[models.Model], instance: models.Model, using: str,
+                       **kwargs):
+    if not DGEQ_ROW_CACHE:
+        return
+    
+    if cached(sender):
+        invalidate(sender, [instance.pk], using)
+    _invalidate_related(_related(sender, instance.__dict__), using)
+
+
+
+def _on_m2m_changed(sender: Type[models.Model], instance: models.Model, action: str,
+                    model: Type[models.Model], pk_set: Optional[Set[Any]], using: str,
+                    **kwargs):
+    if not DGEQ_ROW_CACHE or not action.startswith("post_"):
+        return
+    
+    if cached(type(instance)):
+        invalidate(type(instance), [instance.pk], using)
+    if cached(model):
+        # The related rows removed by 'clear()' are not given
+        invalidate(model, pk_set if action != "post_clear" else None, using)
+
+
+
+pre_save.connect(_on_pre_save, dispatch_uid="dgeq_cache_pre_save")
+post_save.connect(_on_save_or_delete, dispatch_uid="dgeq_cache_post_save")
+post_delete.connect(_on_save_or_delete, dispatch_uid="dgeq_cache_post_delete")
+m2m_changed.connect(_on_m2m_changed, dispatch_uid="dgeq_cache_m2m_changed")
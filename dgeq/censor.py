@@ -115,3 +115,16 @@ class Censor:
         """Return a censored set corresponding to the public field of
         `fields`."""
         return {f for f in fields if self.is_public(model, f)}
+    
+    
+    def fingerprint(self) -> str:
+        """Return a representation of what this instance censors, equal for
+        every `Censor` censoring the same fields."""
+        
+        def mapping(fields: Dict[Type[models.Model], Iterable[str]]):
+            return sorted((m._meta.label, sorted(f)) for m, f in fields.items())
+        
+        user = None
+        if self.use_permissions:
+            user = self.user.pk if self.user.is_authenticated else "anonymous"
+        return repr((mapping(self.public), mapping(self.private), user))
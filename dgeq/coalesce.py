@@ -0,0 +1,167 @@
+import asyncio
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, TYPE_CHECKING, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+
+
+if TYPE_CHECKING:
+    from .dgeq import GenericQuery
+
+# Whether identical queries evaluated concurrently in the same process (by
+# threads or asyncio tasks) share the result of the first one instead of being
+# evaluated each.
+DGEQ_COALESCE = getattr(settings, "DGEQ_COALESCE", False)
+
+# Alias of the cache used to also share the result of identical queries
+# evaluated concurrently by different processes, `None` to only share results
+# within a process.
+DGEQ_COALESCE_CACHE = getattr(settings, "DGEQ_COALESCE_CACHE", None)
+
+# Maximum time (in seconds) a query waits for the result of an identical query
+# evaluated by another thread, task or process, also used as timeout of the
+# cache entries.
+DGEQ_COALESCE_TIMEOUT = getattr(settings, "DGEQ_COALESCE_TIMEOUT", 30)
+
+# Time (in seconds) between two checks of the result of another process
+POLL_INTERVAL = 0.05
+
+# Prefix of every key used in the cache
+PREFIX = "dgeq:flight"
+
+
+
+def key(query: 'GenericQuery') -> str:
+    """Return the key of `query`, equal for every query on the same model and
+    database with the same query string, censoring the same fields and whose
+    `queryset` compiles to the same SQL (views may restrict it)."""
+    try:
+        sql = query.queryset.query.sql_with_params()
+    except EmptyResultSet:
+        sql = None
+    flight = repr((
+        query.model._meta.label, query.queryset.db, query._query_dict_list,
+        query.censor.fingerprint(), sql,
+    ))
+    return hashlib.sha1(flight.encode()).hexdigest()
+
+
+
+class _Flight:
+    """Evaluation of a query shared by concurrent identical queries."""
+    
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+# Flights in progress in this process, by key
+_FLIGHTS: Dict[str, _Flight] = dict()
+_FLIGHTS_LOCK = threading.Lock()
+
+# Flights in progress in each event loop, by loop and key
+_TASKS: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = dict()
+
+
+
+def single_flight(key: str, func: Callable[[], Any]) -> Any:
+    """Return the result of `func()`, sharing it with the concurrent calls
+    using the same `key` in this process.
+    
+    Only the first call executes `func()`, the other calls wait for its result
+    and receive a copy of it (taken from a snapshot, so that the first call can
+    modify its result). If `func()` fails, or if its result is not
+    available after `DGEQ_COALESCE_TIMEOUT`, each waiting call executes it
+    instead. If `DGEQ_COALESCE_CACHE` is set, the first call also shares the
+    result with other processes (see `cache_flight()`)."""
+    with _FLIGHTS_LOCK:
+        flight = _FLIGHTS.get(key)
+        leader = flight is None
+        if leader:
+            flight = _FLIGHTS[key] = _Flight()
+    
+    if not leader:
+        if not flight.done.wait(DGEQ_COALESCE_TIMEOUT) or flight.result is None:
+            return func()
+        return copy.deepcopy(flight.result)
+    
+    result = None
+    try:
+        result = cache_flight(key, func) if DGEQ_COALESCE_CACHE else func()
+        flight.result = copy.deepcopy(result)
+    finally:
+        with _FLIGHTS_LOCK:
+            del _FLIGHTS[key]
+        flight.done.set()
+    return result
+
+
+
+async def async_single_flight(key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+    """Asynchronous version of `single_flight()`, sharing the result of
+    `await func()` with the concurrent tasks of the running event loop using
+    the same `key`."""
+    loop = asyncio.get_running_loop()
+    future = _TASKS.get((loop, key))
+    if future is not None:
+        # Cancelling a waiting task must not cancel the flight
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), DGEQ_COALESCE_TIMEOUT)
+        except asyncio.TimeoutError:
+            result = None
+        if result is None:
+            return await func()
+        return copy.deepcopy(result)
+    
+    future = _TASKS[(loop, key)] = loop.create_future()
+    result = snapshot = None
+    try:
+        result = await func()
+        snapshot = copy.deepcopy(result)
+    finally:
+        del _TASKS[(loop, key)]
+        future.set_result(snapshot)
+    return result
+
+
+
+def cache_flight(key: str, func: Callable[[], Any]) -> Any:
+    """Return the result of `func()`, sharing it with the other processes
+    using the same `key` through the cache `DGEQ_COALESCE_CACHE`.
+    
+    The first process adds a lock to the cache, executes `func()`, then stores
+    the result of this flight until `DGEQ_COALESCE_TIMEOUT`. Other processes
+    finding the lock poll the cache for this result, and execute `func()`
+    themselves if the lock disappears without result (or after
+    `DGEQ_COALESCE_TIMEOUT`). Results must be picklable."""
+    cache = caches[DGEQ_COALESCE_CACHE]
+    lock = f"{PREFIX}:{key}"
+    token = uuid.uuid4().hex
+    if cache.add(lock, token, DGEQ_COALESCE_TIMEOUT):
+        try:
+            result = func()
+            cache.set(f"{lock}:{token}", result, DGEQ_COALESCE_TIMEOUT)
+        finally:
+            cache.delete(lock)
+        return result
+    
+    leader = cache.get(lock)
+    deadline = time.monotonic() + DGEQ_COALESCE_TIMEOUT
+    while leader is not None and time.monotonic() < deadline:
+        # The lock is read first, the result being stored before its removal
+        current = cache.get(lock)
+        result = cache.get(f"{lock}:{leader}")
+        if result is not None:
+            return result
+        if current != leader:
+            break
+        time.sleep(POLL_INTERVAL)
+    
+    return func()
@@ -0,0 +1,510 @@
+import array
+import itertools
+import operator
+import statistics
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TYPE_CHECKING, Type, Union
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import utils, versions
+from .aggregations import Aggregation, Percentile, interpolate
+from .commands import Aggregate, Case, Command, Count, Evaluate, Filtering, Show, Sort, Time
+from .exceptions import InvalidCommandError
+from .filter import DGEQ_EXCLUDE_SEARCH_MODIFIER, Filter
+from .memory import compile_filter
+
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+if TYPE_CHECKING:
+    from .dgeq import GenericQuery
+
+# List of models (or their dotted path / label) whose columns are kept in
+# memory. `c:count` and `c:aggregate` on these models are computed from the
+# columns when the query only contains filters on the fields of the model,
+# `c:sort`, `c:show`, `c:hide`, `c:case`, `c:time` and `c:evaluate`.
+DGEQ_COLUMNAR_TABLES = getattr(settings, "DGEQ_COLUMNAR_TABLES", [])
+
+# Type code of the `array` storing the values of numeric fields
+TYPECODES = (
+    (models.FloatField, "d"),
+    (models.IntegerField, "q"),
+)
+
+# Lookups on numeric columns vectorized with numpy
+VECTORIZED_LOOKUPS = {
+    "exact": operator.eq,
+    "gt":    operator.gt,
+    "gte":   operator.ge,
+    "lt":    operator.lt,
+    "lte":   operator.le,
+}
+
+# Aggregations computed on the non-null values of a column, either in pure
+# Python or with numpy (see `_function()`). Results match the functions
+# registered by django on SQLite.
+FUNCTIONS = {
+    "count":      (lambda v, a: len(v), lambda v, a: len(v)),
+    "dcount":     (lambda v, a: len(set(v)), lambda v, a: len(numpy.unique(v))),
+    "max":        (lambda v, a: max(v), lambda v, a: v.max()),
+    "min":        (lambda v, a: min(v), lambda v, a: v.min()),
+    "sum":        (lambda v, a: sum(v), lambda v, a: v.sum()),
+    "avg":        (lambda v, a: sum(v) / len(v), lambda v, a: int(v.sum()) / len(v)
+                   if v.dtype.kind == "i" else float(v.mean())),
+    "stddev":     (lambda v, a: statistics.pstdev(v), lambda v, a: float(v.std())),
+    "var":        (lambda v, a: statistics.pvariance(v), lambda v, a: float(v.var())),
+    "percentile": (lambda v, a: interpolate(sorted(v), a.percentile),
+                   lambda v, a: float(numpy.quantile(v, a.percentile))),
+}
+
+# Columnar tables already built, by model
+_TABLES: Dict[Type[models.Model], 'ColumnarTable'] = dict()
+_TABLES_LOCK = threading.Lock()
+
+Bitmap = bytearray
+
+
+
+def _and(*bitmaps: Bitmap) -> Bitmap:
+    """Return the intersection of `bitmaps`.
+    
+    Bitmaps may have different lengths if rows were added in the meantime,
+    the result is then truncated to the shortest one."""
+    length = min(len(b) for b in bitmaps)
+    if numpy is not None and length:
+        result = numpy.frombuffer(bitmaps[0], dtype=bool, count=length).copy()
+        for b in bitmaps[1:]:
+            result &= numpy.frombuffer(b, dtype=bool, count=length)
+        return bytearray(result.tobytes())
+    return bytearray(map(all, zip(*bitmaps)))
+
+
+
+def _function(aggregate: models.Aggregate) -> Optional[str]:
+    """Return the name of the function of `aggregate` in `FUNCTIONS`, `None`
+    if it is not supported."""
+    if isinstance(aggregate, models.Count):
+        return "dcount" if aggregate.distinct else "count"
+    if isinstance(aggregate, Percentile):
+        return "percentile"
+    for cls, name in ((models.Max, "max"), (models.Min, "min"), (models.Sum, "sum"),
+                      (models.Avg, "avg")):
+        if isinstance(aggregate, cls):
+            return name
+    if isinstance(aggregate, models.StdDev) and aggregate.function == "STDDEV_POP":
+        return "stddev"
+    if isinstance(aggregate, models.Variance) and aggregate.function == "VAR_POP":
+        return "var"
+    return None
+
+
+
+class Column:
+    """Values of a field for every row of a `ColumnarTable`.
+    
+    Values of integer and float fields are stored in an `array` (with `0` in
+    place of nulls, recorded in the `nulls` bitmap), other values in a `list`.
+    
+    Fields:
+        * `field` (`models.Field`) - Field of the column.
+        * `typecode` (`Optional[str]`) - Type code of the `array`, `None` if the
+                column is not numeric.
+        * `data` (`Union[array.array, list]`) - Values of the column.
+        * `nulls` (`Optional[Bitmap]`) - Rows where the value is null, `None`
+                if the column is not numeric.
+    """
+    
+    
+    def __init__(self, field: models.Field, values: Iterable[Any]):
+        self.field = field
+        self.typecode = next((t for c, t in TYPECODES if isinstance(field, c)), None)
+        if self.typecode is None:
+            self.data = list(values)
+            self.nulls = None
+        else:
+            values = list(values)
+            self.data = array.array(self.typecode, (0 if v is None else v for v in values))
+            self.nulls = bytearray(v is None for v in values)
+    
+    
+    @property
+    def numeric(self) -> bool:
+        return self.typecode is not None
+    
+    
+    def append(self, value: Any):
+        if self.numeric:
+            self.nulls.append(value is None)
+            value = 0 if value is None else value
+        self.data.append(value)
+    
+    
+    def __setitem__(self, i: int, value: Any):
+        if self.numeric:
+            self.nulls[i] = value is None
+            value = 0 if value is None else value
+        self.data[i] = value
+    
+    
+    def values(self) -> Iterator[Any]:
+        """Iterate over the values of the column, with `None` for nulls."""
+        if not self.numeric:
+            return iter(self.data)
+        return (None if n else v for v, n in zip(self.data, self.nulls))
+    
+    
+    def select(self, bitmap: Bitmap) -> Union[list, 'numpy.ndarray']:
+        """Return the non-null values of the rows set in `bitmap`, as a numpy
+        array if numpy is installed and the column is numeric."""
+        if numpy is not None and self.numeric and len(bitmap):
+            length = min(len(bitmap), len(self.data))
+            view = numpy.frombuffer(self.data, dtype=self.typecode, count=length)
+            mask = numpy.frombuffer(bitmap, dtype=bool, count=length)
+            mask = mask & ~numpy.frombuffer(self.nulls, dtype=bool, count=length)
+            return view[mask]
+        return [v for v in itertools.compress(self.values(), bitmap) if v is not None]
+    
+    
+    def vectorized(self, f: Filter) -> Optional[Bitmap]:
+        """Compute the bitmap of the rows matching `f` with numpy, return
+        `None` if `f` cannot be vectorized."""
+        if numpy is None or not self.numeric or f.date_part is not None or not len(self.data):
+            return None
+        
+        lookup = f.lookup()
+        view = numpy.frombuffer(self.data, dtype=self.typecode)
+        nulls = numpy.frombuffer(self.nulls, dtype=bool)
+        if f.value is None:
+            result = nulls.copy()
+        elif lookup == "in" and all(isinstance(v, (int, float)) for v in f.value):
+            result = numpy.isin(view, f.value) & ~nulls
+        elif lookup in VECTORIZED_LOOKUPS and isinstance(f.value, (int, float)):
+            result = VECTORIZED_LOOKUPS[lookup](view, f.value) & ~nulls
+        else:
+            return None
+        
+        # Excluded rows include rows where the field is null, the same way as
+        # django's `exclude()`
+        if f.modifier in DGEQ_EXCLUDE_SEARCH_MODIFIER:
+            result = ~result
+        return bytearray(result.tobytes())
+
+
+
+class ColumnarTable:
+    """Columns of the concrete fields of a model, used to compute counts and
+    aggregations without querying the database.
+    
+    Filters are compiled into bitmaps (a `bytearray` containing `1` for every
+    matching row) which are then intersected. Numeric columns are processed
+    with numpy if it is installed, in pure Python otherwise.
+    
+    The table is kept up to date once the transactions saving or deleting
+    rows of the model (`post_save` and `post_delete` signals) are committed:
+    saved rows are reloaded, deleted rows are unset in `alive`. Changes made by
+    other processes are detected through the version of the model (see
+    `versions.Stamp`), the table is then built again on its next use.
+    
+    Fields:
+        * `model` (`Type[models.Model]`) - Model of the rows.
+        * `columns` (`Dict[str, Column]`) - Columns, by name of their field.
+        * `alive` (`Bitmap`) - Rows which have not been deleted.
+        * `stamp` (`versions.Stamp`) - Version of the rows loaded.
+    """
+    
+    
+    def __init__(self, model: Type[models.Model]):
+        self.model = model
+        self._lock = threading.RLock()
+        self._fields = list(model._meta.concrete_fields)
+        self.stamp = versions.Stamp(model)
+        
+        rows = list(model._default_manager.values_list(*[f.attname for f in self._fields]))
+        self.columns = {
+            f.name: Column(f, (r[i] for r in rows)) for i, f in enumerate(self._fields)
+        }
+        pk = model._meta.pk.name
+        self._positions = {pk: i for i, pk in enumerate(self.columns[pk].values())}
+        self.alive = bytearray(b"\x01" * len(rows))
+    
+    
+    def __len__(self):
+        return self.alive.count(1)
+    
+    
+    def update(self, pk: Any):
+        """Reload the row `pk` from the database."""
+        row = self.model._default_manager.filter(pk=pk).values_list(
+            *[f.attname for f in self._fields]
+        ).first()
+        if row is None:
+            return self.delete(pk)
+        
+        with self._lock:
+            position = self._positions.get(pk)
+            if position is None:
+                self._positions[pk] = len(self.alive)
+                self.alive.append(1)
+                for f, value in zip(self._fields, row):
+                    self.columns[f.name].append(value)
+            else:
+                for f, value in zip(self._fields, row):
+                    self.columns[f.name][position] = value
+            self.stamp.advance()
+    
+    
+    def delete(self, pk: Any):
+        """Remove the row `pk`."""
+        with self._lock:
+            position = self._positions.pop(pk, None)
+            if position is not None:
+                self.alive[position] = 0
+            self.stamp.advance()
+    
+    
+    def bitmap(self, f: Filter) -> Optional[Bitmap]:
+        """Return the bitmap of the rows matching `f`, `None` if `f` cannot be
+        evaluated on the columns."""
+        if f.full_text or f.field not in self.columns:
+            return None
+        
+        column = self.columns[f.field]
+        with self._lock:
+            result = column.vectorized(f)
+            if result is not None:
+                return result
+            
+            # Pattern lookups on strings are left to the database, whose case
+            # handling and collation may differ from Python's
+            matches = compile_filter(f)
+            if matches is None:
+                return None
+            return bytearray(map(matches, column.values()))
+    
+    
+    def count(self, bitmap: Bitmap) -> int:
+        """Return the number of rows set in `bitmap`."""
+        return bitmap.count(1)
+    
+    
+    def aggregate(self, aggregations: Iterable[Aggregation],
+                  bitmap: Bitmap) -> Optional[Dict[str, Any]]:
+        """Compute `aggregations` on the rows set in `bitmap`, return `None` if
+        any of them cannot be computed on the columns."""
+        result = dict()
+        with self._lock:
+            for a in aggregations:
+                column = self.columns.get(a.field)
+                if column is None:
+                    return None
+                
+                bitmaps = [bitmap]
+                for f in a.filters:
+                    bitmaps.append(self.bitmap(f))
+                    if bitmaps[-1] is None:
+                        return None
+                
+                values = column.select(_and(*bitmaps) if len(bitmaps) > 1 else bitmap)
+                value = self._compute(a.func(a.field), column, values)
+                if value is ...:
+                    return None
+                result[a.to] = value
+        
+        return result
+    
+    
+    @staticmethod
+    def _compute(aggregate: models.Aggregate, column: Column, values: Any) -> Any:
+        """Compute `aggregate` on the non-null `values` of `column`, return
+        `...` if `aggregate` is not supported."""
+        name = _function(aggregate)
+        if name is None or (name not in ("count", "dcount") and not column.numeric):
+            return ...
+        if not len(values) and name not in ("count", "dcount"):
+            return None
+        
+        python, vectorized = FUNCTIONS[name]
+        if isinstance(values, list):
+            value = python(values, aggregate)
+        else:
+            value = vectorized(values, aggregate)
+        
+        if name in ("max", "min", "sum"):
+            value = int(value) if column.typecode == "q" else float(value)
+        return value
+
+
+
+def get_table(model: Type[models.Model]) -> Optional[ColumnarTable]:
+    """Return the columnar table of `model` if it is declared in
+    `DGEQ_COLUMNAR_TABLES`, `None` otherwise.
+    
+    The table is built on the first call for a given model, and built again
+    once it is outdated (see `versions.Stamp.fresh()`)."""
+    if not utils.get_model_setting({m: True for m in DGEQ_COLUMNAR_TABLES}, model, False):
+        return None
+    
+    table = _TABLES.get(model)
+    if table is None or not table.stamp.fresh():
+        with _TABLES_LOCK:
+            if _TABLES.get(model) is table:
+                _TABLES[model] = ColumnarTable(model)
+            table = _TABLES[model]
+    
+    return table
+
+
+
+def invalidate(model: Type[models.Model] = None):
+    """Drop the columnar table of `model` (or every table if `model` is
+    `None`), it will be built again on its next use."""
+    with _TABLES_LOCK:
+        for m in [model] if model is not None else list(_TABLES):
+            _TABLES.pop(m, None)
+
+
+
+def _on_change(sender: Type[models.Model], instance: models.Model, using: str,
+               deleted: bool):
+    if not utils.get_model_setting({m: True for m in DGEQ_COLUMNAR_TABLES}, sender, False):
+        return
+    
+    pk = instance.pk
+    
+    def apply():
+        table = _TABLES.get(sender)
+        if table is None:
+            versions.increment(sender)
+        elif deleted:
+            table.delete(pk)
+        else:
+            table.update(pk)
+    
+    transaction.on_commit(apply, using=using)
+
+
+
+def _on_save(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    _on_change(sender, instance, using, False)
+
+
+
+def _on_delete(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    _on_change(sender, instance, using, True)
+
+
+
+post_save.connect(_on_save, dispatch_uid="dgeq_columnar_post_save")
+post_delete.connect(_on_delete, dispatch_uid="dgeq_columnar_post_delete")
+
+
+
+class ColumnarCommand(Command):
+    """Wrap a command to also evaluate it on the columnar table of the query.
+    
+    Fields:
+        * `command` (`Command`) - Wrapped command.
+    """
+    
+    
+    def __init__(self, command: Command):
+        self.command = command
+        self.regex = command.regex
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        self.command(query, field, values)
+
+
+
+class ColumnarFiltering(ColumnarCommand):
+    """Compute the bitmap of the rows matching the filters, see `Filtering`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        self.command(query, field, values)
+        if query.columnar is None:
+            return
+        
+        target = utils.target_field(field, query.model, query.arbitrary_fields)
+        bitmaps = [
+            query.columnar.bitmap(Filter(field, v, query.case, target))
+            for v in utils.split_list_values(values)
+        ]
+        if any(b is None for b in bitmaps):
+            query.columnar = None
+            return
+        
+        query.columnar_bitmap = _and(query.columnar_bitmap, *bitmaps)
+
+
+
+class ColumnarAggregate(ColumnarCommand):
+    """Compute the aggregations from the columns, see `Aggregate`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if query.group_by:
+            query.columnar = None
+            return self.command(query, field, values)
+        
+        aggregations = [
+            Aggregation.from_query_value(
+                a, query.model, query.censor, query.arbitrary_fields, query.case
+            )
+            for a in utils.split_list_values(values)
+        ]
+        result = query.columnar.aggregate(aggregations, query.columnar_bitmap)
+        if result is None:
+            query.columnar = None
+            return self.command(query, field, values)
+        
+        query.result = {**query.result, **result}
+
+
+
+class ColumnarCount(ColumnarCommand):
+    """Count the rows from the columns, see `Count`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if not values[-1].isdigit():
+            raise InvalidCommandError(
+                "c:count", f"value must be either 0 or 1 (received '{values[-1]}')"
+            )
+        
+        if int(values[-1]):
+            query.result['count'] = query.columnar.count(query.columnar_bitmap)
+
+
+# Commands wrapped when a columnar table is used. Commands in
+# `COLUMNAR_SAFE_COMMANDS` do not change the counts nor the aggregations and
+# are used as is. Any other command makes the query fall back to the database.
+COLUMNAR_COMMANDS = (
+    (Filtering, ColumnarFiltering),
+    (Aggregate, ColumnarAggregate),
+    (Count, ColumnarCount),
+)
+COLUMNAR_SAFE_COMMANDS = (Case, Evaluate, Show, Sort, Time)
+
+
+
+def columnar_command(query: 'GenericQuery', command: Command) -> Command:
+    """Return the command to use in place of `command` to use the columnar
+    table of `query`.
+    
+    If `command` cannot be evaluated on the columns, the query falls back to
+    the database (`query.columnar` is set to `None`) and `command` is
+    returned."""
+    for cls, wrapper in COLUMNAR_COMMANDS:
+        if isinstance(command, cls):
+            return wrapper(command)
+    if not isinstance(command, COLUMNAR_SAFE_COMMANDS):
+        query.columnar = None
+    return command
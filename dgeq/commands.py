@@ -1,20 +1,89 @@
+import math
+import random
 from abc import ABC, abstractmethod
-from typing import List, TYPE_CHECKING
+from typing import Dict, List, Optional, TYPE_CHECKING
 
 from django.conf import settings
-from django.db.models import Q
+from django.db import connections, models
+from django.db.models import F, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
 
 from . import utils
-from .aggregations import Aggregation, Annotation
+from .aggregations import (Aggregation, Annotation, Buckets, Percentile, Periods,
+                           WindowAnnotation, _check_to)
+from .computations import Computation
 from .exceptions import InvalidCommandError
 from .filter import Filter
 from .joins import JoinQuery
+from .maintained import stored_annotation
+from .search import Relevance, fts_built
 
 
 if TYPE_CHECKING:
     from .dgeq import GenericQuery
 
 
+def check_groupable(query: 'GenericQuery', command: str):
+    """Raise `InvalidCommandError` if the rows of `query` cannot be grouped."""
+    if query.sliced:
+        raise InvalidCommandError(command, "cannot be used after 'c:start' or 'c:limit'")
+    
+    # Values would be grouped according to the existing `GROUP BY` if one has
+    # already been created by an aggregate
+    if query.queryset.query.group_by is not None:
+        raise InvalidCommandError(
+            command, "cannot be used after an aggregation ('c:annotate' or 'c:aggregate')"
+        )
+
+
+
+def group(query: 'GenericQuery', groups: Dict[str, str]):
+    """Group the rows of `query` by the given fields, in addition to the
+    existing groups.
+    
+    `groups` maps the lookup of the fields to their name in the resulting
+    rows."""
+    query.group_by.update(groups)
+    query.queryset = query.queryset.values(*query.group_by).order_by(*query.group_by)
+
+
+
+def semi_join(query: 'GenericQuery', filters: Q) -> models.Exists:
+    """Return a correlated `EXISTS` subquery matching the rows of `query` for
+    which `filters` hold.
+    
+    Filtering on a list of related models joins their table, duplicating the
+    rows matching more than once. Using the subquery instead keeps each row at
+    most once, with the same semantics since every condition of `filters` is
+    still applied in a single call to `filter()`."""
+    return models.Exists(
+        query.model._default_manager.filter(pk=OuterRef("pk")).filter(filters)
+    )
+
+
+
+def check_full_text(query: 'GenericQuery', command: str, f: Filter):
+    """Raise `InvalidCommandError` if `f` is a full-text search on SQLite and
+    the FTS5 shadow table of its model has not been built.
+    
+    Raise `SearchModifierError` if full-text search is not enabled on the
+    targeted field (E.G. a field created by a command)."""
+    if not f.full_text:
+        return
+    f.lookup()
+    
+    connection = connections[query.queryset.db]
+    if (connection.vendor == "sqlite"
+            and not fts_built(f.target.model, connection)):
+        raise InvalidCommandError(
+            command,
+            f"full-text index of '{f.target.model._meta.label}' has not been built, run "
+            f"'manage.py dgeq_fulltext'"
+        )
+
+
+
 class Command(ABC):
     """Interface for commands."""
     regex = None
@@ -41,6 +110,9 @@ class Annotate(Command):
         support search modifiers.
     * `delayed` (`delayed=1`) - Whether the annotation will be applied before
         (`0`) or after (`1`) the filtering of the main query. Default is `0`.|
+    * `strategy` (`strategy=subquery`) - Either `join` to compute the
+        annotation by joining the related table, or `subquery` to compute it in
+        a correlated subquery.
     
     You can declare multiple annotation using a comma `,` or with multiple
     declaration of `c:annotate`. Each annotation's `to` must be unique.
@@ -61,6 +133,17 @@ class Annotate(Command):
     `Sort`, `Show` and even `Aggregate`. They can also be used in filters,
     making it possible to filter on rivers average length for instance.
     
+    When no `strategy` is given, annotations on a list of related models use
+    a subquery if another annotation on a list of related models is joined,
+    since joining both would compute them over the cartesian product of their
+    rows. Other annotations use a join. Annotations using fields created by
+    other commands (e.g. `c:compute`) cannot use a subquery, which does not
+    have these fields.
+    
+    Unless the rows are grouped, annotations matching one of the
+    `DGEQ_MAINTAINED_ANNOTATIONS` of the model read the stored value instead
+    of computing it, their `strategy` is then set to `"stored"`.
+    
     Created annotation will be appended to `query.annotations`.
     
     Also append the field use by annotation to `query.arbitrary_fields`. See
@@ -70,16 +153,54 @@ class Annotate(Command):
     
     
     def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
-        annotations = utils.split_list_values(values)
-        
-        query.annotations = list()
-        
-        for a in annotations:
+        annotations = list()
+        stored = dict()
+        for a in utils.split_list_values(values):
             a = Annotation.from_query_value(
                 a, query.model, query.case, query.censor, query.arbitrary_fields
             )
+            annotations.append((a, a.spans_many(query.model, query.arbitrary_fields)))
             query.arbitrary_fields.add(a.to)
-            query.queryset = a.apply(query.queryset)
+            
+            expression = (
+                None if query.group_by else stored_annotation(query.model, a, query.queryset)
+            )
+            if expression is not None:
+                stored[a.to] = expression
+                a.strategy = "stored"
+        
+        # Joining more than one list of related models would compute the
+        # annotations over their cartesian product, use subqueries instead.
+        many = sum(
+            a.spans_many(query.model, query.arbitrary_fields)
+            and a.strategy not in ("subquery", "stored")
+            for a in [*query.annotations, *(a for a, _ in annotations)]
+        )
+        for a, spans_many in annotations:
+            if a.strategy is None:
+                a.strategy = (
+                    "subquery" if spans_many and many > 1 and not a.arbitrary else "join"
+                )
+        
+        # Annotations using fields created by other commands must be joined
+        joined = [
+            a for a in [*query.annotations, *(a for a, _ in annotations)]
+            if a.strategy == "join" and a.spans_many(query.model, query.arbitrary_fields)
+        ]
+        if len(joined) > 1 and any(a.arbitrary for a in joined):
+            raise InvalidCommandError(
+                "c:annotate",
+                f"cannot join more than one list of related models ('{joined[0].to}' and "
+                f"'{joined[1].to}'), and annotations using fields created by other commands "
+                f"cannot be computed in a subquery"
+            )
+        
+        for a, _ in annotations:
+            if a.strategy == "stored":
+                query.queryset = query.queryset.annotate(**{a.to: stored[a.to]})
+            else:
+                query.queryset = a.apply(query.queryset)
+            query.annotations.append(a)
 
 
 
@@ -95,9 +216,21 @@ class Aggregate(Command):
         aggregation will be displayed.|
     * `func` (`func=avg`) - Function to use for the aggregation. Value must be
         key of `DGEQ_DGEQ_AGGREGATION_FUNCTION` dictionary.
+    * `filters` (`filters=rivers.length=>2000`) - Allow to add an apostrophe
+        `'` separated list of filters restricting the rows used by this
+        aggregation only. These filters support search modifiers.
     
     You can declare multiple aggregation using a comma `,` or with multiple
-    declaration of `c:aggregate`. Each aggregation's `to` must be unique."""
+    declaration of `c:aggregate`. Each aggregation's `to` must be unique.
+    
+    Every aggregation is computed in a single query, so using `filters` allow
+    to compute multiple conditional aggregations at once. Percentiles are the
+    exception on databases not computing them natively (see `Percentile`),
+    they then need two queries each.
+    
+    If the rows have been grouped with `c:group`, aggregations are computed
+    for each group instead, and their `to` are appended to
+    `query.arbitrary_fields` so that they can be used in other commands."""
     
     regex = "^c:aggregate$"
     
@@ -106,14 +239,36 @@ class Aggregate(Command):
         aggregations = utils.split_list_values(values)
         aggregations = [
             Aggregation.from_query_value(
-                a, query.model, query.censor, query.arbitrary_fields
+                a, query.model, query.censor, query.arbitrary_fields, query.case
             ).get()
             for a in aggregations
         ]
         
+        # Percentiles not supported by the database are computed separately
+        connection = connections[query.queryset.db]
+        offsets = dict(
+            (to, a) for to, a in aggregations
+            if isinstance(a, Percentile) and not a.native(connection)
+        )
+        
+        if query.group_by:
+            if query.sliced:
+                raise InvalidCommandError(
+                    "c:aggregate", "cannot be used on groups after 'c:start' or 'c:limit'"
+                )
+            if offsets:
+                raise InvalidCommandError(
+                    "c:aggregate", "percentiles cannot be computed on groups with this database"
+                )
+            query.queryset = query.queryset.annotate(**dict(aggregations))
+            query.arbitrary_fields |= {to for to, _ in aggregations}
+            return
+        
+        aggregations = [(to, a) for to, a in aggregations if to not in offsets]
         query.result = {
             **query.result,
-            **query.queryset.aggregate(**dict(aggregations)),
+            **(query.queryset.aggregate(**dict(aggregations)) if aggregations else {}),
+            **{to: a.sorted_offset(query.queryset) for to, a in offsets.items()},
         }
 
 
@@ -136,6 +291,47 @@ class Case(Command):
 
 
 
+class Compute(Command):
+    """Create fields computed from arithmetic expressions by parsing query's
+    `c:compute` value.
+    
+    Computations are made up of key value pairs delimited by a pipe `|`:
+    `key:value|key:value`. Valid keys are :
+    
+    * `to` (`to=density`) - Name of the field where the result of the
+        computation will be displayed.
+    * `expr` (`expr=population/area`) - Arithmetic expression computing the
+        field. Can contain numbers, numeric fields (dot `.` notation can be used
+        for related fields), `+`, `-`, `*`, `/` and parentheses.
+    
+    You can declare multiple computations using a comma `,` or with multiple
+    declaration of `c:compute`. Each computation's `to` must be unique.
+    
+    Computations are done by the database. The field created by `to` is
+    appended to `query.arbitrary_fields`, and can thus be used in other
+    commands, such as `Sort`, `Show` or in filters."""
+    
+    regex = "^c:compute$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        for c in utils.split_list_values(values):
+            c = Computation.from_query_value(
+                c, query.model, query.censor, query.arbitrary_fields
+            )
+            # Computing from a field that is not part of the groups would split
+            # them
+            if query.group_by:
+                for f in c.fields:
+                    if f not in {*query.group_by.values(), *query.arbitrary_fields}:
+                        raise InvalidCommandError(
+                            "c:compute", f"cannot compute on a non-grouping field ('{f}')"
+                        )
+            query.arbitrary_fields.add(c.to)
+            query.queryset = c.apply(query.queryset)
+
+
+
 class Count(Command):
     """Add the number of object in the database matching the query.
     
@@ -200,6 +396,145 @@ class Evaluate(Command):
 
 
 
+class Exists(Command):
+    """Only keep the rows having (`c:exists`) or not having (`c:notexists`)
+    related rows matching some filters.
+    
+    Value must be a comma separated list of conditions. Each condition is
+    either the path to the related models (dot `.` notation can be used), or
+    key value pairs delimited by a pipe `|` : `key:value|key:value`. Valid keys
+    are :
+    
+    * `path` (`path=rivers`) - Path to the related models.
+    * `filters` (`filters=length=>5000'discharge=>10000`) - Apostrophe `'`
+        separated list of filters that a single related row must match. Fields
+        are relative to the related model, and filters support search
+        modifiers.
+    
+    Each condition is compiled into a correlated `EXISTS` subquery, so that
+    the whole query is done in a single SQL statement without duplicating
+    rows. Conditions are combined with a logical `AND`."""
+    
+    regex = "^c:(not)?exists$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        command = field
+        if query.sliced:
+            raise InvalidCommandError(command, "cannot be used after 'c:start' or 'c:limit'")
+        
+        for condition in utils.split_list_values(values):
+            if "=" not in condition:
+                path, filters = condition, []
+            else:
+                try:
+                    query_dict = utils.subquery_to_querydict(condition)
+                except ValueError as e:
+                    raise InvalidCommandError(command, str(e))
+                if "path" not in query_dict:
+                    raise InvalidCommandError(command, "'path' argument is missing")
+                path = query_dict["path"]
+                filters = utils.split_list_values(query_dict.getlist("filters"), "'")
+            
+            second_last_model, last_field_name = utils.check_field(
+                path, query.model, query.censor
+            )
+            if not utils.get_field(last_field_name, second_last_model).is_relation:
+                raise InvalidCommandError(command, f"'{path}' is not a related model")
+            
+            # Filters are given relative to the related model, prefix them with
+            # the path so that the censor is checked along the whole path.
+            conditions = Q(**{f"{path.replace('.', '__')}__isnull": False})
+            for f in filters:
+                kwarg = f.split("=", 1)
+                if len(kwarg) < 2:
+                    raise InvalidCommandError(
+                        command, f"Filters must contains an equal '=', received '{kwarg[0]}'"
+                    )
+                k, v = kwarg
+                utils.check_field(f"{path}.{k}", query.model, query.censor)
+                target = utils.target_field(f"{path}.{k}", query.model)
+                conditions &= Filter(f"{path}.{k}", v, query.case, target).get()
+            
+            # Every condition is in the same call to `filter()` so that they
+            # apply to the same related row.
+            exists = semi_join(query, conditions)
+            query.queryset = query.queryset.filter(~exists if command == "c:notexists" else exists)
+
+
+
+class Facet(Command):
+    """Add the most common values of the provided fields, and their number of
+    occurrences, to the key `facets` of the result.
+    
+    Value must be a comma separated list of facets. Each facet is either the
+    name of a field (dot `.` notation can be used for related fields), or key
+    value pairs delimited by a pipe `|` : `key:value|key:value`. Valid keys
+    are :
+    
+    * `field` (`field=country.region.name`) - Name of the field.
+    * `limit` (`limit=5`) - Maximum number of values returned for this facet,
+        default to `DGEQ_FACET_LIMIT`.
+    
+    Facets are computed on the rows matching the filters given before
+    `c:facet`, using one `GROUP BY` query per facet. Values are sorted by
+    descending count."""
+    
+    regex = "^c:facet$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        from .constants import DGEQ_FACET_LIMIT, DGEQ_MAX_LIMIT
+        
+        if query.sliced:
+            raise InvalidCommandError(
+                "c:facet", "cannot be used after 'c:start' or 'c:limit'"
+            )
+        if query.group_by:
+            raise InvalidCommandError("c:facet", "cannot be used after 'c:group'")
+        
+        facets = list()
+        for f in utils.split_list_values(values):
+            if "=" not in f:
+                facet_field, limit = f, str(DGEQ_FACET_LIMIT)
+            else:
+                try:
+                    query_dict = utils.subquery_to_querydict(f)
+                except ValueError as e:
+                    raise InvalidCommandError("c:facet", str(e))
+                if "field" not in query_dict:
+                    raise InvalidCommandError("c:facet", "'field' argument is missing")
+                facet_field = query_dict["field"]
+                limit = query_dict.get("limit", str(DGEQ_FACET_LIMIT))
+            
+            if not limit.isdigit() or not int(limit):
+                raise InvalidCommandError(
+                    "c:facet", f"'limit' value must be a positive integer (received '{limit}')"
+                )
+            if DGEQ_MAX_LIMIT and int(limit) > DGEQ_MAX_LIMIT:
+                raise InvalidCommandError(
+                    "c:facet",
+                    f"'limit' value cannot be higher than '{DGEQ_MAX_LIMIT}' (received '{limit}')"
+                )
+            utils.check_field(facet_field, query.model, query.censor, query.arbitrary_fields)
+            facets.append((facet_field, int(limit)))
+        
+        # Every facet share the same filtered queryset, without its ordering
+        # which is useless for counting values.
+        base = query.queryset.order_by()
+        result = query.result.setdefault("facets", dict())
+        for facet_field, limit in facets:
+            lookup = facet_field.replace(".", "__")
+            counts = (
+                base.values(lookup)
+                .annotate(_dgeq_count=models.Count("pk", distinct=True))
+                .order_by("-_dgeq_count", lookup)
+                .values_list(lookup, "_dgeq_count")
+            )
+            result[facet_field] = [{"value": v, "count": c} for v, c in counts[:limit]]
+
+
+
 class Filtering(Command):
     """Apply filters on the query by looking at every query's field not starting
     with `c:`.
@@ -240,6 +575,10 @@ class Filtering(Command):
     * `$` (`country/?name=$Islands`) - Ends with a string.
     * `*` (`country/?name=*istan`) - Contains a string.
     * `~` (`country/?name=~z`) - Do not contain a string.
+    * `@` (`country/?id=@1;5;42`) - Equal to any value of the semicolon `;`
+            separated list.
+    * `:` (`disaster/?comment=:flood damage`) - Contains every word, using the
+            full-text search engine of the database.
     
     To combine search modifier, either use the comma `,` :
     `country/?population=[4700000,]4800000`, or create another `field=value`
@@ -250,7 +589,15 @@ class Filtering(Command):
     `States` :
     
     * `country/?name=^United,~States` or `country/?name=^United&name=~States`
-
+    
+    Filters on a list of related models (e.g. `rivers.length`) are compiled
+    into a correlated `EXISTS` subquery instead of a join, so that rows are
+    never duplicated. Every value given to a same field must then match the
+    same related row.
+    
+    A full-text search on a field also adds a `[field]_relevance` field, which
+    can be used to sort the rows (e.g. `c:sort=-comment_relevance`).
+    
     [1] https://en.wikipedia.org/wiki/ISO_8601
     """
     
@@ -264,12 +611,112 @@ class Filtering(Command):
             )
         
         values = utils.split_list_values(values)
+        utils.check_field(field, query.model, query.censor, query.arbitrary_fields)
+        target = utils.target_field(field, query.model, query.arbitrary_fields)
         filters = Q()
+        full_text = list()
         for v in values:
-            utils.check_field(field, query.model, query.censor, query.arbitrary_fields)
-            filters &= Filter(field, v, query.case).get()
+            f = Filter(field, v, query.case, target)
+            check_full_text(query, field, f)
+            filters &= f.get()
+            if f.full_text:
+                full_text.append(f.value)
         
+        # Databases do not allow window functions in the WHERE clause
+        if isinstance(query.queryset.query.annotations.get(field), models.Window):
+            raise InvalidCommandError(
+                field, "You cannot filter on fields created by 'c:window'"
+            )
+        
+        many = utils.spans_many(field, query.model, query.arbitrary_fields)
+        if many:
+            filters = semi_join(query, filters)
         query.queryset = query.queryset.filter(filters)
+        
+        # Add the relevance of the rows for full-text searches
+        if full_text and not many:
+            to = field.replace(".", "_") + "_relevance"
+            _check_to(field, to, query.model, query.censor, query.arbitrary_fields)
+            query.queryset = query.queryset.annotate(**{
+                to: Relevance(field.replace(".", "__"), " ".join(full_text))
+            })
+            query.arbitrary_fields.add(to)
+
+
+
+class Group(Command):
+    """Group the resulting rows by the fields provided in `c:group`.
+    
+    Value must be a comma separated list of field. Grouping can be done on
+    related field by using dot `.` notation.
+    
+    Once grouped, each row of the result correspond to a group and only
+    contains the grouping fields. Use `c:aggregate` after `c:group` to compute
+    aggregations for each group, the whole computation being done by the
+    database in a single query. `c:sort`, `c:start` and `c:limit` then apply
+    to the groups.
+    
+    Grouping fields are stored in `query.group_by`."""
+    
+    regex = "^c:group$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        check_groupable(query, "c:group")
+        
+        groups = dict()
+        for f in utils.split_list_values(values):
+            utils.check_field(f, query.model, query.censor, query.arbitrary_fields)
+            groups[f.replace(".", "__")] = f
+        
+        group(query, groups)
+
+
+
+class Histogram(Command):
+    """Group the rows into buckets of equal width according to the value of a
+    numeric field.
+    
+    Histograms are made up of key value pairs delimited by a pipe `|`:
+    `key:value|key:value`. Valid keys are :
+    
+    * `field` (`field=population`) - Name of the numeric field.
+    * `buckets` (`buckets=10`) - Number of buckets, default to `10`.
+    * `min` (`min=0`) - Lower bound of the first bucket, default to the
+        minimum value of the field.
+    * `max` (`max=1000000`) - Upper bound of the last bucket, default to the
+        maximum value of the field.
+    * `to` (`to=bucket`) - Name of the field containing the index of the
+        bucket (first bucket is `0`), default to `bucket`.
+    
+    The rows are grouped by bucket as with `c:group`, use `c:aggregate` to
+    compute metrics for each bucket. Bucket are computed by the database.
+    Rows outside of `[min, max]` are ignored.
+    
+    Bounds of the histogram are added to the key `histogram` of the result,
+    so that the range of bucket `i` is `[min + i * width, min + (i+1) * width[`.
+    """
+    
+    regex = "^c:histogram$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        check_groupable(query, "c:histogram")
+        
+        buckets = Buckets.from_query_value(
+            values[-1], query.model, query.censor, query.arbitrary_fields
+        )
+        query.queryset = buckets.apply(query.queryset)
+        query.arbitrary_fields.add(buckets.to)
+        query.result["histogram"] = {
+            "field":   buckets.field.replace("__", "."),
+            "min":     buckets.min,
+            "max":     buckets.max,
+            "width":   buckets.width,
+            "buckets": buckets.buckets,
+        }
+        
+        group(query, {buckets.to: buckets.to})
 
 
 
@@ -330,6 +777,233 @@ class Join(Command):
 
 
 
+class Or(Command):
+    """Apply groups of filters combined with a logical `OR` by looking at
+    query's `c:or` value.
+    
+    Each group is an apostrophe `'` separated list of filters, using the same
+    syntax as `Filtering` (`field=value`, with search modifiers). A row matches
+    a group if it matches at least one of its filters :
+    
+    * `river/?c:or=length=>5000'discharge=>10000`
+    
+    You can declare multiple groups using a comma `,` or with multiple
+    declaration of `c:or`. Groups are combined with each other and with the
+    other filters with a logical `AND`, so that any boolean combination of
+    filters can be expressed in a single query."""
+    
+    regex = "^c:or$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if query.sliced:
+            raise InvalidCommandError("c:or", "cannot be used after 'c:start' or 'c:limit'")
+        
+        filters, many = Q(), False
+        for group in utils.split_list_values(values):
+            alternatives = Q()
+            for f in utils.split_list_values([group], "'"):
+                kwarg = f.split("=", 1)
+                if len(kwarg) < 2:
+                    raise InvalidCommandError(
+                        "c:or", f"Filters must contains an equal '=', received '{kwarg[0]}'"
+                    )
+                k, v = kwarg
+                utils.check_field(k, query.model, query.censor, query.arbitrary_fields)
+                if isinstance(query.queryset.query.annotations.get(k), models.Window):
+                    raise InvalidCommandError(
+                        "c:or", "You cannot filter on fields created by 'c:window'"
+                    )
+                target = utils.target_field(k, query.model, query.arbitrary_fields)
+                f = Filter(k, v, query.case, target)
+                check_full_text(query, "c:or", f)
+                alternatives |= f.get()
+                many |= utils.spans_many(k, query.model, query.arbitrary_fields)
+            filters &= alternatives
+        
+        if many:
+            filters = semi_join(query, filters)
+        query.queryset = query.queryset.filter(filters)
+
+
+
+class Sample(Command):
+    """Only keep a random sample of the rows matching the filters given before
+    `c:sample`.
+    
+    Value is either the size of the sample (`c:sample=N` to keep `N` rows, or
+    `c:sample=N%` to keep about `N` percent of the rows), or key value pairs
+    delimited by a pipe `|` : `key:value|key:value`. Valid keys are :
+    
+    * `size` (`size=100` or `size=5%`) - Size of the sample.
+    * `seed` (`seed=42`) - Seed of the random generator, the same seed returns
+        the same sample as long as the data do not change.
+    
+    Percentages are sampled with `TABLESAMPLE BERNOULLI` on PostgreSQL. Other
+    samples are drawn by probing random primary keys between the smallest and
+    the greatest primary key of the filtered rows, fetched by batches with
+    `IN`. Models with a non-integer primary key are sampled from the list of
+    their primary keys.
+    
+    Since the drawn primary keys are then given to a single `IN`, samples
+    cannot be bigger than `DGEQ_MAX_LIMIT` (or than the maximum number of
+    parameters of a query if `DGEQ_MAX_LIMIT` is `0`), bigger percentages
+    being truncated."""
+    
+    regex = "^c:sample$"
+    
+    # Maximum number of batch of random primary keys probed before returning
+    # a smaller sample.
+    max_rounds = 10
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        from .constants import DGEQ_MAX_LIMIT
+        
+        if query.sliced:
+            raise InvalidCommandError("c:sample", "cannot be used after 'c:start' or 'c:limit'")
+        if query.group_by:
+            raise InvalidCommandError("c:sample", "cannot be used after 'c:group'")
+        
+        if "=" not in values[-1]:
+            size, seed = values[-1], None
+        else:
+            try:
+                query_dict = utils.subquery_to_querydict(values[-1])
+            except ValueError as e:
+                raise InvalidCommandError("c:sample", str(e))
+            if "size" not in query_dict:
+                raise InvalidCommandError("c:sample", "'size' argument is missing")
+            size, seed = query_dict["size"], query_dict.get("seed")
+        
+        if seed is not None and not seed.isdigit():
+            raise InvalidCommandError(
+                "c:sample", f"'seed' value must be a non-negative integer (received '{seed}')"
+            )
+        seed = int(seed) if seed is not None else None
+        
+        if size.endswith("%"):
+            try:
+                percent = float(size[:-1])
+            except ValueError:
+                percent = -1
+            if not 0 < percent <= 100:
+                raise InvalidCommandError(
+                    "c:sample", f"percentage must be in ]0, 100] (received '{size}')"
+                )
+            if connections[query.queryset.db].vendor == "postgresql":
+                query.queryset = self._tablesample(query.queryset, percent, seed)
+                return
+            n = None
+        else:
+            if not size.isdigit() or not int(size):
+                raise InvalidCommandError(
+                    "c:sample", f"size must be a positive integer (received '{size}')"
+                )
+            n, percent = int(size), None
+        
+        maximum = DGEQ_MAX_LIMIT or utils.max_in_size(connections[query.queryset.db])
+        if n is not None and n > maximum:
+            raise InvalidCommandError(
+                "c:sample", f"size cannot be higher than '{maximum}' (received '{size}')"
+            )
+        
+        pks = self._draw(query.queryset, n, percent, random.Random(seed), maximum)
+        query.queryset = query.queryset.filter(pk__in=pks)
+    
+    
+    @staticmethod
+    def _tablesample(queryset: models.QuerySet, percent: float,
+                     seed: int = None) -> models.QuerySet:
+        """Keep about `percent` percent of the rows using `TABLESAMPLE`."""
+        qn = connections[queryset.db].ops.quote_name
+        meta = queryset.model._meta
+        sql = (
+            f"SELECT {qn(meta.pk.column)} FROM {qn(meta.db_table)} "
+            f"TABLESAMPLE BERNOULLI (%s)"
+        )
+        params = [percent]
+        if seed is not None:
+            sql += " REPEATABLE (%s)"
+            params.append(seed)
+        return queryset.filter(pk__in=RawSQL(sql, params))
+    
+    
+    @classmethod
+    def _draw(cls, queryset: models.QuerySet, n: Optional[int], percent: Optional[float],
+              rng: random.Random, maximum: int) -> list:
+        """Draw the primary keys of `n` rows (or `percent` percent of the rows,
+        but no more than `maximum` rows) of `queryset`."""
+        pk = queryset.model._meta.pk
+        pk = pk.target_field if pk.is_relation else pk
+        probable = isinstance(pk, models.IntegerField)
+        
+        stats = {"_dgeq_count": models.Count("pk")}
+        if probable:
+            stats.update(_dgeq_min=models.Min("pk"), _dgeq_max=models.Max("pk"))
+        stats = queryset.order_by().aggregate(**stats)
+        count = stats["_dgeq_count"]
+        if percent is not None:
+            n = min(round(count * percent / 100), maximum)
+        if not n or not count:
+            return []
+        
+        # Probing is only worth it if it costs less than listing every
+        # primary key.
+        if probable:
+            span = stats["_dgeq_max"] - stats["_dgeq_min"] + 1
+            if n * span / count < count:
+                return cls._probe(queryset, n, stats["_dgeq_min"], stats["_dgeq_max"], count, rng)
+        
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+        return rng.sample(pks, min(n, len(pks)))
+    
+    
+    @classmethod
+    def _probe(cls, queryset: models.QuerySet, n: int, low: int, high: int, count: int,
+               rng: random.Random) -> List[int]:
+        """Draw up to `n` primary keys of `queryset` by probing random primary
+        keys between `low` and `high`."""
+        chunk = utils.max_in_size(connections[queryset.db])
+        
+        span = high - low + 1
+        found, probed = list(), set()
+        for _ in range(cls.max_rounds):
+            remaining = n - len(found)
+            candidates = span - len(probed)
+            if remaining <= 0 or candidates <= 0:
+                break
+            
+            # Draw enough new primary keys to find the remaining rows given the
+            # density of the rows between `low` and `high`.
+            draw = min(candidates, math.ceil(remaining * span / count * 1.25))
+            if draw * 2 >= candidates:
+                batch = rng.sample(
+                    [pk for pk in range(low, high + 1) if pk not in probed], draw
+                )
+            else:
+                batch = list()
+                while len(batch) < draw:
+                    pk = rng.randint(low, high)
+                    if pk not in probed:
+                        probed.add(pk)
+                        batch.append(pk)
+            probed.update(batch)
+            
+            hits = set()
+            for i in range(0, len(batch), chunk):
+                hits.update(
+                    queryset.order_by().filter(pk__in=batch[i:i + chunk])
+                    .values_list("pk", flat=True)
+                )
+            # Keep the rows in the order they were drawn so that a seeded
+            # sample is reproducible.
+            found.extend(pk for pk in batch if pk in hits)
+        
+        return found[:n]
+
+
+
 class Show(Command):
     """Allow to choose which field to include or remove.
     
@@ -380,10 +1054,14 @@ class Sort(Command):
         fields = utils.split_list_values(values)
         
         for f in fields:
-            utils.check_field(
-                f if not f.startswith("-") else f[1:], query.model, query.censor,
-                query.arbitrary_fields
-            )
+            name = f if not f.startswith("-") else f[1:]
+            utils.check_field(name, query.model, query.censor, query.arbitrary_fields)
+            # Sorting on a field that is not part of the groups would split
+            # them
+            if query.group_by and name not in {*query.group_by.values(), *query.arbitrary_fields}:
+                raise InvalidCommandError(
+                    "c:sort", f"cannot sort grouped rows on a non-grouping field ('{name}')"
+                )
         
         query.queryset = query.queryset.order_by(*[f.replace(".", "__") for f in fields])
 
@@ -450,18 +1128,230 @@ class Time(Command):
         query.time = int(values[-1])
 
 
+
+class TimeSeries(Command):
+    """Group the rows by period of time according to the value of a date
+    field.
+    
+    Time series are made up of key value pairs delimited by a pipe `|`:
+    `key:value|key:value`. Valid keys are :
+    
+    * `field` (`field=date`) - Name of the date field.
+    * `interval` (`interval=month`) - Length of the periods, must be one of
+        `year`, `quarter`, `month`, `week`, `day`, `hour` or `minute`. Default
+        to `month`.
+    * `to` (`to=period`) - Name of the field containing the start of the
+        period, default to `period`.
+    
+    The rows are grouped by period as with `c:group`, use `c:aggregate` to
+    compute metrics for each period. Dates are truncated by the database."""
+    
+    regex = "^c:timeseries$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        check_groupable(query, "c:timeseries")
+        
+        periods = Periods.from_query_value(
+            values[-1], query.model, query.censor, query.arbitrary_fields
+        )
+        query.queryset = periods.apply(query.queryset)
+        query.arbitrary_fields.add(periods.to)
+        
+        group(query, {periods.to: periods.to})
+
+
+
+class TopN(Command):
+    """Only keep the first rows of each group of rows sharing the same values
+    for some fields.
+    
+    Top N are made up of key value pairs delimited by a pipe `|`:
+    `key:value|key:value`. Valid keys are :
+    
+    * `partition` (`partition=country`) - Fields used to create the groups
+        (multiple field names separated by an apostrophe `'`). Fields cannot
+        span a list of related models.
+    * `sort` (`sort=-date`) - Sort the rows of each group by the given fields
+        (apostrophe `'` separated list). Prepend an hyphen `-` to use
+        descending order.
+    * `n` (`n=3`) - Number of rows to keep in each group, default to `1`.
+    
+    The rows are then sorted by group. The whole computation is done in a
+    single query, using a `ROW_NUMBER()` window function, or a correlated
+    subquery counting the preceding rows of each group on databases not
+    supporting window functions."""
+    
+    regex = "^c:topn$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if query.sliced:
+            raise InvalidCommandError("c:topn", "cannot be used after 'c:start' or 'c:limit'")
+        if query.group_by:
+            raise InvalidCommandError("c:topn", "cannot be used after 'c:group'")
+        
+        try:
+            query_dict = utils.subquery_to_querydict(values[-1])
+        except ValueError as e:
+            raise InvalidCommandError("c:topn", str(e))
+        
+        # Retrieve the fields used to create the groups
+        partition = utils.split_list_values(query_dict.getlist("partition"), "'")
+        if not partition:
+            raise InvalidCommandError("c:topn", "'partition' argument is missing")
+        for f in partition:
+            utils.check_field(f, query.model, query.censor, query.arbitrary_fields)
+            if utils.spans_many(f, query.model, query.arbitrary_fields):
+                raise InvalidCommandError(
+                    "c:topn", f"cannot partition on a list of related models ('{f}')"
+                )
+        partition = [f.replace(".", "__") for f in partition]
+        
+        # Retrieve the sort of each group
+        sort = utils.split_list_values(query_dict.getlist("sort"), "'")
+        for f in sort:
+            utils.check_field(
+                f if not f.startswith("-") else f[1:], query.model, query.censor,
+                query.arbitrary_fields
+            )
+        sort = [f.replace(".", "__") for f in sort]
+        
+        # Retrieve the number of rows kept for each group
+        n = query_dict.get("n", "1")
+        if not n.isdigit() or not int(n):
+            raise InvalidCommandError(
+                "c:topn", f"'n' value must be a positive integer (received '{n}')"
+            )
+        n = int(n)
+        
+        if connections[query.queryset.db].features.supports_over_clause:
+            queryset = self._window(query.queryset, partition, sort, n)
+        else:
+            queryset = self._subquery(query.queryset, partition, sort, n)
+        query.queryset = queryset.order_by(*partition, *sort)
+    
+    
+    @staticmethod
+    def _window(queryset: models.QuerySet, partition: List[str], sort: List[str],
+                n: int) -> models.QuerySet:
+        """Keep the `n` first rows of each partition using `ROW_NUMBER()`."""
+        order_by = [F(f[1:]).desc() if f.startswith("-") else F(f).asc() for f in sort]
+        ranked = queryset.order_by().annotate(
+            _dgeq_pk=F("pk"),
+            _dgeq_rank=models.Window(
+                RowNumber(),
+                partition_by=[F(f) for f in partition],
+                order_by=order_by + [F("pk").asc()],
+            ),
+        ).values("_dgeq_pk", "_dgeq_rank")
+        
+        # Window functions cannot be used in a WHERE clause, the ranked rows
+        # must be wrapped in a subquery.
+        connection = connections[queryset.db]
+        qn = connection.ops.quote_name
+        sql, params = ranked.query.get_compiler(connection=connection).as_sql()
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT {qn('_dgeq_pk')} FROM ({sql}) {qn('_dgeq_topn')} "
+            f"WHERE {qn('_dgeq_rank')} <= %s",
+            (*params, n)
+        ))
+    
+    
+    @staticmethod
+    def _subquery(queryset: models.QuerySet, partition: List[str], sort: List[str],
+                  n: int) -> models.QuerySet:
+        """Keep the `n` first rows of each partition by counting, for each row,
+        the rows of the same partition preceding it."""
+        keys = [(f[1:], True) if f.startswith("-") else (f, False) for f in sort] + [("pk", False)]
+        
+        # A row precedes another if its keys are lexicographically smaller
+        preceding, equal = Q(), Q()
+        for key, desc in keys:
+            preceding |= equal & Q(**{f"{key}__{'gt' if desc else 'lt'}": OuterRef(key)})
+            equal &= Q(**{key: OuterRef(key)})
+        
+        count = queryset.order_by().filter(
+            preceding, **{f: OuterRef(f) for f in partition}
+        ).annotate(
+            _dgeq_count=models.Func(F("pk"), function="COUNT")
+        ).values("_dgeq_count")
+        
+        return queryset.annotate(
+            _dgeq_rank=Coalesce(models.Subquery(count, output_field=models.IntegerField()), 0)
+        ).filter(_dgeq_rank__lt=n)
+
+
+
+class Window(Command):
+    """Create annotations computed with window functions by parsing query's
+    `c:window` value.
+    
+    Window annotations are made up of key value pairs delimited by a pipe `|`:
+    `key:value|key:value`. Valid keys are :
+    
+    * `to` (`to=rank`) - Name of the field where the result will be displayed.
+    * `func` (`func=rank`) - Function to use. Either `rank`, `dense_rank`,
+        `row_number`, `lag`, `lead`, or a key of `DGEQ_AGGREGATION_FUNCTION`
+        to compute a running aggregate.
+    * `field` (`field=population`) - Name of the field used by `lag`, `lead`
+        and aggregates.
+    * `partition` (`partition=region`) - Fields used to partition the rows
+        (apostrophe `'` separated list). The function is computed separately
+        for each partition.
+    * `order` (`order=-population`) - Sort the rows of each partition by the
+        given fields (apostrophe `'` separated list). Prepend an hyphen `-` to
+        use descending order. Mandatory for `rank`, `dense_rank`, `row_number`,
+        `lag` and `lead`.
+    * `offset` (`offset=2`) - Offset used by `lag` and `lead`, default to `1`.
+    
+    You can declare multiple window annotations using a comma `,` or with
+    multiple declaration of `c:window`. Each `to` must be unique.
+    
+    Window functions are computed by the database over every row matching the
+    filters, before `c:start` and `c:limit` are applied. Their `to` are
+    appended to `query.arbitrary_fields`, and can be used by `Sort` and `Show`
+    but not in filters."""
+    
+    regex = "^c:window$"
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if query.sliced:
+            raise InvalidCommandError("c:window", "cannot be used after 'c:start' or 'c:limit'")
+        if query.group_by:
+            raise InvalidCommandError("c:window", "cannot be used after 'c:group'")
+        
+        for w in utils.split_list_values(values):
+            w = WindowAnnotation.from_query_value(
+                w, query.model, query.censor, query.arbitrary_fields
+            )
+            query.arbitrary_fields.add(w.to)
+            query.queryset = w.apply(query.queryset)
+
+
 # Commands used when evaluating the query
 DGEQ_COMMANDS = [
     utils.import_callable(p) for p in getattr(settings, "DGEQ_COMMANDS", [
         Case(),
         Annotate(),
+        Compute(),
+        Window(),
+        Or(),
+        Exists(),
         Filtering(),
         Distinct(),
         Sort(),
+        Sample(),
         Subset(),
         Join(),
         Show(),
+        Group(),
+        Histogram(),
+        TimeSeries(),
         Aggregate(),
+        TopN(),
+        Facet(),
         Count(),
         Time(),
         Evaluate(),
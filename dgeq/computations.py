@@ -0,0 +1,160 @@
+import ast
+from typing import Iterable, Type
+
+from django.db import models
+from django.db.models import F, Func, Value
+from django.db.models.functions import Cast
+
+from . import utils
+from .aggregations import NUMERIC_FIELDS, _check_to
+from .censor import Censor
+from .exceptions import InvalidCommandError
+
+
+
+# Arithmetic operators allowed in computed expressions
+OPERATORS = {
+    ast.Add: lambda lhs, rhs: lhs + rhs,
+    ast.Sub: lambda lhs, rhs: lhs - rhs,
+    ast.Mult: lambda lhs, rhs: lhs * rhs,
+    # Division by zero returns null instead of raising an error
+    ast.Div: lambda lhs, rhs: lhs / Func(rhs, Value(0.0), function="NULLIF"),
+}
+
+# Maximum length of an expression, and maximum depth of its operations, so
+# that parsing and compiling it never exceeds the recursion limit
+MAX_EXPRESSION_LENGTH = 1000
+MAX_EXPRESSION_DEPTH = 32
+
+
+
+class Computation:
+    """Represents a field computed from an arithmetic expression.
+    
+    Fields:
+        * `to` (`str`) - Name of the field where the result of the computation
+                will be stored.
+        * `expression` (`models.Expression`) - Expression computing the field.
+        * `fields` (`List[str]`) - Fields used by the expression.
+    """
+    
+    
+    def __init__(self, to: str, expression: models.Expression, fields: Iterable[str] = ()):
+        self.to = to
+        self.expression = expression
+        self.fields = list(fields)
+    
+    
+    @classmethod
+    def from_query_value(cls, value: str, model: Type[models.Model], censor: Censor,
+                         arbitrary_fields: Iterable[str] = ()) -> 'Computation':
+        """Create a `Computation` from a 'c:compute` query string."""
+        try:
+            query_dict = utils.subquery_to_querydict(value)
+        except ValueError as e:
+            raise InvalidCommandError("c:compute", str(e))
+        
+        # Retrieve the field where to put the computed value
+        if "to" not in query_dict:
+            raise InvalidCommandError("c:compute", "'to' argument is missing")
+        _check_to("c:compute", query_dict["to"], model, censor, arbitrary_fields)
+        to = query_dict["to"]
+        
+        # Parse the expression
+        if "expr" not in query_dict:
+            raise InvalidCommandError("c:compute", "'expr' argument is missing")
+        if len(query_dict["expr"]) > MAX_EXPRESSION_LENGTH:
+            raise InvalidCommandError(
+                "c:compute", f"expression cannot be longer than {MAX_EXPRESSION_LENGTH} characters"
+            )
+        try:
+            tree = ast.parse(query_dict["expr"].strip(), mode="eval")
+        except (SyntaxError, RecursionError, MemoryError):
+            raise InvalidCommandError(
+                "c:compute", f"invalid expression '{query_dict['expr']}'"
+            )
+        fields = list()
+        expression = cls._compile(tree.body, model, censor, arbitrary_fields, fields)
+        
+        return cls(to, expression, fields)
+    
+    
+    @classmethod
+    def _compile(cls, node: ast.AST, model: Type[models.Model], censor: Censor,
+                 arbitrary_fields: Iterable[str], fields: list,
+                 depth: int = 0) -> models.Expression:
+        """Recursively compile an `ast` node into an expression, appending every
+        field used to `fields`.
+        
+        Only numbers, fields (dot `.` notation can be used for related fields),
+        `+`, `-`, `*`, `/` and parentheses are allowed. Every value is cast to
+        a float, so that divisions are never truncated. Operations cannot be
+        nested deeper than `MAX_EXPRESSION_DEPTH`."""
+        if depth > MAX_EXPRESSION_DEPTH:
+            raise InvalidCommandError(
+                "c:compute",
+                f"expression cannot nest more than {MAX_EXPRESSION_DEPTH} operations"
+            )
+        
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](
+                cls._compile(node.left, model, censor, arbitrary_fields, fields, depth + 1),
+                cls._compile(node.right, model, censor, arbitrary_fields, fields, depth + 1),
+            )
+        
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            operand = cls._compile(
+                node.operand, model, censor, arbitrary_fields, fields, depth + 1
+            )
+            return operand if isinstance(node.op, ast.UAdd) else operand * Value(-1.0)
+        
+        # 'ast.Num' is used instead of 'ast.Constant' before Python 3.8
+        number = getattr(node, "value", getattr(node, "n", None))
+        if (isinstance(node, (ast.Constant, getattr(ast, "Num", ast.Constant)))
+                and isinstance(number, (int, float)) and not isinstance(number, bool)):
+            return Value(float(number), output_field=models.FloatField())
+        
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            field = cls._field_name(node)
+            second_last_model, last_field_name = utils.check_field(
+                field, model, censor, arbitrary_fields
+            )
+            if field not in arbitrary_fields:
+                target = utils.get_field(last_field_name, second_last_model)
+                if not isinstance(target, NUMERIC_FIELDS):
+                    raise InvalidCommandError(
+                        "c:compute", f"'{field}' is not a numeric field"
+                    )
+            if utils.spans_many(field, model, arbitrary_fields):
+                raise InvalidCommandError(
+                    "c:compute", f"cannot use a list of related models ('{field}')"
+                )
+            fields.append(field)
+            return Cast(F(field.replace(".", "__")), models.FloatField())
+        
+        raise InvalidCommandError(
+            "c:compute",
+            "expression can only contain numbers, fields, parentheses and the operators "
+            "'+', '-', '*' and '/'"
+        )
+    
+    
+    @classmethod
+    def _field_name(cls, node: ast.AST) -> str:
+        """Return the dotted name of a field from a `ast.Name` or
+        `ast.Attribute` node."""
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            return f"{cls._field_name(node.value)}.{node.attr}"
+        raise InvalidCommandError(
+            "c:compute", "expression can only contain numbers, fields, parentheses and the "
+                         "operators '+', '-', '*' and '/'"
+        )
+    
+    
+    def apply(self, queryset: models.QuerySet) -> models.QuerySet:
+        """Return a new `QuerySet` with this `Computation` applied."""
+        return queryset.annotate(**{
+            self.to: models.ExpressionWrapper(self.expression, output_field=models.FloatField())
+        })
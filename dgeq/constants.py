@@ -15,6 +15,11 @@ DGEQ_MAX_NESTED_FIELD_DEPTH = getattr(settings, "DGEQ_MAX_NESTED_FIELD_DEPTH", 1
 DGEQ_SUBQUERY_SEP_FIELDS = getattr(settings, 'DGEQ_SUBQUERY_SEP_FIELDS', '|')
 DGEQ_SUBQUERY_SEP_VALUES = getattr(settings, 'DGEQ_SUBQUERY_SEP_VALUES', "'")
 
+# Separator of the values of list search modifiers (e.g. `id=@1;2;3`), which
+# must differ from the separators of the filters given to commands (such as
+# `c:or`) and of the modifiers of a same field (`,`)
+DGEQ_LIST_SEP_VALUES = getattr(settings, 'DGEQ_LIST_SEP_VALUES', ';')
+
 # Default limit on row count when 'c:limit' is not provided (set to 0 to get
 # every row)
 DGEQ_DEFAULT_LIMIT = getattr(settings, "DGEQ_DEFAULT_LIMIT", 10)
@@ -22,3 +27,7 @@ DGEQ_DEFAULT_LIMIT = getattr(settings, "DGEQ_DEFAULT_LIMIT", 10)
 # Maximum number of row returned in a response (set to '0' to allow any limit).
 # InvalidCommandError will be raised if an higher number is given to 'c:limit'
 DGEQ_MAX_LIMIT = getattr(settings, "DGEQ_MAX_LIMIT", 200)
+
+# Default number of values returned for each facet of 'c:facet' when no limit
+# is provided. Cannot be higher than 'DGEQ_MAX_LIMIT' (if not '0').
+DGEQ_FACET_LIMIT = getattr(settings, "DGEQ_FACET_LIMIT", 10)
@@ -6,7 +6,7 @@ from typing import Any, Dict, List, TYPE_CHECKING, Type, Union
 from django.db import connection, models
 from django.http import QueryDict
 
-from . import utils
+from . import cache, coalesce, columnar, memory, rollups, utils
 from .censor import Censor
 from .commands import DGEQ_COMMANDS
 from .constants import DGEQ_DEFAULT_LIMIT
@@ -73,6 +73,8 @@ class GenericQuery(JoinMixin):
             for f in model._meta.get_fields()
         }  # noqa
         self.arbitrary_fields = set()
+        self.annotations = list()
+        self.group_by = dict()
         self.queryset = self.model.objects.all()
         self.result = {'status': True}
         self.case = True
@@ -80,9 +82,41 @@ class GenericQuery(JoinMixin):
         self.sliced = False
         self.limit_set = False
         self.time = False
+        # Rollup answering the query, if any. Commands are then applied on the
+        # table of the rollup instead of the rows of the model
+        self.rollup = rollups.plan(self)
+        if self.rollup is not None:
+            self.queryset = self.rollup.queryset(self.queryset.db)
+        # Memory table of the model, if any, and indices of the rows in this
+        # table, set to `None` if the query cannot be evaluated in memory
+        self.memory = memory.get_table(model) if self.rollup is None else None
+        self.memory_rows = list(range(len(self.memory))) if self.memory is not None else None
+        # Columnar table of the model, if any, and bitmap of the rows matching
+        # the query, set to `None` if counts and aggregations cannot be
+        # computed from the columns
+        self.columnar = columnar.get_table(model) if self.rollup is None else None
+        self.columnar_bitmap = (
+            bytearray(self.columnar.alive) if self.columnar is not None else None
+        )
+    
+    
+    def _evaluate_groups(self) -> List[Dict[str, Any]]:
+        queryset = self.queryset
+        
+        # Use the default limit if no limit has been given to 'c:limit'
+        if DGEQ_DEFAULT_LIMIT and not self.limit_set:
+            queryset = queryset[:DGEQ_DEFAULT_LIMIT]
+        
+        return [{self.group_by.get(k, k): v for k, v in row.items()} for row in queryset]
     
     
     def _evaluate(self) -> List[Dict[str, Any]]:
+        if self.memory is not None:
+            return self.memory.evaluate(self)
+        
+        if self.group_by:
+            return self._evaluate_groups()
+        
         fields = set(self.fields)
         fields |= set(self.arbitrary_fields)
         fields = self.censor.censor(self.model, fields)
@@ -90,6 +124,14 @@ class GenericQuery(JoinMixin):
         fields, one_fields, many_fields = utils.split_related_field(
             self.model, fields, self.arbitrary_fields
         )
+        
+        # Rows are only cached if they only contain the fields of the model
+        if cache.cached(self.model) and not self.joins and not fields & self.arbitrary_fields:
+            queryset = self.queryset
+            if DGEQ_DEFAULT_LIMIT and not self.limit_set:
+                queryset = queryset[:DGEQ_DEFAULT_LIMIT]
+            return cache.rows(queryset, fields, one_fields, many_fields)
+        
         queryset = self.queryset.select_related(
             *[f for f in one_fields if f not in self.joins.keys()]
         )
@@ -113,7 +155,32 @@ class GenericQuery(JoinMixin):
         
         Execute commands in `DGEQ_COMMANDS` on each field/value of the query
         when the field match the command's regex. This function then compute the
-        resulting rows."""
+        resulting rows.
+        
+        If [`DGEQ_COALESCE`](settings.md#dgeq_coalesce) is set, identical
+        queries evaluated concurrently share the result of the first one."""
+        if coalesce.DGEQ_COALESCE:
+            return coalesce.single_flight(coalesce.key(self), self._evaluate_query)
+        return self._evaluate_query()
+    
+    
+    async def aevaluate(self):
+        """Asynchronous version of `evaluate()`, evaluating the query in a
+        thread.
+        
+        If [`DGEQ_COALESCE`](settings.md#dgeq_coalesce) is set, identical
+        queries awaited concurrently in the same event loop share the result of
+        the first one."""
+        # Only installed along Django 3.0 and later
+        from asgiref.sync import sync_to_async
+        
+        func = sync_to_async(self.evaluate)
+        if coalesce.DGEQ_COALESCE:
+            return await coalesce.async_single_flight(coalesce.key(self), func)
+        return await func()
+    
+    
+    def _evaluate_query(self):
         start_time = time.time()
         start_query = len(connection.queries)
         
@@ -121,6 +188,12 @@ class GenericQuery(JoinMixin):
             for field, lst in self._query_dict_list:
                 matching_commands = (c for c in DGEQ_COMMANDS if re.match(c.regex, field))
                 for command in matching_commands:
+                    if self.memory is not None:
+                        command = memory.memory_command(self, command)
+                    if self.columnar is not None:
+                        command = columnar.columnar_command(self, command)
+                    if self.rollup is not None:
+                        command = rollups.rollup_command(self, command)
                     command(self, field, lst)
             
             if self.evaluated:
@@ -48,6 +48,25 @@ class SearchModifierError(DgeqError):
 
 
 
+class InvalidValueError(DgeqError):
+    """Raised when a value cannot be parsed according to the type of the
+    field it is compared to."""
+    
+    code = "INVALID_VALUE"
+    details = ['field', 'value', 'type']
+    
+    
+    def __init__(self, field: str, value: str, field_instance: models.Field):
+        self.field = field
+        self.value = value
+        self.type = type(field_instance).__name__
+    
+    
+    def __str__(self):
+        return f"Invalid value '{self.value}' for field '{self.field}' of type '{self.type}'"
+
+
+
 class UnknownFieldError(DgeqError):
     """Raised when an unknown field is used inside a `Filter` or in any
     command."""
@@ -1,10 +1,19 @@
-from datetime import datetime
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Optional, Tuple
 
 from django.conf import settings
-from django.db.models import Q, QuerySet
+from django.db import connections, models
+from django.db.models import Q, QuerySet, Value
+from django.db.models.functions import Lower
+from django.utils import timezone
 
-from .exceptions import SearchModifierError
-from .types import DGEQ_TYPE_PARSERS
+from . import trigram, utils
+from .constants import DGEQ_LIST_SEP_VALUES
+from .exceptions import InvalidValueError, SearchModifierError
+from .search import FullTextSearch, is_full_text
+from .types import datetime_parser, field_parser
 
 
 # Table giving which django's lookup function to use according to the search
@@ -19,11 +28,13 @@ from .types import DGEQ_TYPE_PARSERS
 
 DEFAULT_FILTERS_TABLE = {
     ('', int):         'exact',
+    ('', bool):        'exact',
     ('', str):         ('iexact', 'exact'),
     ('', datetime):    'exact',
     ('', type(None)):  'exact',
     
     ('!', int):        'exact',
+    ('!', bool):       'exact',
     ('!', str):        ('iexact', 'exact'),
     ('!', datetime):   'exact',
     ('!', type(None)): 'exact',
@@ -52,6 +63,10 @@ DEFAULT_FILTERS_TABLE = {
     ('$', str):        ('iendswith', 'endswith'),
     ('*', str):        ('icontains', 'contains'),
     ('~', str):        ('icontains', 'contains'),
+    
+    ('@', list):       'in',
+    
+    (':', str):        ('dgeq_search', 'dgeq_search'),
 }
 DGEQ_FILTERS_TABLE = {
     **DEFAULT_FILTERS_TABLE,
@@ -65,18 +80,102 @@ SEARCH_MODIFIERS = {k[0] for k, v in DGEQ_FILTERS_TABLE.items() if v is not None
 # modifier in this list will use `queryset.exclude()` instead.
 DGEQ_EXCLUDE_SEARCH_MODIFIER = getattr(settings, 'DGEQ_EXCLUDE_SEARCH_MODIFIER', ['!', '~'])
 
+# Value of search modifier in this list is a list of values separated by
+# `DGEQ_LIST_SEP_VALUES`. Each value is parsed, and the filter's value is a
+# `list` of unique values.
+DGEQ_LIST_SEARCH_MODIFIER = getattr(settings, 'DGEQ_LIST_SEARCH_MODIFIER', ['@'])
+
+# Dictionary mapping a model (or its dotted path) to a dictionary mapping some
+# of its fields to the list of rewrites applied to the lookups on this field,
+# allowing the database to use an index on the field:
+#
+# * `"lower"`: Case-insensitive lookups are rewritten as
+#   `LOWER(field) [lookup] lower(value)`, to use a functional index on
+#   `LOWER(field)`.
+# * `"prefix"`: Case-sensitive `startswith` lookups are rewritten as a range
+#   `field >= prefix AND field < next_prefix`, to use a B-tree index on the
+#   field. Combined with `"lower"`, case-insensitive `startswith` lookups are
+#   rewritten as a range on `LOWER(field)`. The range follows the collation of
+#   the field, which must be binary.
+DGEQ_LOOKUP_REWRITES = getattr(settings, 'DGEQ_LOOKUP_REWRITES', {})
+
+# Fields on which the `lower` transform used by the `"lower"` lookup rewrite is
+# registered when this module is loaded
+LOWER_FIELDS = (models.CharField, models.TextField)
+for _field in LOWER_FIELDS:
+    _field.register_lookup(Lower)
+
+# Date parts usable with list search modifiers (e.g. `date=@year:2019`). Each
+# part maps to a pair of functions, the first truncating a datetime to the
+# start of the period containing it, the second returning the start of the
+# next period.
+DATE_PARTS = {
+    "year":  (
+        lambda d: d.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0),
+        lambda d: d.replace(year=d.year + 1),
+    ),
+    "month": (
+        lambda d: d.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+        lambda d: d.replace(year=d.year + d.month // 12, month=d.month % 12 + 1),
+    ),
+    "day":   (
+        lambda d: d.replace(hour=0, minute=0, second=0, microsecond=0),
+        lambda d: d + timedelta(days=1),
+    ),
+}
+DATE_PART_REGEX = re.compile(rf"^({'|'.join(DATE_PARTS)}):(.*)$")
+
+# Case-insensitive lookups rewritten by the `"lower"` lookup rewrite
+LOWER_LOOKUPS = ('iexact', 'istartswith', 'iendswith', 'icontains')
+
+
+
+def lookup_rewrites(field: Optional[models.Field]) -> Iterable[str]:
+    """Return the lookup rewrites defined in `DGEQ_LOOKUP_REWRITES` for
+    `field`."""
+    if field is None or not hasattr(field, "model"):
+        return ()
+    
+    return tuple(
+        utils.get_model_setting(DGEQ_LOOKUP_REWRITES, field.model, {}).get(field.name, ())
+    )
+
+
+
+def next_prefix(prefix: str) -> Optional[str]:
+    """Return the smallest string greater than every string starting with
+    `prefix`, or `None` if there is none."""
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:  # Skip surrogates, which cannot be encoded
+            code = 0xE000
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
 
 
 class Filter:
     """Represent a search filter in a `GenericQuery`"""
     
     
-    def __init__(self, field: str, value: str, case: bool):
+    def __init__(self, field: str, value: str, case: bool, target: Optional[models.Field] = None):
         """Create a `Filter` from field-value pair of a query string.
         
         `case` indicate whether the filter is case-sensitive (`True`) or not.
         
         `value` must include the search modifier, if any.
+        
+        `target` is the field compared to the value (see
+        `utils.target_field()`). If given, the value is parsed according to the
+        type of this field (see `DGEQ_FIELD_PARSERS`), raising
+        `InvalidValueError` if it is not valid. Otherwise, the value is parsed
+        with `DGEQ_TYPE_PARSERS`.
+        
+        Values of list search modifiers prefixed by a date part (see
+        `DATE_PARTS`, e.g. `@year:2019;2021`) are compiled into half-open
+        ranges on the field.
         """
         # Extract optional modifier from value, if any
         if value and value[0] in SEARCH_MODIFIERS:
@@ -86,40 +185,174 @@ class Filter:
         
         self.field = field.replace(".", "__")
         self.modifier = modifier
-        for parser in DGEQ_TYPE_PARSERS:
-            v = parser(value)
-            if v is not ...:
-                self.value = v
-                break
+        parser = field_parser(type(target) if target is not None else None)
+        match = DATE_PART_REGEX.match(value)
+        self.date_part = None
+        if (modifier in DGEQ_LIST_SEARCH_MODIFIER and match
+                and (target is None or isinstance(target, models.DateField))):
+            self.date_part, value = match.groups()
+            values = value.split(DGEQ_LIST_SEP_VALUES) if value else []
+            self.value = list(dict.fromkeys(
+                self._parse_date_part(self.date_part, field, v, target) for v in values
+            ))
+        elif modifier in DGEQ_LIST_SEARCH_MODIFIER:
+            values = value.split(DGEQ_LIST_SEP_VALUES) if value else []
+            # Remove duplicates while keeping the order of the values
+            self.value = list(dict.fromkeys(
+                self._parse(parser, field, v, target) for v in values
+            ))
         else:
-            self.value = value
+            self.value = self._parse(parser, field, value, target)
         self.case = case
+        self.target = target
     
     
-    def get(self) -> Q:
-        """Return a `Q` object corresponding to this `Filter`."""
+    @staticmethod
+    def _parse(parser, field: str, value: str, target: Optional[models.Field]) -> Any:
+        """Parse `value` with `parser`, raising `InvalidValueError` if it is
+        not a valid value for `target`."""
+        v = parser(value)
+        if v is ...:
+            raise InvalidValueError(field, value, target)
+        return v
+    
+    
+    @staticmethod
+    def _parse_date_part(part: str, field: str, value: str,
+                         target: Optional[models.Field]) -> Tuple[datetime, datetime]:
+        """Parse `value` with `datetime_parser` and return the half-open range
+        `[start, end)` of the `part` (see `DATE_PARTS`) containing it.
+        
+        Naive bounds are made aware in the current time zone if `USE_TZ` is
+        `True`, unless `target` is a `DateField`."""
+        v = datetime_parser(value)
+        if v is ...:
+            raise InvalidValueError(field, value, target)
+        
+        truncate, following = DATE_PARTS[part]
+        start = truncate(v)
+        end = following(start)
+        if (settings.USE_TZ and timezone.is_naive(start)
+                and (target is None or isinstance(target, models.DateTimeField))):
+            start, end = timezone.make_aware(start), timezone.make_aware(end)
+        return start, end
+    
+    
+    def lookup(self) -> str:
+        """Return the name of the django's lookup used by this `Filter` (see
+        `DGEQ_FILTERS_TABLE`).
+        
+        Raise `SearchModifierError` if the modifier cannot be used with the
+        type of the value."""
         try:
             lookup = DGEQ_FILTERS_TABLE[(self.modifier, type(self.value))]
             if lookup is None:
                 raise KeyError
             if isinstance(self.value, str):
                 lookup = lookup[self.case]
+            # Full-text search must be enabled on the field
+            if lookup == FullTextSearch.lookup_name and not is_full_text(self.target):
+                raise KeyError
         except KeyError:
             raise SearchModifierError(self.modifier, self.value)
         
-        if self.modifier not in DGEQ_EXCLUDE_SEARCH_MODIFIER:
+        return lookup
+    
+    
+    def get(self) -> Q:
+        """Return a `Q` object corresponding to this `Filter`."""
+        if self.date_part is not None:
+            return self._date_part_ranges()
+        
+        lookup = self.lookup()
+        index = (
+            trigram.get_index(self.target)
+            if isinstance(self.value, str) and lookup in trigram.TRIGRAM_LOOKUPS else None
+        )
+        # Resolve the filter to the primary keys of the matching rows. Too many
+        # matches would not fit in a single `IN` along the other parameters of
+        # the query, the lookup is then left to the database.
+        pks = None
+        if index is not None:
+            pks = index.search(self.target.name, self.value, lookup)
+            connection = connections[self.target.model._default_manager.db]
+            if len(pks) > utils.max_in_size(connection) // 2:
+                pks = None
+        
+        if isinstance(self.value, list):
             q = Q(**{self.field + "__" + lookup: self.value})
+        elif pks is not None:
+            path = self.field.rsplit("__", 1)[0] + "__in" if "__" in self.field else "pk__in"
+            q = Q(**{path: sorted(pks)})
+        elif isinstance(self.value, str) and lookup_rewrites(self.target):
+            q = self._rewrite(lookup)
         else:
-            q = ~Q(**{self.field + "__" + lookup: self.value})
+            q = Q(**{self.field + "__" + lookup: self.value})
+        
+        if self.modifier in DGEQ_EXCLUDE_SEARCH_MODIFIER:
+            q = ~q
+        
+        return q
+    
+    
+    @property
+    def full_text(self) -> bool:
+        """Whether this `Filter` is a full-text search."""
+        lookup = DGEQ_FILTERS_TABLE.get((self.modifier, type(self.value)))
+        return (
+            isinstance(self.value, str) and bool(lookup)
+            and lookup[self.case] == FullTextSearch.lookup_name
+        )
+    
+    
+    def _date_part_ranges(self) -> Q:
+        """Return a `Q` object corresponding to this `Filter` when filtering on
+        date parts, combining half-open ranges with `OR`."""
+        q = Q(**{self.field + "__in": []})
+        for start, end in self.value:
+            q |= Q(**{self.field + "__gte": start, self.field + "__lt": end})
+        
+        if self.modifier in DGEQ_EXCLUDE_SEARCH_MODIFIER:
+            q = ~q
         
         return q
     
     
+    def _rewrite(self, lookup: str) -> Q:
+        """Return a `Q` object corresponding to this `Filter`, applying the
+        lookup rewrites of its target (see `DGEQ_LOOKUP_REWRITES`)."""
+        rewrites = lookup_rewrites(self.target)
+        field, value = self.field, self.value
+        
+        lower = (
+            "lower" in rewrites and lookup in LOWER_LOOKUPS
+            and self.target.get_transform("lower") is not None
+        )
+        if lower:
+            field, lookup = field + "__lower", lookup[1:]
+        
+        # The bounds of the range must be lowered in Python, which only lowers
+        # like the database's 'LOWER()' for ASCII strings
+        if "prefix" in rewrites and lookup == "startswith" and value and (
+                not lower or value.isascii()):
+            value = value.lower() if lower else value
+            upper = next_prefix(value)
+            q = Q(**{field + "__gte": value})
+            if upper is not None:
+                q &= Q(**{field + "__lt": upper})
+            return q
+        
+        # Lower the value with the same function as the field
+        return Q(**{field + "__" + lookup: Lower(Value(value)) if lower else value})
+    
+    
     def __eq__(self, other: 'Filter'):
         return (
-            self.value == self.value
-            and self.field == self.field
-            and self.modifier == self.modifier
+            isinstance(other, Filter)
+            and self.value == other.value
+            and self.field == other.field
+            and self.modifier == other.modifier
+            and self.case == other.case
         )
     
     
@@ -187,7 +187,8 @@ class JoinQuery(JoinMixin):
                 )
             k, v = kwarg
             utils.check_field(k, target_model, censor, arbitrary_fields)
-            filters.append(Filter(k, v, case))
+            filter_target = utils.target_field(k, target_model, arbitrary_fields)
+            filters.append(Filter(k, v, case, filter_target))
         
         return cls(target, field_name, censor, distinct, show, hide, sort, filters, start, limit)
     
@@ -0,0 +1,408 @@
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import F, Func, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+
+from . import utils
+from .aggregations import Annotation
+from .censor import Censor
+
+
+# Dictionary mapping a model (or its dotted path) to a dictionary mapping names
+# to annotations (written as the value of `c:annotate`, without `to`). The
+# values of these annotations are stored in a side table and kept up to date
+# on signals, `c:annotate` then reads the stored values instead of computing
+# them when the annotation matches.
+DGEQ_MAINTAINED_ANNOTATIONS = getattr(settings, "DGEQ_MAINTAINED_ANNOTATIONS", {})
+
+# Name of the column of the side tables containing the primary key of the rows
+OBJECT_ID = "object_id"
+
+# Parsed annotations and their dependencies, by model and declaration
+_PARSED: Dict[Tuple[Type[models.Model], str, str], Tuple[Annotation, list]] = dict()
+
+# Time (in seconds) after which a side table found missing is looked for again,
+# in case it has been built by another process in the meantime
+MISSING_TABLE_TIMEOUT = 60
+
+# Columns of the side tables, by database alias and table, along with the time
+# they were read. An empty set means that the table does not exist.
+_COLUMNS: Dict[Tuple[str, str], Tuple[Set[str], float]] = dict()
+
+# Models whose annotations depend on the rows of a model (see `_watched()`), by
+# model and many-to-many intermediary model, along with the setting they were
+# computed from.
+_WATCHED: Dict[tuple, Tuple[dict, List[Tuple[Type[models.Model], bool, Set[str]]]]] = dict()
+
+
+
+def annotation_table(model: Type[models.Model]) -> str:
+    """Return the name of the side table storing the maintained annotations
+    of `model`."""
+    return f"{model._meta.db_table}_dgeq_annotations"
+
+
+
+def _model(key: object) -> Type[models.Model]:
+    """Return the model corresponding to a key of
+    `DGEQ_MAINTAINED_ANNOTATIONS`."""
+    if isinstance(key, type):
+        return key
+    try:
+        return apps.get_model(key)
+    except (LookupError, ValueError):
+        return utils.import_class(key)
+
+
+
+def _parse(model: Type[models.Model], name: str, value: str) -> Tuple[Annotation, list]:
+    """Parse a maintained annotation of `model`, return it along with its
+    dependencies.
+    
+    Dependencies are tuples `(related_model, lookup, through)`, `lookup`
+    being the lookup from `model` to `related_model` and `through` the
+    intermediary model of the relation if it is a many-to-many relation, for
+    every relation used by the annotation (through its field or its
+    filters)."""
+    key = (model, name, value)
+    if key not in _PARSED:
+        annotation = Annotation.from_query_value(f"{value}|to={name}", model, True, Censor())
+        # Computing each annotation in its own subquery prevents the joins of
+        # the others from multiplying its rows
+        annotation.strategy = "subquery"
+        
+        dependencies = list()
+        for path in [annotation.field, *(f.field for f in annotation.filters)]:
+            current = model
+            tokens = path.split("__")
+            for i, token in enumerate(tokens):
+                field = utils.get_field(token, current)
+                if not field.is_relation:
+                    break
+                through = getattr(field, "through", None) or getattr(
+                    field.remote_field, "through", None
+                )
+                current = field.related_model
+                dependencies.append((current, "__".join(tokens[:i + 1]), through))
+        
+        _PARSED[key] = annotation, dependencies
+    
+    return _PARSED[key]
+
+
+
+def maintained_annotations(model: Type[models.Model]) -> Dict[str, Annotation]:
+    """Return the maintained annotations of `model`, by name."""
+    declared = utils.get_model_setting(DGEQ_MAINTAINED_ANNOTATIONS, model, {})
+    return {name: _parse(model, name, value)[0] for name, value in declared.items()}
+
+
+
+def _annotated_models() -> List[Type[models.Model]]:
+    """Return every model declaring maintained annotations."""
+    return [_model(k) for k in DGEQ_MAINTAINED_ANNOTATIONS]
+
+
+
+def _columns(model: Type[models.Model], connection: BaseDatabaseWrapper) -> Set[str]:
+    """Return the columns of the side table of `model`, or an empty set if it
+    does not exist.
+    
+    The result is cached, a missing table being looked for again after
+    `MISSING_TABLE_TIMEOUT`."""
+    key = (connection.alias, annotation_table(model))
+    columns, read = _COLUMNS.get(key, (None, 0))
+    if columns is None or (not columns and time.monotonic() - read > MISSING_TABLE_TIMEOUT):
+        with connection.cursor() as cursor:
+            if key[1] not in connection.introspection.table_names(cursor):
+                columns = set()
+            else:
+                description = connection.introspection.get_table_description(cursor, key[1])
+                columns = {c.name for c in description}
+        _COLUMNS[key] = columns, time.monotonic()
+    return columns
+
+
+
+class StoredAnnotation(Func):
+    """Value of a maintained annotation, read from the side table of the
+    model in a correlated subquery on its primary key."""
+    
+    
+    def __init__(self, model: Type[models.Model], name: str, output_field: models.Field):
+        super().__init__(F("pk"), output_field=output_field)
+        self.model = model
+        self.name = name
+    
+    
+    def as_sql(self, compiler, connection: BaseDatabaseWrapper, **extra_context):
+        pk_sql, params = compiler.compile(self.source_expressions[0])
+        qn = connection.ops.quote_name
+        table = qn(annotation_table(self.model))
+        return (
+            f"(SELECT {table}.{qn(self.name)} FROM {table} "
+            f"WHERE {table}.{qn(OBJECT_ID)} = {pk_sql})",
+            params,
+        )
+
+
+
+def _output_field(model: Type[models.Model], annotation: Annotation) -> models.Field:
+    """Return the output field of `annotation` on `model`."""
+    queryset = annotation.apply(model._default_manager.all())
+    return queryset.query.annotations[annotation.to].output_field
+
+
+
+def stored_annotation(model: Type[models.Model], annotation: Annotation,
+                      queryset: QuerySet) -> Optional[StoredAnnotation]:
+    """Return the expression reading the stored value of `annotation` if it
+    matches a maintained annotation of `model` whose side table has been
+    built, `None` otherwise."""
+    for name, maintained in maintained_annotations(model).items():
+        if (maintained.field == annotation.field
+                and maintained.func(maintained.field) == annotation.func(annotation.field)
+                and list(maintained.filters) == list(annotation.filters)):
+            break
+    else:
+        return None
+    
+    if name not in _columns(model, connections[queryset.db]):
+        return None
+    return StoredAnnotation(model, name, _output_field(model, maintained))
+
+
+
+def refresh(model: Type[models.Model], pks: Iterable[object], using: str):
+    """Recompute the maintained annotations of the rows of `model` whose
+    primary key is in `pks`.
+    
+    Rows which do not exist anymore are removed from the side table. Nothing
+    is done if the side table has not been built."""
+    pks = list(pks)
+    annotations = maintained_annotations(model)
+    connection = connections[using]
+    columns = _columns(model, connection)
+    if not pks or not columns or not set(annotations) <= columns:
+        return
+    
+    queryset = model._default_manager.using(using).filter(pk__in=pks)
+    stored = _store(model, annotations, queryset, connection, upsert=True)
+    
+    qn = connection.ops.quote_name
+    missing = [pk for pk in pks if pk not in stored]
+    with connection.cursor() as cursor:
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            cursor.execute(
+                f"DELETE FROM {qn(annotation_table(model))} WHERE {qn(OBJECT_ID)} IN "
+                f"({', '.join(['%s'] * len(chunk))})",
+                chunk
+            )
+
+
+
+def _upsert_clause(connection: BaseDatabaseWrapper, names: Iterable[str]) -> str:
+    """Return the clause updating the columns `names` of a row of a side table
+    when inserting a row with the same primary key."""
+    qn = connection.ops.quote_name
+    if connection.vendor == "mysql":
+        return "ON DUPLICATE KEY UPDATE " + ", ".join(
+            f"{qn(n)} = VALUES({qn(n)})" for n in names
+        )
+    return f"ON CONFLICT ({qn(OBJECT_ID)}) DO UPDATE SET " + ", ".join(
+        f"{qn(n)} = excluded.{qn(n)}" for n in names
+    )
+
+
+
+def _store(model: Type[models.Model], annotations: Dict[str, Annotation], queryset: QuerySet,
+           connection: BaseDatabaseWrapper, upsert: bool = False) -> Set[object]:
+    """Compute `annotations` on the rows of `queryset` and write them in the
+    side table of `model`, return the primary keys of the rows written.
+    
+    If `upsert` is `True`, rows already in the side table are updated in the
+    same statement, so that concurrent refreshes of the same row cannot
+    conflict."""
+    for annotation in annotations.values():
+        queryset = annotation.apply(queryset)
+    rows = list(queryset.order_by().values_list("pk", *annotations))
+    
+    qn = connection.ops.quote_name
+    table = qn(annotation_table(model))
+    names = ", ".join(qn(c) for c in [OBJECT_ID, *annotations])
+    placeholders = ", ".join(["%s"] * (len(annotations) + 1))
+    sql = f"INSERT INTO {table} ({names}) VALUES ({placeholders})"
+    if upsert:
+        sql = f"{sql} {_upsert_clause(connection, annotations)}"
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+    return {row[0] for row in rows}
+
+
+
+def build_table(model: Type[models.Model], connection: BaseDatabaseWrapper):
+    """(Re)create the side table of `model` and compute the maintained
+    annotations of every row."""
+    annotations = maintained_annotations(model)
+    qn = connection.ops.quote_name
+    pk = f"{qn(OBJECT_ID)} {model._meta.pk.rel_db_type(connection)} PRIMARY KEY"
+    columns = ", ".join(
+        f"{qn(name)} {_output_field(model, a).db_type(connection)} NULL"
+        for name, a in annotations.items()
+    )
+    
+    drop_table(model, connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {qn(annotation_table(model))} ({pk}, {columns})")
+    _store(model, annotations, model._default_manager.using(connection.alias).all(), connection)
+    _COLUMNS.pop((connection.alias, annotation_table(model)), None)
+
+
+
+def drop_table(model: Type[models.Model], connection: BaseDatabaseWrapper):
+    """Drop the side table of `model`, if it exists."""
+    _COLUMNS.pop((connection.alias, annotation_table(model)), None)
+    with connection.cursor() as cursor:
+        if annotation_table(model) in connection.introspection.table_names(cursor):
+            cursor.execute(f"DROP TABLE {connection.ops.quote_name(annotation_table(model))}")
+
+
+
+def _watched(sender: Type[models.Model], through: Optional[Type[models.Model]]
+             ) -> List[Tuple[Type[models.Model], bool, Set[str]]]:
+    """Return the models whose maintained annotations may depend on the rows
+    of `sender`, along with whether the rows of `sender` are rows of the model
+    and the lookups from the model to `sender`.
+    
+    If `through` is given, only the annotations using this many-to-many
+    relation are considered. The result is cached, most models not being used
+    by any annotation."""
+    key = (sender, through)
+    cached = _WATCHED.get(key)
+    if cached is not None and cached[0] is DGEQ_MAINTAINED_ANNOTATIONS:
+        return cached[1]
+    
+    watched = list()
+    for model in _annotated_models():
+        declared = utils.get_model_setting(DGEQ_MAINTAINED_ANNOTATIONS, model, {})
+        lookups = set()
+        uses_through = False
+        for name, value in declared.items():
+            for related, lookup, t in _parse(model, name, value)[1]:
+                uses_through |= through is not None and t is through
+                if issubclass(sender, related):
+                    lookups.add(lookup)
+        if through is not None and not uses_through:
+            continue
+        
+        itself = issubclass(sender, model) and bool(declared)
+        if itself or lookups:
+            watched.append((model, itself, lookups))
+    
+    _WATCHED[key] = DGEQ_MAINTAINED_ANNOTATIONS, watched
+    return watched
+
+
+
+def _affected(sender: Type[models.Model], pks: Iterable[object], using: str,
+              through: Type[models.Model] = None) -> Dict[Type[models.Model], Set[object]]:
+    """Return the primary keys of the rows whose maintained annotations may
+    depend on the rows of `sender` whose primary key is in `pks`, by model.
+    
+    If `through` is given, only the annotations using this many-to-many
+    relation are considered."""
+    affected = dict()
+    watched = _watched(sender, through)
+    pks = [pk for pk in pks if pk is not None] if watched else []
+    if not pks:
+        return affected
+    
+    for model, itself, lookups in watched:
+        rows = set(pks) if itself else set()
+        for lookup in lookups:
+            rows |= set(
+                model._default_manager.using(using).filter(**{f"{lookup}__in": pks})
+                .values_list("pk", flat=True)
+            )
+        if rows:
+            affected[model] = rows
+    
+    return affected
+
+
+
+def _merge(*affected: Dict[Type[models.Model], Set[object]]
+           ) -> Dict[Type[models.Model], Set[object]]:
+    """Return the union of the primary keys in `affected`, by model."""
+    merged = dict()
+    for a in affected:
+        for model, pks in a.items():
+            merged.setdefault(model, set()).update(pks)
+    return merged
+
+
+
+def _refresh_all(affected: Dict[Type[models.Model], Set[object]], using: str):
+    """Refresh the rows of every model in `affected`."""
+    for model, pks in affected.items():
+        refresh(model, pks, using)
+
+
+
+def _on_pre_save(sender: Type[models.Model], instance: models.Model, raw: bool, using: str,
+                 **kwargs):
+    if DGEQ_MAINTAINED_ANNOTATIONS and not raw and instance.pk is not None:
+        instance._dgeq_maintained = _affected(sender, [instance.pk], using)
+
+
+
+def _on_post_save(sender: Type[models.Model], instance: models.Model, raw: bool, using: str,
+                  **kwargs):
+    if DGEQ_MAINTAINED_ANNOTATIONS and not raw:
+        before = instance.__dict__.pop("_dgeq_maintained", {})
+        _refresh_all(_merge(before, _affected(sender, [instance.pk], using)), using)
+
+
+
+def _on_pre_delete(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    if DGEQ_MAINTAINED_ANNOTATIONS:
+        instance._dgeq_maintained = _affected(sender, [instance.pk], using)
+
+
+
+def _on_post_delete(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    if DGEQ_MAINTAINED_ANNOTATIONS:
+        _refresh_all(instance.__dict__.pop("_dgeq_maintained", {}), using)
+
+
+
+def _on_m2m_changed(sender: Type[models.Model], instance: models.Model, action: str,
+                    model: Type[models.Model], pk_set: Optional[Set[object]], using: str,
+                    **kwargs):
+    if not DGEQ_MAINTAINED_ANNOTATIONS:
+        return
+    
+    affected = _merge(
+        _affected(type(instance), [instance.pk], using, sender),
+        _affected(model, pk_set or (), using, sender),
+    )
+    if action.startswith("pre_"):
+        instance._dgeq_maintained = affected
+    else:
+        before = instance.__dict__.pop("_dgeq_maintained", {})
+        _refresh_all(_merge(before, affected), using)
+
+
+
+pre_save.connect(_on_pre_save, dispatch_uid="dgeq_maintained_pre_save")
+post_save.connect(_on_post_save, dispatch_uid="dgeq_maintained_post_save")
+pre_delete.connect(_on_pre_delete, dispatch_uid="dgeq_maintained_pre_delete")
+post_delete.connect(_on_post_delete, dispatch_uid="dgeq_maintained_post_delete")
+m2m_changed.connect(_on_m2m_changed, dispatch_uid="dgeq_maintained_m2m_changed")
@@ -0,0 +1,44 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from ... import maintained
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the side tables storing the annotations declared in DGEQ_MAINTAINED_ANNOTATIONS, "
+        "computing the annotations of every row."
+    )
+    
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to build the tables on. Defaults to the 'default' database.",
+        )
+        parser.add_argument(
+            "--drop", action="store_true",
+            help="Drop the tables instead of building them.",
+        )
+    
+    
+    def handle(self, *args, **options):
+        if not maintained.DGEQ_MAINTAINED_ANNOTATIONS:
+            raise CommandError("DGEQ_MAINTAINED_ANNOTATIONS is empty")
+        
+        connection = connections[options["database"]]
+        for model in apps.get_models():
+            annotations = maintained.maintained_annotations(model)
+            if not annotations:
+                continue
+            
+            if options["drop"]:
+                maintained.drop_table(model, connection)
+                self.stdout.write(f"Dropped annotation table of '{model._meta.label}'")
+            else:
+                with transaction.atomic(using=connection.alias):
+                    maintained.build_table(model, connection)
+                self.stdout.write(
+                    f"Built annotation table of '{model._meta.label}' ({', '.join(annotations)})"
+                )
@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ... import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the SQLite FTS5 shadow tables (and the triggers maintaining them) of the fields "
+        "declared in DGEQ_FULL_TEXT_FIELDS."
+    )
+    
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to build the tables on. Defaults to the 'default' database.",
+        )
+        parser.add_argument(
+            "--drop", action="store_true",
+            help="Drop the tables and their triggers instead of building them.",
+        )
+    
+    
+    def handle(self, *args, **options):
+        if not search.DGEQ_FULL_TEXT_FIELDS:
+            raise CommandError("DGEQ_FULL_TEXT_FIELDS is empty")
+        
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            self.stdout.write(
+                f"Nothing to do on '{connection.vendor}', full-text search does not need any "
+                f"table on this database."
+            )
+            return
+        
+        for model in apps.get_models():
+            fields = search.full_text_fields(model)
+            if not fields:
+                continue
+            
+            if options["drop"]:
+                search.drop_fts_table(model, connection)
+                self.stdout.write(f"Dropped full-text table of '{model._meta.label}'")
+            else:
+                search.build_fts_table(model, fields, connection)
+                self.stdout.write(
+                    f"Built full-text table of '{model._meta.label}' ({', '.join(fields)})"
+                )
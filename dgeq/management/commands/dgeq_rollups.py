@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from ... import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the tables of the rollups declared in DGEQ_ROLLUPS, aggregating again the groups "
+        "modified since the last refresh."
+    )
+    
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to refresh the tables on. Defaults to the 'default' "
+                 "database.",
+        )
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Rebuild the tables, aggregating every row.",
+        )
+        parser.add_argument(
+            "--drop", action="store_true",
+            help="Drop the tables instead of refreshing them.",
+        )
+    
+    
+    def handle(self, *args, **options):
+        if not rollups.DGEQ_ROLLUPS:
+            raise CommandError("DGEQ_ROLLUPS is empty")
+        
+        using = options["database"]
+        for model in rollups.rolled_up_models():
+            for rollup in rollups.declared_rollups(model):
+                label = f"rollup '{rollup.name}' of '{model._meta.label}'"
+                if options["drop"]:
+                    rollup.drop(using)
+                    self.stdout.write(f"Dropped {label}")
+                    continue
+                
+                with transaction.atomic(using=using):
+                    if options["full"]:
+                        groups = rollup.build(using)
+                    else:
+                        groups = rollup.refresh(using)
+                self.stdout.write(f"Refreshed {label} ({groups} groups updated)")
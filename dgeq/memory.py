@@ -0,0 +1,430 @@
+import datetime
+import operator
+import threading
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING, Tuple, Type
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import utils, versions
+from .commands import Case, Command, Count, Evaluate, Filtering, Show, Sort, Subset, Time
+from .constants import DGEQ_DEFAULT_LIMIT
+from .exceptions import InvalidCommandError
+from .filter import DGEQ_EXCLUDE_SEARCH_MODIFIER, Filter
+
+
+if TYPE_CHECKING:
+    from .dgeq import GenericQuery
+
+# List of models (or their dotted path / label) evaluated in memory. Rows of
+# these models are kept in memory, and queries only using filters and sorting
+# on the fields of the model, `c:show`, `c:hide`, `c:start`, `c:limit`,
+# `c:count`, `c:case`, `c:time` and `c:evaluate` are evaluated without querying
+# the database. Only use it on small models rarely modified.
+DGEQ_MEMORY_TABLES = getattr(settings, "DGEQ_MEMORY_TABLES", [])
+
+# Python implementation of django's lookups, taking the value of the row
+# (never `None`) and the value of the filter.
+LOOKUPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "exact": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda v, f: v in f,
+}
+
+# Python implementation of django's pattern lookups on strings, mapping to
+# whether the lookup is case-sensitive and to a function taking the value of the
+# row and the value of the filter, both folded with `utils.like_fold()`.
+PATTERN_LOOKUPS: Dict[str, Tuple[bool, Callable[[str, str], bool]]] = {
+    "iexact":      (False, operator.eq),
+    "contains":    (True, lambda v, f: f in v),
+    "icontains":   (False, lambda v, f: f in v),
+    "startswith":  (True, str.startswith),
+    "istartswith": (False, str.startswith),
+    "endswith":    (True, str.endswith),
+    "iendswith":   (False, str.endswith),
+}
+
+# Memory tables already built, by model
+_TABLES: Dict[Type[models.Model], 'MemoryTable'] = dict()
+_TABLES_LOCK = threading.Lock()
+
+
+
+def _coerce(target: Optional[models.Field], value: Any) -> Any:
+    """Convert `value` to the type stored in `target`'s column."""
+    if (isinstance(target, models.DateField) and not isinstance(target, models.DateTimeField)
+            and isinstance(value, datetime.datetime)):
+        return value.date()
+    return value
+
+
+
+def _compile_pattern(f: Filter, lookup: str,
+                     vendor: Optional[str]) -> Optional[Callable[[Any, Any], bool]]:
+    """Compile the pattern lookup of `f` into a function taking the value of
+    the row and the folded value of the filter, return `None` if it cannot be
+    evaluated like the database `vendor` does."""
+    text = isinstance(f.target, (models.CharField, models.TextField))
+    if vendor is None or not text or not isinstance(f.value, str):
+        return None
+    
+    case, matches = PATTERN_LOOKUPS[lookup]
+    
+    def pattern(v: str, value: str) -> bool:
+        return matches(utils.like_fold(v, case, vendor), value)
+    
+    
+    return pattern
+
+
+
+def compile_filter(f: Filter, vendor: str = None) -> Optional[Callable[[Any], bool]]:
+    """Compile `f` into a predicate on the values of its field, return `None`
+    if its lookup has no Python implementation.
+    
+    Pattern lookups on strings (`PATTERN_LOOKUPS`) are only compiled if the
+    `vendor` of the database is given, values being compared with its case
+    handling (see `utils.like_fold()`)."""
+    exclude = f.modifier in DGEQ_EXCLUDE_SEARCH_MODIFIER
+    
+    if f.date_part is not None:
+        ranges = [(_coerce(f.target, s), _coerce(f.target, e)) for s, e in f.value]
+        matches = LOOKUPS["in"]
+        value = None
+    else:
+        ranges = None
+        lookup = f.lookup()
+        if lookup in PATTERN_LOOKUPS:
+            matches = _compile_pattern(f, lookup, vendor)
+            if matches is None:
+                return None
+            value = utils.like_fold(f.value, PATTERN_LOOKUPS[lookup][0], vendor)
+        elif lookup in LOOKUPS:
+            matches = LOOKUPS[lookup]
+            if isinstance(f.value, list):
+                value = {_coerce(f.target, v) for v in f.value}
+            else:
+                value = _coerce(f.target, f.value)
+        else:
+            return None
+    
+    def predicate(v: Any) -> bool:
+        if v is None:
+            result = value is None and ranges is None
+        elif ranges is not None:
+            result = any(s <= v < e for s, e in ranges)
+        else:
+            result = value is not None and matches(v, value)
+        # Excluded rows include rows where the field is null, the same way as
+        # django's `exclude()`
+        return result != exclude
+    
+    
+    return predicate
+
+
+
+class MemoryTable:
+    """Snapshot of every row of a model.
+    
+    Rows are stored twice, as tuples of the values of the columns (the
+    non-related fields and the fields related to a unique instance) used to
+    filter and sort the rows, and as serialized `dict` containing every field
+    of the model, used to build the resulting rows.
+    
+    The table is outdated once the rows of its model or of its related models
+    have been changed by any process (see `versions.Stamp`).
+    
+    Fields:
+        * `model` (`Type[models.Model]`) - Model of the rows.
+        * `vendor` (`str`) - Vendor of the database of the model, whose case
+                handling is used by pattern lookups.
+        * `columns` (`Dict[str, int]`) - Index of each column in the tuples.
+        * `sortable` (`Set[str]`) - Columns which can be used to sort the rows.
+        * `tuples` (`List[tuple]`) - Values of the columns of each row.
+        * `serialized` (`List[Dict[str, Any]]`) - Serialized rows.
+        * `related` (`Set[Type[models.Model]]`) - Related models included in
+                the serialized rows.
+        * `stamps` (`List[versions.Stamp]`) - Versions of `model` and of the
+                related models when the rows were read.
+    """
+    
+    
+    def __init__(self, model: Type[models.Model]):
+        self.model = model
+        self.vendor = connections[model._default_manager.db].vendor
+        
+        all_fields = {
+            f.get_accessor_name() if utils.is_reverse(f) else f.name
+            for f in model._meta.get_fields()
+        }
+        fields, one_fields, many_fields = utils.split_related_field(model, all_fields)
+        queryset = model._default_manager.select_related(*one_fields)
+        queryset = queryset.prefetch_related(*many_fields)
+        
+        self.columns = {c: i for i, c in enumerate([*fields, *one_fields])}
+        self.sortable = set(fields)
+        self.related = {
+            utils.get_field(f, model).related_model for f in [*one_fields, *many_fields]
+        }
+        # Stamps must be created before reading the rows
+        self.stamps = [versions.Stamp(m) for m in [model, *self.related]]
+        self.serialized = [
+            utils.serialize_row(item, fields, one_fields, many_fields) for item in queryset
+        ]
+        self.tuples = [tuple(row[c] for c in self.columns) for row in self.serialized]
+    
+    
+    def __len__(self):
+        return len(self.tuples)
+    
+    
+    def fresh(self) -> bool:
+        """Return whether the rows of this table are still up to date."""
+        return all(stamp.fresh() for stamp in self.stamps)
+    
+    
+    def predicate(self, f: Filter) -> Optional[Callable[[tuple], bool]]:
+        """Compile `f` into a predicate on the tuples of this table, return
+        `None` if `f` cannot be evaluated in memory."""
+        if f.full_text or f.field not in self.columns:
+            return None
+        
+        matches = compile_filter(f, self.vendor)
+        if matches is None:
+            return None
+        
+        i = self.columns[f.field]
+        
+        def predicate(t: tuple) -> bool:
+            return matches(t[i])
+        
+        
+        return predicate
+    
+    
+    def sort(self, indices: List[int], fields: List[str], nulls_largest: bool) -> List[int]:
+        """Return `indices` sorted according to `fields` (prepend an hyphen `-`
+        for descending order).
+        
+        Null values are considered larger than any other value if
+        `nulls_largest` is `True`, smaller otherwise."""
+        
+        def key(r: int, i: int) -> tuple:
+            v = self.tuples[r][i]
+            return (v is None) == nulls_largest, 0 if v is None else v
+        
+        
+        # Python's sort is stable, sort from the last field to the first one
+        indices = list(indices)
+        for f in reversed(fields):
+            desc = f.startswith("-")
+            i = self.columns[f[1:] if desc else f]
+            indices.sort(key=lambda r: key(r, i), reverse=desc)
+        return indices
+    
+    
+    def evaluate(self, query: 'GenericQuery') -> List[Dict[str, Any]]:
+        """Return the resulting rows of `query`."""
+        fields = set(query.fields)
+        fields |= set(query.arbitrary_fields)
+        fields = query.censor.censor(query.model, fields)
+        fields, one_fields, many_fields = utils.split_related_field(
+            query.model, fields, query.arbitrary_fields
+        )
+        
+        indices = query.memory_rows
+        # Use the default limit if no limit has been given to 'c:limit'
+        if DGEQ_DEFAULT_LIMIT and not query.limit_set:
+            indices = indices[:DGEQ_DEFAULT_LIMIT]
+        
+        rows = list()
+        for i in indices:
+            row = self.serialized[i]
+            rows.append({
+                **{f: row[f] for f in fields},
+                **{f: row[f] for f in one_fields},
+                **{f: list(row[f]) for f in many_fields},
+            })
+        return rows
+
+
+
+def get_table(model: Type[models.Model]) -> Optional[MemoryTable]:
+    """Return the memory table of `model` if it is declared in
+    `DGEQ_MEMORY_TABLES`, `None` otherwise.
+    
+    The table is built on the first call for a given model, and built again
+    once an instance of the model (or of a related model) has been saved or
+    deleted by a committed transaction of any process."""
+    if not utils.get_model_setting({m: True for m in DGEQ_MEMORY_TABLES}, model, False):
+        return None
+    
+    table = _TABLES.get(model)
+    if table is None or not table.fresh():
+        with _TABLES_LOCK:
+            if _TABLES.get(model) is table:
+                _TABLES[model] = MemoryTable(model)
+            table = _TABLES[model]
+    return table
+
+
+
+def invalidate(model: Type[models.Model] = None):
+    """Drop the memory table of `model` (or every table if `model` is `None`),
+    it will be built again on its next use."""
+    with _TABLES_LOCK:
+        for m in [model] if model is not None else list(_TABLES):
+            _TABLES.pop(m, None)
+
+
+
+def _tracked(models_: List[Type[models.Model]]) -> List[Type[models.Model]]:
+    """Return the models among `models_` (and their parents) whose rows can be
+    contained in a memory table of any process."""
+    tables = {m: True for m in DGEQ_MEMORY_TABLES}
+    tracked = list()
+    for m in {p for m in models_ for p in [m, *m._meta.get_parent_list()]}:
+        related = {f.related_model for f in m._meta.get_fields() if f.related_model}
+        if any(utils.get_model_setting(tables, r, False) for r in [m, *related]):
+            tracked.append(m)
+    return tracked
+
+
+
+def _changed(models_: List[Type[models.Model]], using: str):
+    """Once the transaction is committed, invalidate the memory tables
+    containing rows of `models_` and increment their versions for the other
+    processes."""
+    tracked = _tracked(models_)
+    if not tracked:
+        return
+    
+    def apply():
+        for m in tracked:
+            versions.increment(m)
+        for model, table in list(_TABLES.items()):
+            if model in tracked or table.related.intersection(tracked):
+                invalidate(model)
+    
+    transaction.on_commit(apply, using=using)
+
+
+
+def _invalidate_related(sender: Type[models.Model], using: str, **kwargs):
+    _changed([sender], using)
+
+
+
+def _invalidate_m2m(sender: Type[models.Model], instance: models.Model, action: str,
+                    model: Type[models.Model], using: str, **kwargs):
+    if action.startswith("post_"):
+        _changed([type(instance), model], using)
+
+
+
+post_save.connect(_invalidate_related, dispatch_uid="dgeq_memory_post_save")
+post_delete.connect(_invalidate_related, dispatch_uid="dgeq_memory_post_delete")
+m2m_changed.connect(_invalidate_m2m, dispatch_uid="dgeq_memory_m2m_changed")
+
+
+
+class MemoryFiltering(Filtering):
+    """Filter the rows of a memory table, see `Filtering`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        super().__call__(query, field, values)
+        
+        target = utils.target_field(field, query.model, query.arbitrary_fields)
+        predicates = [
+            query.memory.predicate(Filter(field, v, query.case, target))
+            for v in utils.split_list_values(values)
+        ]
+        if any(p is None for p in predicates):
+            query.memory = None
+            return
+        
+        tuples = query.memory.tuples
+        query.memory_rows = [
+            r for r in query.memory_rows if all(p(tuples[r]) for p in predicates)
+        ]
+
+
+
+class MemorySort(Sort):
+    """Sort the rows of a memory table, see `Sort`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        super().__call__(query, field, values)
+        
+        fields = utils.split_list_values(values)
+        if any(f.lstrip("-") not in query.memory.sortable for f in fields):
+            query.memory = None
+            return
+        
+        features = connections[query.queryset.db].features
+        query.memory_rows = query.memory.sort(
+            query.memory_rows, fields, features.nulls_order_largest
+        )
+
+
+
+class MemorySubset(Subset):
+    """Slice the rows of a memory table, see `Subset`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        super().__call__(query, field, values)
+        
+        n = int(values[-1])
+        if field == "c:start":
+            query.memory_rows = query.memory_rows[n:]
+        else:
+            query.memory_rows = query.memory_rows[:n or settings.DGEQ_MAX_LIMIT]
+
+
+
+class MemoryCount(Count):
+    """Count the rows of a memory table, see `Count`."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        if not values[-1].isdigit():
+            raise InvalidCommandError(
+                "c:count", f"value must be either 0 or 1 (received '{values[-1]}')"
+            )
+        
+        if int(values[-1]):
+            query.result['count'] = len(query.memory_rows)
+
+
+# Commands replaced when evaluating a query in memory. Commands in
+# `MEMORY_SAFE_COMMANDS` do not depend on the rows and are used as is. Any
+# other command makes the query fall back to the database.
+MEMORY_COMMANDS = {
+    Filtering: MemoryFiltering(),
+    Sort:      MemorySort(),
+    Subset:    MemorySubset(),
+    Count:     MemoryCount(),
+}
+MEMORY_SAFE_COMMANDS = (Case, Evaluate, Show, Time)
+
+
+
+def memory_command(query: 'GenericQuery', command: Command) -> Command:
+    """Return the command to use in place of `command` to evaluate `query` in
+    memory.
+    
+    If `command` cannot be evaluated in memory, the query falls back to the
+    database (`query.memory` is set to `None`) and `command` is returned."""
+    if type(command) in MEMORY_COMMANDS:
+        return MEMORY_COMMANDS[type(command)]
+    if not isinstance(command, MEMORY_SAFE_COMMANDS):
+        query.memory = None
+    return command
@@ -0,0 +1,616 @@
+import json
+import re
+import time
+from functools import reduce
+from typing import Any, Dict, List, Optional, Set, TYPE_CHECKING, Tuple, Type
+
+from django.apps import apps
+from django.apps.registry import Apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import ExpressionWrapper, Q, QuerySet
+from django.db.models.functions import Cast, NullIf
+from django.db.models.signals import pre_delete, pre_save, post_save
+
+from . import utils
+from .aggregations import Aggregation, Periods
+from .censor import Censor
+from .commands import (Aggregate, Case, Command, Count, DGEQ_COMMANDS, Evaluate, Filtering, Group,
+                       Show, Sort, Subset, Time, TimeSeries)
+from .exceptions import DgeqError
+from .filter import Filter
+
+
+if TYPE_CHECKING:
+    from .dgeq import GenericQuery
+
+# Dictionary mapping a model (or its dotted path / label) to a dictionary
+# mapping names to rollups. Each rollup is a dictionary containing the groups
+# (`"group"`, written as the value of `c:group`), the periods (`"timeseries"`,
+# written as the value of `c:timeseries`) and the aggregations (`"aggregate"`,
+# written as the value of `c:aggregate`) materialized in its table.
+DGEQ_ROLLUPS = getattr(settings, "DGEQ_ROLLUPS", {})
+
+# Name of the table logging the groups modified since the last refresh of each
+# rollup
+CHANGES_TABLE = "dgeq_rollup_changes"
+
+# Time (in seconds) after which a rollup table found missing is looked for
+# again, in case it has been built by another process in the meantime
+MISSING_TABLE_TIMEOUT = 60
+
+# Maximum number of groups recomputed by a single query
+CHUNK_SIZE = 500
+
+# Aggregation functions which can be computed from the aggregations of subsets
+# of the rows, along with the function aggregating the stored values.
+DECOMPOSABLE: Dict[Type[models.Aggregate], Type[models.Aggregate]] = {
+    models.Count: models.Sum,
+    models.Sum:   models.Sum,
+    models.Max:   models.Max,
+    models.Min:   models.Min,
+}
+
+# Intervals whose periods are unions of the periods of each interval
+NESTED_INTERVALS = {
+    "minute":  ("minute", "hour", "day", "week", "month", "quarter", "year"),
+    "hour":    ("hour", "day", "week", "month", "quarter", "year"),
+    "day":     ("day", "week", "month", "quarter", "year"),
+    "week":    ("week",),
+    "month":   ("month", "quarter", "year"),
+    "quarter": ("quarter", "year"),
+    "year":    ("year",),
+}
+
+# Rollups already parsed, by model, name and declaration
+_ROLLUPS: Dict[Tuple[Type[models.Model], str, tuple], 'Rollup'] = dict()
+
+# Rollup tables known to exist, by database alias and table
+_BUILT: Set[Tuple[str, str]] = set()
+
+# Rollup tables found missing, by database alias and table, along with the time
+# they were looked for
+_MISSING: Dict[Tuple[str, str], float] = dict()
+
+
+
+def _column(field: models.Field) -> models.Field:
+    """Return a nullable field storing the values of `field` in a rollup
+    table."""
+    if field.is_relation:
+        return models.ForeignKey(
+            field.related_model, models.DO_NOTHING, to_field=field.target_field.name,
+            db_constraint=False, related_name="+", null=True
+        )
+    if isinstance(field, models.AutoField):
+        return models.BigIntegerField(null=True)
+    
+    kwargs = {
+        k: getattr(field, k) for k in ("max_length", "max_digits", "decimal_places")
+        if getattr(field, k, None) is not None
+    }
+    return type(field)(null=True, **kwargs)
+
+
+
+class Rollup:
+    """Groups of the rows of a model and their aggregations, materialized in
+    a table.
+    
+    The values of the groups of the saved and deleted rows are logged in
+    `CHANGES_TABLE`, in the transaction modifying the rows. The rollup only
+    answers queries once these groups have been recomputed by `refresh()`.
+    
+    Fields:
+        * `model` (`Type[models.Model]`) - Model of the aggregated rows.
+        * `name` (`str`) - Name of the rollup.
+        * `table` (`str`) - Name of the table of the rollup.
+        * `keys` (`List[str]`) - Fields of `model` the rows are grouped by.
+        * `period` (`Optional[Periods]`) - Periods the rows are grouped by,
+                stored in a column named after their field.
+        * `aggregations` (`List[Aggregation]`) - Aggregations of each group,
+                stored in a column named after their `to`.
+        * `rollup_model` (`Type[models.Model]`) - Unmanaged model of the
+                table, whose fields use the names of the fields of `model`
+                they store (related fields still pointing to the same model).
+                It is registered in its own `Apps` registry, so that it is
+                never seen by django's apps registry.
+    """
+    
+    
+    def __init__(self, model: Type[models.Model], name: str, declaration: Dict[str, str]):
+        if not name.isidentifier():
+            raise ValueError(f"Rollup name must be a valid identifier (received '{name}')")
+        
+        self.model = model
+        self.name = name
+        self.table = f"{model._meta.db_table}_dgeq_rollup_{name}"
+        
+        censor = Censor()
+        self.keys = (
+            utils.split_list_values([declaration["group"]]) if "group" in declaration else []
+        )
+        for key in self.keys:
+            field = model._meta.get_field(key)
+            if not field.concrete or field.many_to_many:
+                raise ValueError(f"Rollup '{name}' cannot be grouped by '{key}'")
+        
+        self.period = None
+        if "timeseries" in declaration:
+            self.period = Periods.from_query_value(declaration["timeseries"], model, censor)
+            if "__" in self.period.field:
+                raise ValueError(f"Periods of rollup '{name}' must use a field of the model")
+        if not self.keys and self.period is None:
+            raise ValueError(f"Rollup '{name}' must declare 'group' or 'timeseries'")
+        
+        self.aggregations = [
+            Aggregation.from_query_value(a, model, censor)
+            for a in utils.split_list_values([declaration["aggregate"]])
+        ]
+        for a in self.aggregations:
+            if a.func not in DECOMPOSABLE or a.filters:
+                raise ValueError(
+                    f"Aggregation '{a.to}' of rollup '{name}' must use 'count', 'sum', 'max' or "
+                    f"'min', without filters"
+                )
+        
+        self.rollup_model = self._rollup_model()
+    
+    
+    def _rollup_model(self) -> Type[models.Model]:
+        """Create the unmanaged model of the table of the rollup."""
+        meta = type("Meta", (), {
+            "app_label": "dgeq_rollups", "db_table": self.table, "managed": False,
+            "apps": Apps(),
+        })
+        attrs = {"__module__": __name__, "Meta": meta}
+        for key in self.keys:
+            attrs[key] = _column(self.model._meta.get_field(key))
+        if self.period is not None:
+            attrs[self.period.field] = _column(self.model._meta.get_field(self.period.field))
+        for a in self.aggregations:
+            if a.func is models.Count:
+                attrs[a.to] = models.BigIntegerField(null=True)
+            else:
+                attrs[a.to] = _column(
+                    utils.target_field(a.field.replace("__", "."), self.model)
+                )
+        
+        name = "".join(w.title() for w in self.name.split("_"))
+        return type(f"{self.model.__name__}{name}Rollup", (models.Model,), attrs)
+    
+    
+    def queryset(self, using: str = None) -> QuerySet:
+        """Return a `QuerySet` on the table of the rollup."""
+        return self.rollup_model._default_manager.using(using).all()
+    
+    
+    def built(self, connection: BaseDatabaseWrapper, cached: bool = True) -> bool:
+        """Return whether the table of the rollup exists.
+        
+        Existence is cached once the table has been found. A missing table is
+        looked for again after `MISSING_TABLE_TIMEOUT`, or on every call if
+        `cached` is `False`."""
+        key = (connection.alias, self.table)
+        if key in _BUILT:
+            return True
+        missing = _MISSING.get(key)
+        if cached and missing is not None and time.monotonic() - missing <= MISSING_TABLE_TIMEOUT:
+            return False
+        
+        with connection.cursor() as cursor:
+            if self.table not in connection.introspection.table_names(cursor):
+                _MISSING[key] = time.monotonic()
+                return False
+        _MISSING.pop(key, None)
+        _BUILT.add(key)
+        return True
+    
+    
+    def fresh(self, connection: BaseDatabaseWrapper) -> bool:
+        """Return whether every change logged for the rollup has been
+        aggregated."""
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT 1 FROM {qn(CHANGES_TABLE)} WHERE {qn('rollup')} = %s",
+                [self.table]
+            )
+            return cursor.fetchone() is None
+    
+    
+    def expression(self, aggregation: Aggregation) -> Optional[models.Expression]:
+        """Return the expression computing `aggregation` from the stored
+        values, or `None` if it cannot be computed from them."""
+        stored = {(a.field, a.func): a.to for a in self.aggregations}
+        if aggregation.func in DECOMPOSABLE:
+            to = stored.get((aggregation.field, aggregation.func))
+            return DECOMPOSABLE[aggregation.func](to) if to is not None else None
+        
+        if aggregation.func is models.Avg:
+            total = stored.get((aggregation.field, models.Sum))
+            count = stored.get((aggregation.field, models.Count))
+            if total is None or count is None:
+                return None
+            return ExpressionWrapper(
+                Cast(models.Sum(total), models.FloatField()) / NullIf(models.Sum(count), 0),
+                output_field=models.FloatField()
+            )
+        
+        return None
+    
+    
+    def _groupable(self, query: 'GenericQuery', field: str, names: Set[str]) -> bool:
+        """Return whether the groups of the rollup can be grouped by
+        `field`."""
+        utils.check_field(field, query.model, query.censor, names)
+        return (
+            field.split(".")[0] in self.keys
+            and not utils.spans_many(field, query.model, names)
+        )
+    
+    
+    def _filterable(self, query: 'GenericQuery', field: str, value: str,
+                    names: Set[str]) -> bool:
+        """Return whether the groups of the rollup can be filtered by `field`
+        using `value`."""
+        if field in names:
+            return True
+        
+        utils.check_field(field, query.model, query.censor, names)
+        if field.split(".")[0] in self.keys:
+            return not utils.spans_many(field, query.model, names)
+        
+        # Date parts are ranges of whole periods if the stored periods nest
+        # into them
+        if self.period is not None and field == self.period.field:
+            target = utils.target_field(field, query.model, names)
+            f = Filter(field, value, query.case, target)
+            return f.date_part in NESTED_INTERVALS[self.period.interval]
+        
+        return False
+    
+    
+    def answers(self, query: 'GenericQuery') -> bool:
+        """Return whether the rollup can answer `query`.
+        
+        The query must group the rows by fields of the groups of the rollup
+        (or by fields related to them) or by periods the stored periods nest
+        into, then only use decomposable aggregations (`count`, `sum`, `max`,
+        `min` and `avg` if both the sum and the count of the field are
+        stored). Filters must be on the groups, on the whole stored periods
+        (date parts) or on the aggregations. `c:case`, `c:time` and
+        `c:evaluate` can be used anywhere, `c:count`, `c:show`, `c:sort`,
+        `c:start` and `c:limit` only after the aggregations."""
+        names = set()
+        grouped = aggregated = False
+        try:
+            for field, values in query._query_dict_list:
+                for command in (c for c in DGEQ_COMMANDS if re.match(c.regex, field)):
+                    if isinstance(command, Filtering):
+                        if not all(
+                            self._filterable(query, field, v, names)
+                            for v in utils.split_list_values(values)
+                        ):
+                            return False
+                    
+                    elif isinstance(command, Group):
+                        if aggregated or not all(
+                            self._groupable(query, f, names)
+                            for f in utils.split_list_values(values)
+                        ):
+                            return False
+                        grouped = True
+                    
+                    elif isinstance(command, TimeSeries):
+                        periods = Periods.from_query_value(
+                            values[-1], query.model, query.censor, names
+                        )
+                        if (aggregated or self.period is None
+                                or periods.field != self.period.field
+                                or periods.interval not in NESTED_INTERVALS[self.period.interval]):
+                            return False
+                        names.add(periods.to)
+                        grouped = True
+                    
+                    elif isinstance(command, Aggregate):
+                        if not grouped:
+                            return False
+                        for value in utils.split_list_values(values):
+                            a = Aggregation.from_query_value(
+                                value, query.model, query.censor, names, query.case
+                            )
+                            if a.filters or self.expression(a) is None:
+                                return False
+                            names.add(a.to)
+                        aggregated = True
+                    
+                    elif isinstance(command, (Count, Show, Sort, Subset)):
+                        if not aggregated:
+                            return False
+                    
+                    elif not isinstance(command, (Case, Evaluate, Time)):
+                        return False
+        
+        # Invalid queries are evaluated as usual to report the error
+        except DgeqError:
+            return False
+        
+        return aggregated
+    
+    
+    def _key_columns(self) -> Dict[str, str]:
+        """Return the columns of the table storing the groups, by name of the
+        values grouping the rows of `model`."""
+        columns = {k: self.rollup_model._meta.get_field(k).attname for k in self.keys}
+        if self.period is not None:
+            columns[self.period.to] = self.period.field
+        return columns
+    
+    
+    def _aggregate(self, queryset: QuerySet) -> List[Dict[str, Any]]:
+        """Return the groups of the rows of `queryset` and their aggregations,
+        as `dict` mapping the columns of the table to their values."""
+        columns = self._key_columns()
+        queryset = queryset.order_by()
+        if self.period is not None:
+            queryset = self.period.apply(queryset)
+        queryset = queryset.values(*columns).annotate(**dict(a.get() for a in self.aggregations))
+        return [{columns.get(k, k): v for k, v in row.items()} for row in queryset]
+    
+    
+    def log(self, connection: BaseDatabaseWrapper, instance: models.Model, stored: bool):
+        """Log the group of `instance` as modified, using its `stored` values
+        (read from the database) or the values of the instance otherwise."""
+        attnames = [self.model._meta.get_field(k).attname for k in self.keys]
+        if not attnames:
+            groups = [[]]
+        elif stored:
+            groups = self.model._default_manager.using(connection.alias).filter(
+                pk=instance.pk
+            ).values_list(*attnames)
+        else:
+            groups = [[getattr(instance, a) for a in attnames]]
+        
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for group in groups:
+                cursor.execute(
+                    f"INSERT INTO {qn(CHANGES_TABLE)} ({qn('rollup')}, {qn('group')}) "
+                    f"VALUES (%s, %s)",
+                    [self.table, json.dumps(list(group), cls=DjangoJSONEncoder)]
+                )
+    
+    
+    def _store(self, queryset: QuerySet, using: str) -> int:
+        """Aggregate the rows of `queryset` into the table, return the number of
+        groups."""
+        groups = self._aggregate(queryset)
+        self.rollup_model._default_manager.using(using).bulk_create(
+            [self.rollup_model(**group) for group in groups], batch_size=CHUNK_SIZE
+        )
+        return len(groups)
+    
+    
+    def refresh(self, using: str) -> int:
+        """Recompute the groups logged as modified since the last refresh,
+        building the table if it does not exist. Return the number of
+        recomputed groups.
+        
+        Groups are recomputed from every row of the model belonging to them,
+        for every period. If the rollup is not grouped by fields, every row is
+        aggregated again."""
+        connection = connections[using]
+        if not self.built(connection, cached=False):
+            return self.build(using)
+        
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {qn('id')}, {qn('group')} FROM {qn(CHANGES_TABLE)} "
+                f"WHERE {qn('rollup')} = %s",
+                [self.table]
+            )
+            logged = cursor.fetchall()
+        if not logged:
+            return 0
+        
+        rows = self.model._default_manager.using(using).all()
+        fields = [self.model._meta.get_field(k) for k in self.keys]
+        groups = {tuple(json.loads(g)) for _, g in logged}
+        count = 0
+        if not fields:
+            self.queryset(using).delete()
+            count = self._store(rows, using)
+        else:
+            groups = [
+                {f.attname: f.to_python(v) for f, v in zip(fields, g)} for g in groups
+            ]
+            columns = [self.rollup_model._meta.get_field(k).attname for k in self.keys]
+            for i in range(0, len(groups), CHUNK_SIZE):
+                chunk = groups[i:i + CHUNK_SIZE]
+                self.queryset(using).filter(reduce(Q.__or__, [
+                    Q(**{c: g[f.attname] for c, f in zip(columns, fields)}) for g in chunk
+                ])).delete()
+                count += self._store(
+                    rows.filter(reduce(Q.__or__, [Q(**g) for g in chunk])), using
+                )
+        
+        ids = [i for i, _ in logged]
+        with connection.cursor() as cursor:
+            for i in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[i:i + CHUNK_SIZE]
+                cursor.execute(
+                    f"DELETE FROM {qn(CHANGES_TABLE)} WHERE {qn('id')} IN "
+                    f"({', '.join(['%s'] * len(chunk))})",
+                    chunk
+                )
+        return count
+    
+    
+    def build(self, using: str) -> int:
+        """(Re)create the table of the rollup and aggregate every row. Return
+        the number of groups."""
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        columns = list()
+        for field in self.rollup_model._meta.local_fields:
+            if field.primary_key:
+                columns.append(
+                    f"{qn(field.column)} {field.db_type(connection)} PRIMARY KEY "
+                    f"{field.db_type_suffix(connection) or ''}".strip()
+                )
+            else:
+                columns.append(f"{qn(field.column)} {field.db_type(connection)} NULL")
+        
+        self.drop(using)
+        with connection.cursor() as cursor:
+            if CHANGES_TABLE not in connection.introspection.table_names(cursor):
+                pk = models.AutoField(primary_key=True)
+                cursor.execute(
+                    f"CREATE TABLE {qn(CHANGES_TABLE)} ("
+                    f"{qn('id')} {pk.db_type(connection)} PRIMARY KEY "
+                    f"{pk.db_type_suffix(connection) or ''}, "
+                    f"{qn('rollup')} varchar(255) NOT NULL, {qn('group')} text NOT NULL)"
+                )
+                cursor.execute(
+                    f"CREATE INDEX {qn(CHANGES_TABLE + '_rollup')} "
+                    f"ON {qn(CHANGES_TABLE)} ({qn('rollup')})"
+                )
+            cursor.execute(f"CREATE TABLE {qn(self.table)} ({', '.join(columns)})")
+        _MISSING.pop((connection.alias, self.table), None)
+        _BUILT.add((connection.alias, self.table))
+        
+        return self._store(self.model._default_manager.using(using).all(), using)
+    
+    
+    def drop(self, using: str):
+        """Drop the table of the rollup and its logged changes, if they
+        exist."""
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        _BUILT.discard((connection.alias, self.table))
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+            if CHANGES_TABLE in tables:
+                cursor.execute(
+                    f"DELETE FROM {qn(CHANGES_TABLE)} WHERE {qn('rollup')} = %s", [self.table]
+                )
+            if self.table in tables:
+                cursor.execute(f"DROP TABLE {qn(self.table)}")
+
+
+
+def _model(key: object) -> Type[models.Model]:
+    """Return the model corresponding to a key of `DGEQ_ROLLUPS`."""
+    if isinstance(key, type):
+        return key
+    try:
+        return apps.get_model(key)
+    except (LookupError, ValueError):
+        return utils.import_class(key)
+
+
+
+def declared_rollups(model: Type[models.Model]) -> List[Rollup]:
+    """Return the rollups of `model` declared in `DGEQ_ROLLUPS`."""
+    declared = utils.get_model_setting(DGEQ_ROLLUPS, model, {})
+    result = list()
+    for name, declaration in declared.items():
+        key = (model, name, tuple(sorted(declaration.items())))
+        if key not in _ROLLUPS:
+            _ROLLUPS[key] = Rollup(model, name, declaration)
+        result.append(_ROLLUPS[key])
+    return result
+
+
+
+def rolled_up_models() -> List[Type[models.Model]]:
+    """Return every model declaring rollups."""
+    return [_model(k) for k in DGEQ_ROLLUPS]
+
+
+
+def plan(query: 'GenericQuery') -> Optional[Rollup]:
+    """Return the first rollup of `query.model` which can answer `query` (see
+    `Rollup.answers()`), whose table has been built and has no pending change
+    (see `Rollup.fresh()`), `None` if there is none."""
+    connection = connections[query.queryset.db]
+    for rollup in declared_rollups(query.model):
+        if rollup.answers(query) and rollup.built(connection) and rollup.fresh(connection):
+            return rollup
+    return None
+
+
+
+def _log(sender: Type[models.Model], instance: models.Model, using: str, stored: bool):
+    """Log the groups of `instance` as modified in the built rollups of
+    `sender`."""
+    connection = connections[using]
+    for rollup in declared_rollups(sender) if DGEQ_ROLLUPS else ():
+        # A table built by another process must be seen by the next write
+        if rollup.built(connection, cached=False):
+            rollup.log(connection, instance, stored)
+
+
+
+def _on_pre_save(sender: Type[models.Model], instance: models.Model, raw: bool, using: str,
+                 **kwargs):
+    if not raw and instance.pk is not None:
+        _log(sender, instance, using, True)
+
+
+
+def _on_post_save(sender: Type[models.Model], instance: models.Model, raw: bool, using: str,
+                  **kwargs):
+    if not raw:
+        _log(sender, instance, using, False)
+
+
+
+def _on_pre_delete(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    _log(sender, instance, using, True)
+
+
+
+pre_save.connect(_on_pre_save, dispatch_uid="dgeq_rollups_pre_save")
+post_save.connect(_on_post_save, dispatch_uid="dgeq_rollups_post_save")
+pre_delete.connect(_on_pre_delete, dispatch_uid="dgeq_rollups_pre_delete")
+
+
+
+class RollupAggregate(Aggregate):
+    """Compute the aggregations of the groups from the stored aggregations of
+    a rollup, see `Aggregate`.
+    
+    The name of the rollup is added in the field `source` of the result."""
+    
+    
+    def __call__(self, query: 'GenericQuery', field: str, values: List[str]):
+        aggregations = [
+            Aggregation.from_query_value(
+                a, query.model, query.censor, query.arbitrary_fields, query.case
+            )
+            for a in utils.split_list_values(values)
+        ]
+        query.queryset = query.queryset.annotate(**{
+            a.to: query.rollup.expression(a) for a in aggregations
+        })
+        query.arbitrary_fields |= {a.to for a in aggregations}
+        query.result["source"] = query.rollup.name
+
+
+# Commands replaced when answering a query from a rollup. Every other command
+# is applied as is on the `QuerySet` of the rollup.
+ROLLUP_COMMANDS = {
+    Aggregate: RollupAggregate(),
+}
+
+
+
+def rollup_command(query: 'GenericQuery', command: Command) -> Command:
+    """Return the command to use in place of `command` to answer `query` from
+    its rollup."""
+    return ROLLUP_COMMANDS.get(type(command), command)
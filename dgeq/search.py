@@ -0,0 +1,223 @@
+from typing import Iterable, List, Set, Tuple, Type
+
+from django.conf import settings
+from django.db import models
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import F, Func
+from django.db.models.expressions import Col
+from django.db.models.lookups import IContains
+
+from . import utils
+
+
+# Dictionary mapping a model (or its dotted path) to the list of its fields on
+# which full-text search is enabled.
+DGEQ_FULL_TEXT_FIELDS = getattr(settings, "DGEQ_FULL_TEXT_FIELDS", {})
+
+# Text search configuration used on PostgreSQL (e.g. `"english"`). If `None`,
+# PostgreSQL's `default_text_search_config` is used.
+DGEQ_FULL_TEXT_CONFIG = getattr(settings, "DGEQ_FULL_TEXT_CONFIG", None)
+
+# FTS5 shadow tables known to exist, by database alias and name
+_BUILT: Set[Tuple[str, str]] = set()
+
+
+
+def full_text_fields(model: Type[models.Model]) -> List[str]:
+    """Return the fields of `model` on which full-text search is enabled."""
+    return list(utils.get_model_setting(DGEQ_FULL_TEXT_FIELDS, model, ()))
+
+
+
+def is_full_text(field: models.Field) -> bool:
+    """Return `True` if full-text search is enabled on `field`, `False`
+    otherwise."""
+    return (
+        field is not None and hasattr(field, "model")
+        and field.name in full_text_fields(field.model)
+    )
+
+
+
+def fts_table(model: Type[models.Model]) -> str:
+    """Return the name of the SQLite FTS5 shadow table of `model`."""
+    return f"{model._meta.db_table}_dgeq_fts"
+
+
+
+def fts_built(model: Type[models.Model], connection: BaseDatabaseWrapper) -> bool:
+    """Return whether the SQLite FTS5 shadow table of `model` exists.
+    
+    Existence is cached once the table has been found."""
+    key = (connection.alias, fts_table(model))
+    if key not in _BUILT:
+        with connection.cursor() as cursor:
+            if fts_table(model) not in connection.introspection.table_names(cursor):
+                return False
+        _BUILT.add(key)
+    return True
+
+
+
+def fts5_query(column: str, value: str) -> str:
+    """Return a FTS5 query matching the rows whose `column` contains every
+    word of `value`.
+    
+    Words are quoted so that characters of the FTS5 query syntax are matched
+    as is, the same way as PostgreSQL's `plainto_tsquery()`."""
+    words = " ".join('"' + w.replace('"', '""') + '"' for w in value.split()) or '""'
+    return f'"{column}" : ({words})'
+
+
+
+def _ts_config(params: list) -> str:
+    """Return the SQL of the text search configuration used on PostgreSQL,
+    appending its parameter to `params`."""
+    if DGEQ_FULL_TEXT_CONFIG is None:
+        return ""
+    params.append(DGEQ_FULL_TEXT_CONFIG)
+    return "%s::regconfig, "
+
+
+
+class FullTextSearch(IContains):
+    """Lookup matching the rows whose field contains every word of the value
+    using the full-text search engine of the database.
+    
+    On PostgreSQL, compiles to `to_tsvector(field) @@ plainto_tsquery(value)`
+    (the SQL of `SearchVector` and `SearchQuery`). On SQLite, searches the
+    FTS5 shadow table of the model (see `build_fts_table()`). Other databases
+    fall back to `icontains`."""
+    
+    lookup_name = "dgeq_search"
+    
+    
+    def as_postgresql(self, compiler, connection: BaseDatabaseWrapper):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        params = list()
+        vector = f"to_tsvector({_ts_config(params)}{lhs_sql})"
+        params += lhs_params
+        query = f"plainto_tsquery({_ts_config(params)}%s)"
+        params.append(self.rhs)
+        return f"{vector} @@ {query}", params
+    
+    
+    def as_sqlite(self, compiler, connection: BaseDatabaseWrapper):
+        if not isinstance(self.lhs, Col):
+            return self.as_sql(compiler, connection)
+        
+        qn = connection.ops.quote_name
+        model = self.lhs.target.model
+        table = qn(fts_table(model))
+        pk = f"{qn(self.lhs.alias)}.{qn(model._meta.pk.column)}"
+        return (
+            f"{pk} IN (SELECT rowid FROM {table} WHERE {table} MATCH %s)",
+            [fts5_query(self.lhs.target.column, self.rhs)],
+        )
+
+
+
+models.CharField.register_lookup(FullTextSearch)
+models.TextField.register_lookup(FullTextSearch)
+
+
+
+class Relevance(Func):
+    """Relevance of the rows for a full-text search of `value` on `field`,
+    higher values being more relevant.
+    
+    Uses `ts_rank()` (the SQL of `SearchRank`) on PostgreSQL, and `bm25()` on
+    the FTS5 shadow table on SQLite. Always `0` on other databases."""
+    
+    output_field = models.FloatField()
+    
+    
+    def __init__(self, field: str, value: str):
+        super().__init__(F(field))
+        self.value = value
+    
+    
+    def as_sql(self, compiler, connection: BaseDatabaseWrapper, **extra_context):
+        return "0.0", []
+    
+    
+    def as_postgresql(self, compiler, connection: BaseDatabaseWrapper, **extra_context):
+        field_sql, field_params = compiler.compile(self.source_expressions[0])
+        params = list()
+        vector = f"to_tsvector({_ts_config(params)}{field_sql})"
+        params += field_params
+        query = f"plainto_tsquery({_ts_config(params)}%s)"
+        params.append(self.value)
+        return f"ts_rank({vector}, {query})", params
+    
+    
+    def as_sqlite(self, compiler, connection: BaseDatabaseWrapper, **extra_context):
+        col = self.source_expressions[0]
+        if not isinstance(col, Col):
+            return self.as_sql(compiler, connection)
+        
+        qn = connection.ops.quote_name
+        model = col.target.model
+        table = qn(fts_table(model))
+        pk = f"{qn(col.alias)}.{qn(model._meta.pk.column)}"
+        return (
+            f"(SELECT -bm25({table}) FROM {table} "
+            f"WHERE {table} MATCH %s AND {table}.rowid = {pk})",
+            [fts5_query(col.target.column, self.value)],
+        )
+
+
+
+def build_fts_table(model: Type[models.Model], fields: Iterable[str],
+                    connection: BaseDatabaseWrapper):
+    """(Re)create the SQLite FTS5 shadow table of `model` indexing `fields`,
+    along with the triggers keeping it up to date, and index every existing
+    row.
+    
+    The shadow table is an external content table using the primary key of
+    `model` (which must be an integer) as `rowid`."""
+    qn = connection.ops.quote_name
+    table = fts_table(model)
+    source = qn(model._meta.db_table)
+    pk = model._meta.pk.column
+    columns = [utils.get_field(f, model).column for f in fields]
+    
+    names = ", ".join(qn(c) for c in columns)
+    new = ", ".join(f"new.{qn(c)}" for c in columns)
+    old = ", ".join(f"old.{qn(c)}" for c in columns)
+    insert = f"INSERT INTO {qn(table)}(rowid, {names}) VALUES (new.{qn(pk)}, {new});"
+    delete = (
+        f"INSERT INTO {qn(table)}({qn(table)}, rowid, {names}) "
+        f"VALUES ('delete', old.{qn(pk)}, {old});"
+    )
+    
+    with connection.cursor() as cursor:
+        drop_fts_table(model, connection)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {qn(table)} USING fts5("
+            f"{names}, content={source}, content_rowid={qn(pk)})"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {qn(table + '_ai')} AFTER INSERT ON {source} BEGIN {insert} END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {qn(table + '_ad')} AFTER DELETE ON {source} BEGIN {delete} END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {qn(table + '_au')} AFTER UPDATE ON {source} "
+            f"BEGIN {delete} {insert} END"
+        )
+        cursor.execute(f"INSERT INTO {qn(table)}({qn(table)}) VALUES ('rebuild')")
+
+
+
+def drop_fts_table(model: Type[models.Model], connection: BaseDatabaseWrapper):
+    """Drop the SQLite FTS5 shadow table of `model` and its triggers, if they
+    exist."""
+    qn = connection.ops.quote_name
+    table = fts_table(model)
+    _BUILT.discard((connection.alias, table))
+    with connection.cursor() as cursor:
+        for suffix in ("_ai", "_ad", "_au"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {qn(table + suffix)}")
+        cursor.execute(f"DROP TABLE IF EXISTS {qn(table)}")
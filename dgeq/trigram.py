@@ -0,0 +1,204 @@
+import threading
+from typing import Dict, Iterable, Optional, Set, Type
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import utils, versions
+
+
+# Dictionary mapping a model (or its dotted path) to the list of its fields
+# indexed by an in-memory trigram index. Substring (`*` / `~`) and prefix (`^`)
+# filters on these fields are resolved from the index into a set of primary
+# keys, avoiding a `LIKE` scan. Only use it on small tables.
+DGEQ_TRIGRAM_INDEXES = getattr(settings, "DGEQ_TRIGRAM_INDEXES", {})
+
+# Lookups which can be resolved by a trigram index, mapped to whether they are
+# case-sensitive and whether they only match prefixes.
+TRIGRAM_LOOKUPS = {
+    "contains":    (True, False),
+    "icontains":   (False, False),
+    "startswith":  (True, True),
+    "istartswith": (False, True),
+}
+
+# Trigram indexes already built, by model
+_INDEXES: Dict[Type[models.Model], 'TrigramIndex'] = dict()
+_INDEXES_LOCK = threading.Lock()
+
+
+
+def trigrams(value: str) -> Set[str]:
+    """Return the set of trigrams (substrings of length 3) of `value`."""
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+
+class TrigramIndex:
+    """In-memory trigram index over some fields of a model.
+    
+    The index is built on creation, and kept up to date once the transactions
+    saving or deleting rows of the model (`post_save` and `post_delete`
+    signals) are committed. Changes made by other processes are detected
+    through the version of the model (see `versions.Stamp`), the index is
+    then built again on its next use. Updates not sending these signals (e.g.
+    `QuerySet.update()`, `bulk_create()`) are not seen by the index, use
+    `invalidate()` after such operations.
+    
+    Fields:
+        * `model` (`Type[models.Model]`) - Model indexed.
+        * `fields` (`List[str]`) - Fields of `model` indexed.
+        * `vendor` (`str`) - Vendor of the database of the model, whose case
+                handling is used by `search()`.
+        * `stamp` (`versions.Stamp`) - Version of the rows indexed.
+    """
+    
+    
+    def __init__(self, model: Type[models.Model], fields: Iterable[str]):
+        self.model = model
+        self.fields = list(fields)
+        self.vendor = connections[model._default_manager.db].vendor
+        self.stamp = versions.Stamp(model)
+        self._lock = threading.Lock()
+        # Values of the fields by primary key, and primary keys by trigram of
+        # the lower-cased values, for each field.
+        self._values: Dict[str, Dict[object, str]] = {f: dict() for f in self.fields}
+        self._grams: Dict[str, Dict[str, Set[object]]] = {f: dict() for f in self.fields}
+        
+        for pk, *values in model._default_manager.values_list("pk", *self.fields):
+            for field, value in zip(self.fields, values):
+                self._add(field, pk, value)
+    
+    
+    def _add(self, field: str, pk: object, value: Optional[str]):
+        """Index `value` as the value of `field` for the row `pk`."""
+        if value is None:
+            return
+        self._values[field][pk] = value
+        for gram in trigrams(value.lower()):
+            self._grams[field].setdefault(gram, set()).add(pk)
+    
+    
+    def _remove(self, field: str, pk: object):
+        """Remove the value of `field` for the row `pk` from the index."""
+        value = self._values[field].pop(pk, None)
+        if value is None:
+            return
+        for gram in trigrams(value.lower()):
+            pks = self._grams[field][gram]
+            pks.discard(pk)
+            if not pks:
+                del self._grams[field][gram]
+    
+    
+    def update(self, pk: object, values: Dict[str, Optional[str]]):
+        """Update the index with the `values` of the fields of the row `pk`, or
+        remove this row if `values` is `None`."""
+        with self._lock:
+            for field in self.fields:
+                self._remove(field, pk)
+                if values is not None:
+                    self._add(field, pk, values[field])
+            self.stamp.advance()
+    
+    
+    def search(self, field: str, value: str, lookup: str) -> Set[object]:
+        """Return the primary keys of the rows matching `lookup` (see
+        `TRIGRAM_LOOKUPS`) with `value` on `field`.
+        
+        Candidates are retrieved through the trigrams of `value`, then checked
+        against the indexed values. Values shorter than a trigram are checked
+        against every indexed value. Values are compared with the case handling
+        of the `LIKE` of the database (see `utils.like_fold()`)."""
+        case, prefix = TRIGRAM_LOOKUPS[lookup]
+        needle = utils.like_fold(value, case, self.vendor)
+        
+        with self._lock:
+            values = self._values[field]
+            grams = trigrams(value.lower())
+            if grams:
+                postings = sorted(
+                    (self._grams[field].get(g, set()) for g in grams), key=len
+                )
+                candidates = set.intersection(*postings)
+            else:
+                candidates = values.keys()
+            
+            matches = set()
+            for pk in candidates:
+                haystack = utils.like_fold(values[pk], case, self.vendor)
+                if haystack.startswith(needle) if prefix else needle in haystack:
+                    matches.add(pk)
+        
+        return matches
+
+
+
+def get_index(field: Optional[models.Field]) -> Optional[TrigramIndex]:
+    """Return the trigram index of the model of `field` if `field` is indexed,
+    `None` otherwise.
+    
+    The index is built on the first call for a given model, and built again
+    once it is outdated (see `versions.Stamp.fresh()`)."""
+    if field is None or not hasattr(field, "model"):
+        return None
+    
+    model = field.model
+    if field.name not in utils.get_model_setting(DGEQ_TRIGRAM_INDEXES, model, ()):
+        return None
+    
+    index = _INDEXES.get(model)
+    if index is None or not index.stamp.fresh():
+        with _INDEXES_LOCK:
+            if _INDEXES.get(model) is index:
+                fields = utils.get_model_setting(DGEQ_TRIGRAM_INDEXES, model)
+                _INDEXES[model] = TrigramIndex(model, fields)
+            index = _INDEXES[model]
+    
+    return index
+
+
+
+def invalidate(model: Type[models.Model] = None):
+    """Drop the trigram index of `model` (or every index if `model` is `None`),
+    it will be built again on its next use."""
+    with _INDEXES_LOCK:
+        for m in [model] if model is not None else list(_INDEXES):
+            _INDEXES.pop(m, None)
+
+
+
+def _on_change(sender: Type[models.Model], instance: models.Model, using: str,
+               deleted: bool):
+    fields = utils.get_model_setting(DGEQ_TRIGRAM_INDEXES, sender, ())
+    if not fields:
+        return
+    
+    # Values are copied now, the instance may be modified before the commit
+    pk = instance.pk
+    values = None if deleted else {f: getattr(instance, f) for f in fields}
+    
+    def apply():
+        index = _INDEXES.get(sender)
+        if index is not None:
+            index.update(pk, values)
+        else:
+            versions.increment(sender)
+    
+    transaction.on_commit(apply, using=using)
+
+
+
+def _on_save(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    _on_change(sender, instance, using, False)
+
+
+
+def _on_delete(sender: Type[models.Model], instance: models.Model, using: str, **kwargs):
+    _on_change(sender, instance, using, True)
+
+
+
+post_save.connect(_on_save, dispatch_uid="dgeq_trigram_post_save")
+post_delete.connect(_on_delete, dispatch_uid="dgeq_trigram_post_delete")
@@ -1,10 +1,13 @@
 import datetime
-from typing import Union
+from functools import lru_cache
+from typing import Any, Callable, Optional, Type, Union
 
 from dateutil.parser import isoparse
 from django.conf import settings
+from django.db import models
+from django.utils import timezone
 
-from .utils import import_callable
+from .utils import import_callable, import_class
 
 
 Nothing = type(Ellipsis)
@@ -43,6 +46,29 @@ def none_parser(value: str) -> Union[Nothing, None]:
     return None if value == "" else ...
 
 
+
+def bool_parser(value: str) -> Union[Nothing, bool]:
+    """Try to parse the given value as a boolean ('true' or 'false', case
+    insensitive)."""
+    return {"true": True, "false": False}.get(value.lower(), ...)
+
+
+
+def str_parser(value: str) -> str:
+    """Return the given value unchanged."""
+    return value
+
+
+
+def aware_datetime_parser(value: str) -> Union[Nothing, datetime.datetime]:
+    """Try to parse the given value as a ISO 8601's datetime, making it aware
+    in the current time zone if it is naive and `USE_TZ` is `True`."""
+    value = datetime_parser(value)
+    if value is not ... and settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
 # Parsers for query string values. Parsers must ba a callable or a dotted path
 # (E.G. `dgeq.parsers.none_parser`) to a callable which return either the parsed
 # type of Ellipsis if no type were matched. If every parser return Ellipsis, the
@@ -55,3 +81,65 @@ DGEQ_TYPE_PARSERS = [
         datetime_parser,
     ])
 ]
+
+# Parsers used for the values of filters according to the type of the
+# targeted field. Keys must be a field class or the dotted path to a field
+# class, values a list of parsers like `DGEQ_TYPE_PARSERS`. The first parser not
+# returning Ellipsis is used, if every parser return Ellipsis, the value is
+# invalid for this field. Subclasses of a field class use its parsers.
+#
+# Fields not matching any class (and arbitrary fields, like annotations) use
+# `DGEQ_TYPE_PARSERS`.
+DGEQ_FIELD_PARSERS = {
+    import_class(k): [import_callable(p) for p in v]
+    for k, v in getattr(settings, "DGEQ_FIELD_PARSERS", {
+        models.BooleanField:  [none_parser, bool_parser, int_parser],
+        models.IntegerField:  [none_parser, int_parser, float_parser],
+        models.FloatField:    [none_parser, int_parser, float_parser],
+        models.DecimalField:  [none_parser, int_parser, float_parser],
+        models.DateTimeField: [none_parser, aware_datetime_parser],
+        models.DateField:     [none_parser, datetime_parser],
+        models.CharField:     [none_parser, str_parser],
+        models.TextField:     [none_parser, str_parser],
+    }).items()
+}
+
+
+
+def generic_parser(value: str) -> Any:
+    """Parse the given value with the first parser of `DGEQ_TYPE_PARSERS` not
+    returning Ellipsis, return the value unchanged if every parser does."""
+    for parser in DGEQ_TYPE_PARSERS:
+        v = parser(value)
+        if v is not ...:
+            return v
+    return value
+
+
+
+@lru_cache(maxsize=None)
+def field_parser(field_class: Optional[Type[models.Field]]) -> Callable[[str], Any]:
+    """Return the parser used for the values of a field of class
+    `field_class`.
+    
+    The returned parser returns Ellipsis if the value is invalid for this type
+    of field. `generic_parser` is returned if `field_class` is `None` or does
+    not correspond to any entry of `DGEQ_FIELD_PARSERS`."""
+    parsers = next(
+        (DGEQ_FIELD_PARSERS[c] for c in getattr(field_class, "__mro__", ())
+         if c in DGEQ_FIELD_PARSERS),
+        None
+    )
+    if parsers is None:
+        return generic_parser
+    
+    
+    def parser(value: str) -> Any:
+        for p in parsers:
+            v = p(value)
+            if v is not ...:
+                return v
+        return ...
+    
+    
+    return parser
@@ -1,4 +1,5 @@
 import operator
+import string
 from collections import abc
 from functools import reduce
 from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Type, Union
@@ -7,6 +8,7 @@ from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
 from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.backends.base.base import BaseDatabaseWrapper
 from django.db.models import Field
 from django.http import QueryDict
 from django.utils.module_loading import import_string
@@ -33,6 +35,9 @@ UNIQUE_FOREIGN_FIELD = (models.OneToOneRel, models.OneToOneField, models.Foreign
 
 Nothing = type(Ellipsis)
 
+# Translation table lowering ASCII letters only, like SQLite's `LIKE`
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
 # Typing of a command
 CommandType = Callable[['GenericQuery', str, List[str]], None]
 
@@ -55,6 +60,31 @@ ImportableCallable = Union[
 
 
 
+def like_fold(value: str, case: bool, vendor: str) -> str:
+    """Return `value` folded so that pattern lookups (`contains`, `startswith`,
+    `endswith` and their case-insensitive versions) can be evaluated in Python
+    the way the database `vendor` does, by comparing folded strings.
+    
+    `case` indicates whether the lookup is case-sensitive. SQLite's `LIKE`
+    ignores the case of ASCII letters only, even for case-sensitive lookups.
+    Other databases are assumed to compare case-sensitive lookups exactly, and
+    case-insensitive ones after lowering every letter."""
+    if vendor == "sqlite":
+        return value.translate(ASCII_LOWER)
+    return value if case else value.lower()
+
+
+
+def max_in_size(connection: BaseDatabaseWrapper) -> int:
+    """Return the maximum number of values given to a single `IN` on
+    `connection`."""
+    return min(
+        filter(None, (connection.ops.max_in_list_size(), connection.features.max_query_params)),
+        default=1000
+    )
+
+
+
 def import_class(o: Union[type, str]) -> type:
     """Take a dotted path to a class, and return the corresponding class.
     
@@ -173,6 +203,22 @@ def get_field(field: str, model: Type[models.Model]) -> models.Field:
 
 
 
+def get_model_setting(mapping: Dict[Union[Type[models.Model], str], Any],
+                      model: Type[models.Model], default: Any = None) -> Any:
+    """Return the value associated to `model` in a `dict` setting keyed by
+    models, or `default` if `model` is not in `mapping`.
+    
+    Keys can either be a `Model`, its dotted path (e.g.
+    `"django_dummy_app.models.Country"`) or its label (e.g.
+    `"django_dummy_app.Country"`)."""
+    names = (model, model._meta.label, f"{model.__module__}.{model.__name__}")
+    for key, value in mapping.items():
+        if key in names:
+            return value
+    return default
+
+
+
 def _check_field(fields: List[str], current_model: Type[models.Model], censor: Censor,
                  arbitrary_fields: Iterable[str] = ()) -> Tuple[Type[models.Model], str]:
     """Recursively check fields.
@@ -358,6 +404,78 @@ def is_one(field: models.Field) -> bool:
 
 
 
+def spans_many(field: str, model: Type[models.Model], arbitrary_fields: Iterable[str] = (),
+               sep: str = ".") -> bool:
+    """Return `True` if `field` spans a relation to multiple instances (see
+    `is_many()`), `False` otherwise.
+    
+    `field` must have been checked with `check_field()` beforehand.
+    
+    Parameters :
+        * `field` (`str`) - Name of the field.
+        * `model` (`Type[models.Model]`) - Model to retrieve the field from.
+        * `arbitrary_fields` (`Iterable[str]`) - Optional list of arbitrary
+          fields not present by default in the model, e.g. fields added by
+          annotations.
+        * `sep` (`str`) - Separator used for spanning relationship
+          lookup (default to `.`).
+    """
+    for token in field.split(sep):
+        if token in arbitrary_fields:
+            return False
+        
+        field_instance = get_field(token, model)
+        if is_many(field_instance):
+            return True
+        if not field_instance.is_relation:
+            return False
+        
+        model = field_instance.related_model
+        arbitrary_fields = ()
+    
+    return False
+
+
+
+def target_field(field: str, model: Type[models.Model], arbitrary_fields: Iterable[str] = (),
+                 sep: str = ".") -> Union[models.Field, None]:
+    """Return the concrete field whose values are compared when filtering on
+    `field`, or `None` if `field` is an arbitrary field.
+    
+    Relations are followed to the field they point to, e.g. filtering on a
+    foreign key compares the primary key of the related model.
+    
+    `field` must have been checked with `check_field()` beforehand.
+    
+    Parameters :
+        * `field` (`str`) - Name of the field.
+        * `model` (`Type[models.Model]`) - Model to retrieve the field from.
+        * `arbitrary_fields` (`Iterable[str]`) - Optional list of arbitrary
+          fields not present by default in the model, e.g. fields added by
+          annotations.
+        * `sep` (`str`) - Separator used for spanning relationship
+          lookup (default to `.`).
+    """
+    field_instance = None
+    for token in field.split(sep):
+        if token in arbitrary_fields:
+            return None
+        
+        if field_instance is not None:
+            model = field_instance.related_model
+        field_instance = get_field(token, model)
+        arbitrary_fields = ()
+    
+    while field_instance.is_relation:
+        field_instance = (
+            getattr(field_instance, "target_field", None)
+            or field_instance.related_model._meta.pk
+        )
+    
+    return field_instance
+
+
+
 def split_related_field(model: Type[models.Model], fields: Iterable[str],
                         arbitrary_fields: Iterable[str] = ()
                         ) -> Tuple[Set[str], Set[str], Set[str]]:
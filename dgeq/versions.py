@@ -0,0 +1,110 @@
+import time
+from typing import Optional, Type
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import models
+
+
+# Alias of the cache (in `CACHES`) storing the version of the models whose rows
+# are kept in memory (trigram indexes, memory and columnar tables). It must be
+# shared by every process (e.g. Memcached or Redis) for the changes made by a
+# process to be seen by the others. `None` only tracks changes made by the
+# current process.
+DGEQ_VERSION_CACHE = getattr(settings, "DGEQ_VERSION_CACHE", DEFAULT_CACHE_ALIAS)
+
+# Maximum age (in seconds) of the structures built from the rows of a model
+# before they are built again, `None` to keep them as long as their version is
+# current.
+DGEQ_IN_MEMORY_MAX_AGE = getattr(settings, "DGEQ_IN_MEMORY_MAX_AGE", None)
+
+# Prefix of every key used in the cache
+PREFIX = "dgeq:version"
+
+
+
+def _key(model: Type[models.Model]) -> str:
+    return f"{PREFIX}:{model._meta.label_lower}"
+
+
+
+def current(model: Type[models.Model]) -> Optional[int]:
+    """Return the version of the rows of `model`, `None` if versions are not
+    tracked."""
+    if DGEQ_VERSION_CACHE is None:
+        return None
+    
+    cache = caches[DGEQ_VERSION_CACHE]
+    version = cache.get(_key(model))
+    if version is None:
+        cache.add(_key(model), 0, None)
+        version = cache.get(_key(model))
+    return version
+
+
+
+def increment(model: Type[models.Model]) -> Optional[int]:
+    """Increment the version of the rows of `model` and return it, `None` if
+    versions are not tracked or if the version has been evicted in the
+    meantime."""
+    if DGEQ_VERSION_CACHE is None:
+        return None
+    
+    cache = caches[DGEQ_VERSION_CACHE]
+    cache.add(_key(model), 0, None)
+    try:
+        return cache.incr(_key(model))
+    except ValueError:
+        return None
+
+
+
+class Stamp:
+    """Version and creation time of a structure built from the rows of a
+    model.
+    
+    The stamp must be created before reading the rows, so that changes
+    committed while they are read make it outdated.
+    
+    Fields:
+        * `model` (`Type[models.Model]`) - Model whose rows are used.
+        * `version` (`Optional[int]`) - Version of the rows when the stamp was
+            created (see `current()`).
+        * `created` (`float`) - Creation time, from `time.monotonic()`.
+        * `outdated` (`bool`) - Whether a change of another process has been
+            missed by the structure.
+    """
+    
+    
+    def __init__(self, model: Type[models.Model]):
+        self.model = model
+        self.version = current(model)
+        self.created = time.monotonic()
+        self.outdated = False
+    
+    
+    def fresh(self) -> bool:
+        """Return whether the structure is still up to date: no other process
+        changed the rows of the model and `DGEQ_IN_MEMORY_MAX_AGE` is not
+        exceeded."""
+        if self.outdated:
+            return False
+        if DGEQ_IN_MEMORY_MAX_AGE is not None:
+            if time.monotonic() - self.created > DGEQ_IN_MEMORY_MAX_AGE:
+                return False
+        return self.version == current(self.model)
+    
+    
+    def advance(self):
+        """Increment the version of the model after a committed change already
+        applied to the structure.
+        
+        The structure stays up to date only if no other process changed the
+        model since its last version, it is outdated otherwise."""
+        version = increment(self.model)
+        if self.version is None and version is None:
+            return
+        if version is None or self.version is None or version != self.version + 1:
+            self.outdated = True
+        else:
+            self.version = version
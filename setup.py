@@ -46,7 +46,7 @@ setup(
     author='Coumes Quentin',
     author_email='coumes.quentin@gmail.com',
     url='https://github.com/qcoumes/dgeq',
-    packages=['dgeq'],
+    packages=['dgeq', 'dgeq.management', 'dgeq.management.commands'],
     install_requires=['django>=2.0.0', 'python-dateutil'],
     classifiers=CLASSIFIERS,
 )
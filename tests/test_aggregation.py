@@ -1,16 +1,22 @@
+import sqlite3
+import statistics
+from unittest import mock
+
 import django
 from django.contrib.auth.models import AnonymousUser
-from django.db import models
+from django.db import connection, models
 from django.db.models import Q
 from django.test import TestCase
 from packaging import version
 
 from dgeq import utils
-from dgeq.aggregations import Aggregation, Annotation, DistinctCount
-from dgeq.exceptions import InvalidCommandError
+from dgeq.aggregations import (Aggregation, Annotation, Buckets, DistinctCount, Median, P90,
+                               Percentile, Periods, WindowAnnotation,
+                               _register_sqlite_functions, get_function)
+from dgeq.exceptions import InvalidCommandError, UnknownFieldError
 from dgeq.filter import Filter
 from dgeq.utils import Censor
-from django_dummy_app.models import Country
+from django_dummy_app.models import Country, Disaster
 
 
 
@@ -125,6 +131,45 @@ class AggregationTestCase(TestCase):
         
         with self.assertRaises(InvalidCommandError):
             [Aggregation.from_query_value(a, Country, self.censor) for a in aggregations]
+    
+    
+    def test_filters(self):
+        query_string = (
+            "field=population|func=sum|to=population_sum,"
+            "field=population|func=sum|to=europe_sum|filters=region.continent.name=europe,"
+            "field=population|func=max|to=big_max|filters=population=>1000000'area=<100000"
+        )
+        aggregations = utils.split_list_values([query_string], ",")
+        aggregations = [
+            Aggregation.from_query_value(a, Country, self.censor, case=False) for a in aggregations
+        ]
+        kwargs = dict([a.get() for a in aggregations])
+        query = Country.objects.all().aggregate(**kwargs)
+        
+        expected = Country.objects.all().aggregate(
+            population_sum=models.Sum("population"),
+            europe_sum=models.Sum(
+                "population", filter=Q(region__continent__name__iexact="europe")
+            ),
+            big_max=models.Max(
+                "population", filter=Q(population__gt=1000000) & Q(area__lt=100000)
+            ),
+        )
+        self.assertEqual(expected, query)
+        self.assertNotEqual(query["population_sum"], query["europe_sum"])
+    
+    
+    def test_filters_invalid(self):
+        query_string = "field=population|func=max|to=population_max|filters=population"
+        with self.assertRaises(InvalidCommandError):
+            Aggregation.from_query_value(query_string, Country, self.censor)
+    
+    
+    def test_filters_censored(self):
+        censor = Censor(private={Country: ["area"]})
+        query_string = "field=population|func=max|to=population_max|filters=area=>10"
+        with self.assertRaises(UnknownFieldError):
+            Aggregation.from_query_value(query_string, Country, censor)
 
 
 
@@ -360,3 +405,313 @@ class AnnotationTestCase(TestCase):
         
         with self.assertRaises(InvalidCommandError):
             [Annotation.from_query_value(a, Country, False, self.censor) for a in annotations]
+
+
+
+class BucketsTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+        cls.censor = Censor(user=cls.user)
+    
+    
+    def test_from_query_value(self):
+        buckets = Buckets.from_query_value(
+            "field=population|buckets=4|min=0|max=1000|to=b", Country, self.censor
+        )
+        self.assertEqual("population", buckets.field)
+        self.assertEqual("b", buckets.to)
+        self.assertEqual(4, buckets.buckets)
+        self.assertEqual(250, buckets.width)
+    
+    
+    def test_apply_auto_bounds(self):
+        buckets = Buckets.from_query_value("field=area|buckets=7", Country, self.censor)
+        queryset = buckets.apply(Country.objects.all())
+        bounds = Country.objects.aggregate(min=models.Min("area"), max=models.Max("area"))
+        self.assertEqual(bounds["min"], buckets.min)
+        self.assertEqual(bounds["max"], buckets.max)
+        
+        self.assertEqual(Country.objects.count(), queryset.count())
+        for c in queryset:
+            self.assertEqual(min(int((c.area - buckets.min) // buckets.width), 6), c.bucket)
+    
+    
+    def test_apply_explicit_bounds(self):
+        buckets = Buckets.from_query_value(
+            "field=population|buckets=10|min=1000000|max=2000000", Country, self.censor
+        )
+        queryset = buckets.apply(Country.objects.all())
+        expected = Country.objects.filter(population__gte=1000000, population__lte=2000000)
+        self.assertEqual(expected.count(), queryset.count())
+        for c in queryset:
+            self.assertEqual(min((c.population - 1000000) // 100000, 9), c.bucket)
+    
+    
+    def test_not_numeric(self):
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=name", Country, self.censor)
+    
+    
+    def test_invalid_buckets(self):
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=area|buckets=0", Country, self.censor)
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=area|buckets=ten", Country, self.censor)
+    
+    
+    def test_invalid_bounds(self):
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=area|min=zero", Country, self.censor)
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=area|min=10|max=0", Country, self.censor)
+    
+    
+    def test_already_used_to(self):
+        with self.assertRaises(InvalidCommandError):
+            Buckets.from_query_value("field=area|to=name", Country, self.censor)
+
+
+
+class PeriodsTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+        cls.censor = Censor(user=cls.user)
+    
+    
+    def test_apply(self):
+        periods = Periods.from_query_value("field=date|interval=year", Disaster, self.censor)
+        queryset = periods.apply(Disaster.objects.all())
+        for d in queryset[:20]:
+            self.assertEqual(d.date.replace(month=1, day=1, hour=0, minute=0, second=0), d.period)
+    
+    
+    def test_default(self):
+        periods = Periods.from_query_value("field=date", Disaster, self.censor)
+        self.assertEqual("month", periods.interval)
+        self.assertEqual("period", periods.to)
+    
+    
+    def test_not_date(self):
+        with self.assertRaises(InvalidCommandError):
+            Periods.from_query_value("field=event", Disaster, self.censor)
+    
+    
+    def test_created_field(self):
+        with self.assertRaises(InvalidCommandError):
+            Periods.from_query_value("field=d", Disaster, self.censor, ["d"])
+    
+    
+    def test_unknown_interval(self):
+        with self.assertRaises(InvalidCommandError):
+            Periods.from_query_value("field=date|interval=decade", Disaster, self.censor)
+
+
+
+class PercentileTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+        cls.censor = Censor(user=cls.user)
+    
+    
+    def test_median(self):
+        populations = Country.objects.values_list("population", flat=True)
+        self.assertAlmostEqual(
+            statistics.median(populations),
+            Country.objects.aggregate(median=Median("population"))["median"]
+        )
+    
+    
+    def test_percentile(self):
+        populations = sorted(Country.objects.values_list("population", flat=True))
+        position = (len(populations) - 1) * 0.9
+        low, high = populations[int(position)], populations[int(position) + 1]
+        expected = low + (high - low) * (position - int(position))
+        self.assertAlmostEqual(
+            expected, Country.objects.aggregate(p90=P90("population"))["p90"], places=3
+        )
+        self.assertAlmostEqual(
+            expected,
+            Country.objects.aggregate(p90=Percentile("population", 0.9))["p90"], places=3
+        )
+    
+    
+    def test_sqlite_registration(self):
+        # Compiling the query does not touch the connection
+        with mock.patch.object(connection, "ensure_connection") as ensure_connection:
+            str(Country.objects.annotate(median=Median("population")).query)
+        ensure_connection.assert_not_called()
+        
+        raw = sqlite3.connect(":memory:")
+        self.addCleanup(raw.close)
+        _register_sqlite_functions(mock.Mock(vendor="sqlite", connection=raw))
+        self.assertEqual((2.0,), raw.execute(
+            "SELECT DGEQ_PERCENTILE(x, 0.5) FROM (SELECT 1 AS x UNION SELECT 3)"
+        ).fetchone())
+    
+    
+    def test_filter(self):
+        populations = Country.objects.filter(area__gt=100000).values_list("population", flat=True)
+        self.assertAlmostEqual(
+            statistics.median(populations),
+            Country.objects.aggregate(
+                median=Median("population", filter=Q(area__gt=100000))
+            )["median"]
+        )
+    
+    
+    def test_sorted_offset(self):
+        for q in [0, 0.1, 0.5, 0.95, 1]:
+            self.assertAlmostEqual(
+                Country.objects.aggregate(p=Percentile("population", q))["p"],
+                Percentile("population", q).sorted_offset(Country.objects.all()),
+                places=3
+            )
+        self.assertAlmostEqual(
+            Country.objects.aggregate(m=Median("population", filter=Q(area__gt=100000)))["m"],
+            Median("population", filter=Q(area__gt=100000)).sorted_offset(Country.objects.all())
+        )
+        self.assertIsNone(Median("population").sorted_offset(Country.objects.none()))
+    
+    
+    def test_get_function(self):
+        self.assertEqual(Median, get_function("c:aggregate", "median"))
+        aggregation = Aggregation.from_query_value(
+            "field=population|func=percentile(0.9)|to=p90", Country, self.censor
+        )
+        self.assertAlmostEqual(
+            Country.objects.aggregate(p90=P90("population"))["p90"],
+            Country.objects.aggregate(**dict([aggregation.get()]))["p90"]
+        )
+    
+    
+    def test_get_function_invalid(self):
+        for name in ["percentile", "percentile(1.5)", "percentile(a)", "percentile()"]:
+            with self.assertRaises(InvalidCommandError):
+                get_function("c:aggregate", name)
+    
+    
+    def test_annotate(self):
+        annotation = Annotation.from_query_value(
+            "field=rivers.length|func=median|to=river_median", Country, True, self.censor
+        )
+        country = annotation.apply(Country.objects.all()).get(name="France")
+        self.assertAlmostEqual(
+            statistics.median(country.rivers.values_list("length", flat=True)),
+            country.river_median
+        )
+    
+    
+    def test_annotate_not_native(self):
+        annotation = Annotation.from_query_value(
+            "field=rivers.length|func=median|to=river_median", Country, True, self.censor
+        )
+        with mock.patch.object(Percentile, "native_vendors", ()):
+            with self.assertRaises(InvalidCommandError):
+                annotation.apply(Country.objects.all())
+
+
+
+class WindowAnnotationTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+        cls.censor = Censor(user=cls.user)
+    
+    
+    def test_rank(self):
+        window = WindowAnnotation.from_query_value(
+            "to=rank|func=rank|order=-population|partition=region", Country, self.censor
+        )
+        for c in window.apply(Country.objects.all()):
+            self.assertEqual(
+                Country.objects.filter(region=c.region, population__gt=c.population).count() + 1,
+                c.rank
+            )
+    
+    
+    def test_running_sum(self):
+        window = WindowAnnotation.from_query_value(
+            "to=total|func=sum|field=population|order=id", Country, self.censor
+        )
+        total = 0
+        for c in window.apply(Country.objects.all()).order_by("id"):
+            total += c.population
+            self.assertEqual(total, c.total)
+    
+    
+    def test_partition_sum(self):
+        window = WindowAnnotation.from_query_value(
+            "to=total|func=sum|field=population|partition=region.continent", Country, self.censor
+        )
+        for c in window.apply(Country.objects.all())[:20]:
+            self.assertEqual(
+                Country.objects.filter(region__continent=c.region.continent_id)
+                .aggregate(t=models.Sum("population"))["t"],
+                c.total
+            )
+    
+    
+    def test_lag(self):
+        window = WindowAnnotation.from_query_value(
+            "to=previous|func=lag|field=name|order=population|offset=2", Country, self.censor
+        )
+        countries = list(window.apply(Country.objects.all()).order_by("population", "id"))
+        self.assertIsNone(countries[0].previous)
+        self.assertIsNone(countries[1].previous)
+        populations = [c.population for c in countries]
+        for c in countries[2:]:
+            if populations.count(c.population) == 1:
+                self.assertEqual(countries[countries.index(c) - 2].name, c.previous)
+    
+    
+    def test_missing_order(self):
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value("to=rank|func=rank", Country, self.censor)
+    
+    
+    def test_missing_field(self):
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value("to=total|func=sum|order=id", Country, self.censor)
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value("to=prev|func=lag|order=id", Country, self.censor)
+    
+    
+    def test_invalid_function(self):
+        for func in ["unknown", "median", "dcount"]:
+            with self.assertRaises(InvalidCommandError):
+                WindowAnnotation.from_query_value(
+                    f"to=value|func={func}|field=population|order=id", Country, self.censor
+                )
+    
+    
+    def test_invalid_offset(self):
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value(
+                "to=prev|func=lag|field=name|order=id|offset=0", Country, self.censor
+            )
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value(
+                "to=rank|func=rank|order=id|offset=2", Country, self.censor
+            )
+    
+    
+    def test_many_partition(self):
+        with self.assertRaises(InvalidCommandError):
+            WindowAnnotation.from_query_value(
+                "to=rank|func=rank|order=id|partition=rivers", Country, self.censor
+            )
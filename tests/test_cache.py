@@ -0,0 +1,139 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.http import QueryDict
+from django.test import TestCase
+
+from dgeq import GenericQuery, cache
+from django_dummy_app.models import Country, Disaster, Forest, Region, River
+
+
+
+@mock.patch("dgeq.cache.DGEQ_ROW_CACHE", [Country, "django_dummy_app.Region"])
+class RowCacheTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def setUp(self):
+        caches[cache.DGEQ_ROW_CACHE_ALIAS].clear()
+    
+    
+    def evaluate(self, model, query_string, use_cache=True):
+        if use_cache:
+            return GenericQuery(model, QueryDict(query_string)).evaluate()
+        with mock.patch("dgeq.cache.DGEQ_ROW_CACHE", []):
+            return GenericQuery(model, QueryDict(query_string)).evaluate()
+    
+    
+    def assertSameResult(self, model, query_string):
+        # Evaluate twice so that the second result is taken from the cache
+        self.assertTrue(self.evaluate(model, query_string)["status"], query_string)
+        self.assertEqual(
+            self.evaluate(model, query_string, False), self.evaluate(model, query_string),
+            query_string
+        )
+    
+    
+    def test_rows(self):
+        query_strings = [
+            "c:sort=id", "c:sort=name&c:limit=0", "name=*stan&c:sort=-population",
+            "c:show=name,region,rivers&c:sort=id",
+            "c:hide=disasters&c:sort=id&c:start=10&c:limit=20",
+            "rivers.length=>3000&c:sort=name&c:limit=0", "name=Nowhere",
+            "c:annotate=field=rivers|func=count|to=n&c:sort=-n,id",
+            "c:annotate=field=rivers|func=count|to=n&c:hide=n&c:sort=id",
+            "c:join=field=region|show=name&c:sort=id",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, query_string)
+        self.assertSameResult(Region, "c:sort=name&c:limit=0")
+    
+    
+    def test_hits(self):
+        query_string = "c:show=id,name,region&c:sort=id&c:limit=20"
+        with self.assertNumQueries(2):
+            self.evaluate(Country, query_string)
+        with self.assertNumQueries(1):
+            self.evaluate(Country, query_string)
+        
+        # Only the rows missing from the cache are fetched
+        with self.assertNumQueries(2):
+            result = self.evaluate(Country, "c:show=id,name,region&c:sort=id&c:limit=40")
+        self.assertEqual(40, len(result["rows"]))
+        with self.assertNumQueries(1):
+            self.evaluate(Country, "id=<41&c:show=id,name,region&c:sort=-id&c:limit=0")
+        
+        # Other projections are cached separately
+        with self.assertNumQueries(2):
+            result = self.evaluate(Country, "c:show=id,name&c:sort=id&c:limit=20")
+        self.assertEqual({"id", "name"}, set(result["rows"][0]))
+    
+    
+    def test_invalidate_on_save_and_delete(self):
+        query_string = "c:sort=id&c:limit=0"
+        self.assertSameResult(Country, query_string)
+        
+        country = Country.objects.get(name="France")
+        country.population += 1
+        country.save()
+        self.assertSameResult(Country, query_string)
+        
+        # Related rows
+        disaster = Disaster.objects.create(
+            event="Storm", date="2020-01-01T00:00:00Z", country=country, source="Test",
+            comment="Test"
+        )
+        self.assertSameResult(Country, query_string)
+        disaster.country = Country.objects.get(name="Spain")
+        disaster.save()
+        self.assertSameResult(Country, query_string)
+        disaster.delete()
+        self.assertSameResult(Country, query_string)
+        
+        country.region = Region.objects.exclude(pk=country.region_id).first()
+        country.save()
+        self.assertSameResult(Country, query_string)
+        self.assertSameResult(Region, query_string)
+        
+        Disaster.objects.filter(country=country).delete()
+        country.delete()
+        self.assertSameResult(Country, query_string)
+        self.assertSameResult(Region, query_string)
+    
+    
+    def test_invalidate_on_m2m_changed(self):
+        query_string = "c:sort=id&c:limit=0"
+        self.assertSameResult(Country, query_string)
+        
+        country = Country.objects.get(name="France")
+        rivers = list(River.objects.exclude(countries=country)[:2])
+        country.rivers.add(*rivers)
+        self.assertSameResult(Country, query_string)
+        rivers[0].countries.remove(country)
+        self.assertSameResult(Country, query_string)
+        Forest.objects.first().countries.clear()
+        self.assertSameResult(Country, query_string)
+    
+    
+    def test_invalidate(self):
+        query_string = "c:sort=id&c:limit=0"
+        self.assertSameResult(Country, query_string)
+        
+        Country.objects.filter(name="France").update(population=1)
+        cache.invalidate(Country, [Country.objects.get(name="France").pk])
+        self.assertSameResult(Country, query_string)
+        
+        Country.objects.update(population=2)
+        cache.invalidate(Country)
+        self.assertSameResult(Country, query_string)
+    
+    
+    def test_fingerprint(self):
+        self.assertEqual(
+            cache.fingerprint({"name", "id"}, {"region"}, ()),
+            cache.fingerprint(["id", "name"], ["region"], []),
+        )
+        self.assertNotEqual(
+            cache.fingerprint({"name", "id"}, {"region"}, ()),
+            cache.fingerprint({"name", "id", "region"}, (), ()),
+        )
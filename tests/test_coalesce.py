@@ -0,0 +1,277 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.http import QueryDict
+from django.test import TestCase
+
+from dgeq import GenericQuery, coalesce
+from django_dummy_app.models import Country, Region
+
+
+FOLLOWERS = 4
+
+
+
+class CoalesceTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def key(self, model, query_string, **kwargs):
+        return coalesce.key(GenericQuery(model, QueryDict(query_string), **kwargs))
+    
+    
+    def run_threads(self, func):
+        """Run `func` in a leader thread then in `FOLLOWERS` threads started
+        while the leader is executing, return the results of the followers."""
+        started = threading.Event()
+        release = threading.Event()
+        results = list()
+        
+        def leader():
+            started.set()
+            release.wait(5)
+            return func()
+        
+        def follower():
+            results.append(coalesce.single_flight("key", func))
+        
+        threads = [threading.Thread(target=coalesce.single_flight, args=("key", leader))]
+        threads[0].start()
+        started.wait(5)
+        for _ in range(FOLLOWERS):
+            threads.append(threading.Thread(target=follower))
+            threads[-1].start()
+        # Let the followers wait for the leader
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+    
+    
+    def test_key(self):
+        user = User.objects.create_user("test")
+        self.assertEqual(
+            self.key(Country, "name=France&c:show=name"),
+            self.key(Country, "name=France&c:show=name"),
+        )
+        self.assertEqual(
+            self.key(Country, "c:show=name", public_fields={Country: ["name", "id"]}),
+            self.key(Country, "c:show=name", public_fields={Country: ("id", "name")}),
+        )
+        self.assertEqual(
+            self.key(Country, "c:show=name", user=user),
+            self.key(Country, "c:show=name", user=AnonymousUser()),
+        )
+        
+        keys = [
+            self.key(Country, "name=France&c:show=name"),
+            self.key(Country, "c:show=name&name=France"),
+            self.key(Country, "name=Spain&c:show=name"),
+            self.key(Region, "name=France&c:show=name"),
+            self.key(Country, "name=France&c:show=name", public_fields={Country: ["name"]}),
+            self.key(Country, "name=France&c:show=name", private_fields={Country: ["area"]}),
+            self.key(Country, "name=France&c:show=name", user=user, use_permissions=True),
+            self.key(
+                Country, "name=France&c:show=name", user=AnonymousUser(), use_permissions=True
+            ),
+        ]
+        # Querysets restricted by a view
+        for queryset in [Country.objects.filter(region__name="Western Europe"),
+                         Country.objects.none()]:
+            query = GenericQuery(Country, QueryDict("name=France&c:show=name"))
+            query.queryset = queryset
+            keys.append(coalesce.key(query))
+        self.assertEqual(len(keys), len(set(keys)))
+    
+    
+    def test_single_flight(self):
+        calls = list()
+        
+        def func():
+            calls.append(None)
+            return {"status": True, "rows": [{"name": "France"}]}
+        
+        results = self.run_threads(func)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([func()] * FOLLOWERS, results)
+        # Followers receive copies of the result
+        results[0]["rows"].clear()
+        self.assertEqual(func(), results[1])
+        self.assertEqual({}, coalesce._FLIGHTS)
+    
+    
+    def test_single_flight_leader_modifies(self):
+        started, modified = threading.Event(), threading.Event()
+        
+        def func():
+            started.set()
+            time.sleep(0.05)
+            return {"status": True, "rows": [{"name": "France"}]}
+        
+        def leader():
+            result = coalesce.single_flight("key", func)
+            result["rows"].clear()
+            modified.set()
+        
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait()
+        result = coalesce.single_flight("key", func)
+        thread.join()
+        
+        self.assertTrue(modified.is_set())
+        self.assertEqual([{"name": "France"}], result["rows"])
+    
+    
+    def test_single_flight_leader_fails(self):
+        calls = list()
+        
+        def func():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError
+            return {"status": True}
+        
+        with mock.patch("threading.excepthook"):
+            results = self.run_threads(func)
+        self.assertEqual(1 + FOLLOWERS, len(calls))
+        self.assertEqual([{"status": True}] * FOLLOWERS, results)
+    
+    
+    @mock.patch("dgeq.coalesce.DGEQ_COALESCE_TIMEOUT", 0.01)
+    def test_single_flight_timeout(self):
+        calls = list()
+        
+        def func():
+            calls.append(None)
+            return {"status": True}
+        
+        results = self.run_threads(func)
+        self.assertEqual(1 + FOLLOWERS, len(calls))
+        self.assertEqual([{"status": True}] * FOLLOWERS, results)
+    
+    
+    def test_async_single_flight(self):
+        calls = list()
+        
+        async def func():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return {"status": True}
+        
+        async def gather():
+            return await asyncio.gather(*[
+                coalesce.async_single_flight("key", func) for _ in range(FOLLOWERS + 1)
+            ])
+        
+        self.assertEqual([{"status": True}] * (FOLLOWERS + 1), asyncio.run(gather()))
+        self.assertEqual(1, len(calls))
+        self.assertEqual({}, coalesce._TASKS)
+    
+    
+    def test_async_single_flight_leader_modifies(self):
+        async def func():
+            await asyncio.sleep(0.05)
+            return {"status": True, "rows": [{"name": "France"}]}
+        
+        async def leader():
+            result = await coalesce.async_single_flight("key", func)
+            result["rows"].clear()
+            return result
+        
+        async def gather():
+            return await asyncio.gather(leader(), coalesce.async_single_flight("key", func))
+        
+        self.assertEqual([[], [{"name": "France"}]], [r["rows"] for r in asyncio.run(gather())])
+    
+    
+    @mock.patch("dgeq.coalesce.DGEQ_COALESCE_TIMEOUT", 0.01)
+    def test_async_single_flight_timeout(self):
+        calls = list()
+        
+        async def func():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return {"status": True}
+        
+        async def gather():
+            return await asyncio.gather(*[
+                coalesce.async_single_flight("key", func) for _ in range(FOLLOWERS + 1)
+            ])
+        
+        self.assertEqual([{"status": True}] * (FOLLOWERS + 1), asyncio.run(gather()))
+        self.assertEqual(FOLLOWERS + 1, len(calls))
+        self.assertEqual({}, coalesce._TASKS)
+    
+    
+    @mock.patch("dgeq.coalesce.DGEQ_COALESCE", True)
+    def test_aevaluate(self):
+        def evaluate(*args):
+            time.sleep(0.05)
+            return {"status": True}
+        
+        async def gather():
+            return await asyncio.gather(*[
+                GenericQuery(Country, QueryDict("name=France")).aevaluate()
+                for _ in range(FOLLOWERS + 1)
+            ])
+        
+        with mock.patch("dgeq.GenericQuery.evaluate", side_effect=evaluate) as mocked:
+            self.assertEqual([{"status": True}] * (FOLLOWERS + 1), asyncio.run(gather()))
+        self.assertEqual(1, mocked.call_count)
+    
+    
+    def test_evaluate(self):
+        query_string = "name=*stan&c:show=name,rivers&c:sort=-population"
+        result = GenericQuery(Country, QueryDict(query_string)).evaluate()
+        with mock.patch("dgeq.coalesce.DGEQ_COALESCE", True):
+            self.assertEqual(result, GenericQuery(Country, QueryDict(query_string)).evaluate())
+            with mock.patch("dgeq.coalesce.DGEQ_COALESCE_CACHE", "default"):
+                self.assertEqual(
+                    result, GenericQuery(Country, QueryDict(query_string)).evaluate()
+                )
+    
+    
+    @mock.patch("dgeq.coalesce.POLL_INTERVAL", 0.01)
+    @mock.patch("dgeq.coalesce.DGEQ_COALESCE_CACHE", "default")
+    def test_cache_flight(self):
+        cache = caches["default"]
+        cache.clear()
+        lock = f"{coalesce.PREFIX}:key"
+        calls = list()
+        
+        def func():
+            calls.append(None)
+            return {"status": True, "process": "this"}
+        
+        # No other process
+        self.assertEqual(func(), coalesce.cache_flight("key", func))
+        self.assertEqual(2, len(calls))
+        self.assertIsNone(cache.get(lock))
+        
+        # Another process stores its result then removes the lock
+        def other_process(result):
+            time.sleep(0.05)
+            if result is not None:
+                cache.set(f"{lock}:token", result)
+            cache.delete(lock)
+        
+        cache.set(lock, "token")
+        thread = threading.Thread(target=other_process, args=({"process": "other"},))
+        thread.start()
+        self.assertEqual({"process": "other"}, coalesce.cache_flight("key", func))
+        thread.join(5)
+        self.assertEqual(2, len(calls))
+        
+        # Another process fails
+        cache.set(lock, "token2")
+        thread = threading.Thread(target=other_process, args=(None,))
+        thread.start()
+        self.assertEqual(func(), coalesce.cache_flight("key", func))
+        thread.join(5)
+        self.assertEqual(4, len(calls))
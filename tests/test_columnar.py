@@ -0,0 +1,212 @@
+from unittest import mock
+
+from django.db import transaction
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+
+from dgeq import GenericQuery, columnar, versions
+from django_dummy_app.models import Continent, Country, Forest, Region, River
+
+
+AGGREGATIONS = ",".join([
+    "field=population|func=sum|to=sum",
+    "field=population|func=avg|to=avg",
+    "field=population|func=max|to=max",
+    "field=area|func=min|to=min",
+    "field=area|func=stddev|to=stddev",
+    "field=area|func=var|to=var",
+    "field=area|func=median|to=median",
+    "field=area|func=percentile(0.25)|to=p25",
+    "field=name|func=count|to=count",
+    "field=region|func=dcount|to=dcount",
+])
+
+
+
+@mock.patch("dgeq.columnar.DGEQ_COLUMNAR_TABLES", [Country, "django_dummy_app.River"])
+class ColumnarTableTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def tearDown(self):
+        columnar.invalidate()
+    
+    
+    def evaluate(self, model, query_string, use_columnar):
+        query = GenericQuery(model, QueryDict(query_string))
+        if not use_columnar:
+            query.columnar = None
+        result = query.evaluate()
+        return query.columnar is not None, result
+    
+    
+    def assertSameResult(self, model, query_string, use_columnar=True):
+        used_columnar, result = self.evaluate(model, query_string, True)
+        _, expected = self.evaluate(model, query_string, False)
+        self.assertTrue(expected["status"], (query_string, expected))
+        self.assertEqual(use_columnar, used_columnar, query_string)
+        
+        self.assertEqual(set(expected), set(result), query_string)
+        for k, v in expected.items():
+            if isinstance(v, float):
+                self.assertAlmostEqual(
+                    v, result[k], delta=abs(v) * 1e-9, msg=f"{query_string} ({k})"
+                )
+            else:
+                self.assertEqual(v, result[k], f"{query_string} ({k})")
+    
+    
+    def test_get_table(self):
+        self.assertIs(columnar.get_table(Country), columnar.get_table(Country))
+        self.assertIsNotNone(columnar.get_table(River))
+        self.assertIsNone(columnar.get_table(Forest))
+        
+        table = columnar.get_table(Country)
+        self.assertEqual(Country.objects.count(), len(table))
+        self.assertTrue(table.columns["population"].numeric)
+        self.assertFalse(table.columns["name"].numeric)
+    
+    
+    def test_no_query(self):
+        columnar.get_table(Country)
+        with self.assertNumQueries(0):
+            used_columnar, result = self.evaluate(
+                Country, f"population=>1000000&c:aggregate={AGGREGATIONS}&c:count=1&c:evaluate=0",
+                True
+            )
+        self.assertTrue(used_columnar)
+        self.assertEqual(
+            Country.objects.filter(population__gt=1000000).count(), result["count"]
+        )
+    
+    
+    def test_aggregate(self):
+        query_strings = [
+            "", "population=>10000000", "name=France", "name=!France", "region=@1;2;3",
+            "population=<0", "area=]100000&population=[1000000", "region=!2&c:sort=-name",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(
+                Country, f"{query_string}&c:aggregate={AGGREGATIONS}&c:count=1&c:evaluate=0"
+            )
+    
+    
+    def test_aggregate_filters(self):
+        self.assertSameResult(
+            Country,
+            "c:aggregate=field=population|func=sum|to=a|filters=region=1'population=>1000000,"
+            "field=population|func=count|to=b|filters=name=!France&c:evaluate=0"
+        )
+    
+    
+    def test_aggregate_null(self):
+        self.assertSameResult(
+            River,
+            "c:aggregate=field=discharge|func=avg|to=avg,field=discharge|func=count|to=count,"
+            "field=discharge|func=sum|to=sum&c:count=1&c:evaluate=0"
+        )
+        for query_string in ["discharge=", "discharge=!", "discharge=>1000", "discharge=<1000"]:
+            self.assertSameResult(
+                River, f"{query_string}&c:aggregate=field=discharge|func=max|to=max&c:count=1"
+            )
+    
+    
+    def test_pure_python(self):
+        with mock.patch("dgeq.columnar.numpy", None):
+            self.test_aggregate()
+            self.test_aggregate_null()
+    
+    
+    def test_fallback(self):
+        query_strings = [
+            "region.name=*Europe&c:count=1", "rivers.length=>1000&c:count=1",
+            "c:limit=3&c:count=1", "c:distinct=1&c:count=1",
+            "c:aggregate=field=rivers.length|func=sum|to=total",
+            "c:aggregate=field=name|func=max|to=max",
+            "c:group=region&c:aggregate=field=area|func=sum|to=total",
+            "name=*stan&c:count=1", "name=~STAN&c:count=1", "c:case=0&name=^MA&c:count=1",
+            "c:aggregate=field=area|func=sum|to=total|filters=name=$ia",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, f"{query_string}&c:evaluate=0", use_columnar=False)
+    
+    
+    def test_errors(self):
+        for query_string in ["c:count=a", "c:aggregate=field=unknown|func=sum|to=a"]:
+            _, result = self.evaluate(Country, query_string, True)
+            self.assertFalse(result["status"])
+            self.assertEqual(self.evaluate(Country, query_string, False)[1], result)
+    
+    
+    def test_other_process(self):
+        table = columnar.get_table(Country)
+        versions.increment(Country)
+        self.assertIsNot(table, columnar.get_table(Country))
+
+
+
+@mock.patch("dgeq.columnar.DGEQ_COLUMNAR_TABLES", [Country])
+class ColumnarUpdateTestCase(TransactionTestCase):
+    
+    def setUp(self):
+        continent = Continent.objects.create(name="Continent")
+        self.region = Region.objects.create(name="Region", continent=continent)
+        for i in range(1, 4):
+            Country.objects.create(
+                name=f"Country {i}", area=i * 1000, population=i * 100, region=self.region
+            )
+    
+    
+    def tearDown(self):
+        columnar.invalidate()
+    
+    
+    def aggregate(self):
+        return GenericQuery(
+            Country, QueryDict(f"c:aggregate={AGGREGATIONS}&c:count=1&c:evaluate=0")
+        ).evaluate()
+    
+    
+    def assertUpToDate(self):
+        result = self.aggregate()
+        with mock.patch("dgeq.columnar.DGEQ_COLUMNAR_TABLES", []):
+            self.assertEqual(self.aggregate(), result)
+    
+    
+    def test_incremental_update(self):
+        table = columnar.get_table(Country)
+        
+        country = Country.objects.get(name="Country 1")
+        country.population = 1
+        country.save()
+        new = Country.objects.create(name="Atlantis", area=10, population=10, region=self.region)
+        self.assertUpToDate()
+        
+        new.delete()
+        country.delete()
+        self.assertUpToDate()
+        self.assertIs(table, columnar.get_table(Country))
+    
+    
+    def test_update_on_commit(self):
+        table = columnar.get_table(Country)
+        with transaction.atomic():
+            Country.objects.create(name="Atlantis", area=10, population=10, region=self.region)
+            self.assertEqual(3, len(table))
+        self.assertEqual(4, len(table))
+        
+        with transaction.atomic():
+            Country.objects.create(name="Lemuria", area=10, population=10, region=self.region)
+            transaction.set_rollback(True)
+        self.assertEqual(4, len(table))
+        self.assertIs(table, columnar.get_table(Country))
+    
+    
+    def test_update_other_process(self):
+        table = columnar.get_table(Country)
+        versions.increment(Country)
+        Country.objects.create(name="Atlantis", area=10, population=10, region=self.region)
+        
+        # The table missed a change, it is built again
+        self.assertIsNot(table, columnar.get_table(Country))
+        self.assertUpToDate()
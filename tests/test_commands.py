@@ -1,14 +1,17 @@
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.db import models
+from django.db import connection, models
 from django.http import QueryDict
 from django.test import TestCase
 
 from dgeq import GenericQuery, commands
-from dgeq.constants import DGEQ_MAX_LIMIT
-from dgeq.exceptions import InvalidCommandError
+from dgeq.aggregations import Percentile
+from dgeq.constants import DGEQ_FACET_LIMIT, DGEQ_MAX_LIMIT
+from dgeq.exceptions import InvalidCommandError, UnknownFieldError
 from dgeq.utils import Censor
-from django_dummy_app.models import Country, Forest
+from django_dummy_app.models import Country, Disaster, Forest, River
 
 
 
@@ -36,6 +39,86 @@ class AnnotationTestCase(TestCase):
             self.assertTrue(hasattr(c1, "river_length"))
             self.assertTrue(hasattr(c2, "river_length"))
             self.assertEqual(c1.river_length, c2.river_length)
+    
+    
+    def expected_many(self, c):
+        return (
+            c.rivers.count(),
+            c.forests.aggregate(total=models.Sum("area"))["total"],
+        )
+    
+    
+    def test_annotate_many_relations(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Annotate()(dgeq, "c:annotate", [
+            "field=rivers|func=count|to=river_count,field=forests.area|func=sum|to=forest_area"
+        ])
+        self.assertEqual(["subquery", "subquery"], [a.strategy for a in dgeq.annotations])
+        self.assertEqual(Country.objects.count(), dgeq.queryset.count())
+        for c in dgeq.queryset:
+            self.assertEqual(self.expected_many(c), (c.river_count, c.forest_area))
+    
+    
+    def test_annotate_many_relations_separate(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Annotate()(dgeq, "c:annotate", ["field=rivers|func=count|to=river_count"])
+        commands.Annotate()(dgeq, "c:annotate", ["field=forests.area|func=sum|to=forest_area"])
+        self.assertEqual(["join", "subquery"], [a.strategy for a in dgeq.annotations])
+        for c in dgeq.queryset:
+            self.assertEqual(self.expected_many(c), (c.river_count, c.forest_area))
+    
+    
+    def test_annotate_strategy(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Annotate()(dgeq, "c:annotate", [
+            "field=rivers.length|func=max|to=river_length|strategy=subquery"
+            "|filters=rivers.length=>3000,field=population|func=sum|to=population_sum"
+        ])
+        self.assertEqual(["subquery", "join"], [a.strategy for a in dgeq.annotations])
+        for c in dgeq.queryset:
+            self.assertEqual(
+                c.rivers.filter(length__gt=3000).aggregate(m=models.Max("length"))["m"],
+                c.river_length
+            )
+    
+    
+    def test_annotate_strategy_arbitrary_field(self):
+        density = "c:compute", ["to=density|expr=population/area"]
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Compute()(dgeq, *density)
+        commands.Annotate()(dgeq, "c:annotate", [
+            "field=rivers|func=count|to=river_count|filters=density=>100,"
+            "field=forests.area|func=sum|to=forest_area"
+        ])
+        self.assertEqual(["join", "subquery"], [a.strategy for a in dgeq.annotations])
+        for c in dgeq.queryset:
+            self.assertEqual(c.forests.aggregate(t=models.Sum("area"))["t"], c.forest_area)
+            self.assertEqual(
+                c.rivers.count() if c.area and c.population / c.area > 100 else 0, c.river_count
+            )
+        
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Compute()(dgeq, *density)
+        with self.assertRaises(InvalidCommandError):
+            commands.Annotate()(dgeq, "c:annotate", [
+                "field=rivers|func=count|to=river_count|filters=density=>100|strategy=subquery"
+            ])
+        
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Compute()(dgeq, *density)
+        commands.Annotate()(dgeq, "c:annotate", ["field=rivers|func=count|to=river_count"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Annotate()(dgeq, "c:annotate", [
+                "field=forests.area|func=sum|to=forest_area|filters=density=>100"
+            ])
+    
+    
+    def test_annotate_invalid_strategy(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Annotate()(dgeq, "c:annotate", [
+                "field=rivers|func=count|to=river_count|strategy=unknown"
+            ])
 
 
 
@@ -59,6 +142,25 @@ class AggregateTestCase(TestCase):
             )["population_avg"],
             dgeq.result["population_avg"]
         )
+    
+    
+    def test_aggregate_percentile_not_native(self):
+        subquery = "field=population|func=p90|to=p90,field=population|func=max|to=population_max"
+        expected = GenericQuery(Country, QueryDict())
+        commands.Aggregate()(expected, "c:aggregate", [subquery])
+        dgeq = GenericQuery(Country, QueryDict())
+        with mock.patch.object(Percentile, "native_vendors", ()):
+            commands.Aggregate()(dgeq, "c:aggregate", [subquery])
+        self.assertEqual(expected.result["population_max"], dgeq.result["population_max"])
+        self.assertAlmostEqual(expected.result["p90"], dgeq.result["p90"], places=3)
+    
+    
+    def test_aggregate_percentile_group_not_native(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region"])
+        with mock.patch.object(Percentile, "native_vendors", ()):
+            with self.assertRaises(InvalidCommandError):
+                commands.Aggregate()(dgeq, "c:aggregate", ["field=population|func=median|to=m"])
 
 
 
@@ -91,6 +193,43 @@ class CaseTestCase(TestCase):
 
 
 
+class ComputeTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_compute(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Compute()(dgeq, "c:compute", ["to=density|expr=population/area"])
+        commands.Filtering()(dgeq, "density", [">100"])
+        commands.Sort()(dgeq, "c:sort", ["-density"])
+        self.assertIn("density", dgeq.arbitrary_fields)
+        rows = list(dgeq.queryset)
+        expected = sorted(
+            (c for c in Country.objects.all() if c.area and c.population / c.area > 100),
+            key=lambda c: -c.population / c.area
+        )
+        self.assertEqual([c.pk for c in expected], [c.pk for c in rows])
+    
+    
+    def test_compute_groups(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region.name"])
+        commands.Aggregate()(dgeq, "c:aggregate", [
+            "field=population|func=sum|to=population_sum,field=area|func=sum|to=area_sum"
+        ])
+        commands.Compute()(dgeq, "c:compute", ["to=density|expr=population_sum/area_sum"])
+        for row in dgeq.queryset:
+            self.assertAlmostEqual(row["population_sum"] / row["area_sum"], row["density"])
+    
+    
+    def test_compute_groups_non_grouping_field(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region.name"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Compute()(dgeq, "c:compute", ["to=density|expr=population/area"])
+
+
+
 class CountTestCase(TestCase):
     fixtures = ["tests/django_dummy_app/geography_data.json"]
     
@@ -131,12 +270,14 @@ class DistinctTestCase(TestCase):
     
     
     def test_distinct_true(self):
+        # Filters on a list of related models do not join their table, join it
+        # manually to create duplicates
         dgeq = GenericQuery(Forest, QueryDict())
-        commands.Filtering()(dgeq, "countries.region.name", ["South America"])
+        dgeq.queryset = Forest.objects.filter(countries__region__name="South America")
         without_distinct = dgeq.queryset.count()
         
         dgeq = GenericQuery(Forest, QueryDict())
-        commands.Filtering()(dgeq, "countries.region.name", ["South America"])
+        dgeq.queryset = Forest.objects.filter(countries__region__name="South America")
         commands.Distinct()(dgeq, "c:distinct", ["1"])
         with_distinct = dgeq.queryset.count()
         
@@ -146,11 +287,11 @@ class DistinctTestCase(TestCase):
     
     def test_distinct_false(self):
         dgeq = GenericQuery(Forest, QueryDict())
-        commands.Filtering()(dgeq, "countries.region.name", ["South America"])
+        dgeq.queryset = Forest.objects.filter(countries__region__name="South America")
         without_distinct = dgeq.queryset.count()
         
         dgeq = GenericQuery(Forest, QueryDict())
-        commands.Filtering()(dgeq, "countries.region.name", ["South America"])
+        dgeq.queryset = Forest.objects.filter(countries__region__name="South America")
         commands.Distinct()(dgeq, "c:distinct", ["0"])
         with_distinct = dgeq.queryset.count()
         
@@ -204,6 +345,120 @@ class EvaluateTestCase(TestCase):
 
 
 
+class ExistsTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_exists(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Exists()(dgeq, "c:exists", [
+            "path=disasters|filters=event=Flood,path=rivers|filters=length=>3000'discharge=>1000"
+        ])
+        expected = Country.objects.filter(
+            pk__in=Disaster.objects.filter(event="Flood").values("country")
+        ).filter(
+            pk__in=River.objects.filter(length__gt=3000, discharge__gt=1000).values("countries")
+        )
+        self.assertTrue(expected.exists())
+        self.assertEqual(set(expected), set(dgeq.queryset))
+        self.assertEqual(dgeq.queryset.count(), dgeq.queryset.distinct().count())
+    
+    
+    def test_exists_same_row(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Exists()(dgeq, "c:exists", ["path=rivers|filters=length=>3000'discharge=<1000"])
+        expected = Country.objects.filter(
+            pk__in=River.objects.filter(length__gt=3000, discharge__lt=1000).values("countries")
+        )
+        self.assertEqual(set(expected), set(dgeq.queryset))
+    
+    
+    def test_exists_path(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Exists()(dgeq, "c:exists", ["mountains"])
+        self.assertEqual(
+            set(Country.objects.filter(mountains__isnull=False)), set(dgeq.queryset)
+        )
+    
+    
+    def test_notexists(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Exists()(dgeq, "c:notexists", ["path=disasters|filters=event=Flood"])
+        self.assertEqual(
+            set(Country.objects.exclude(disasters__event="Flood")), set(dgeq.queryset)
+        )
+    
+    
+    def test_exists_censored(self):
+        dgeq = GenericQuery(Country, QueryDict(), private_fields={River: ["length"]})
+        with self.assertRaises(UnknownFieldError):
+            commands.Exists()(dgeq, "c:exists", ["path=rivers|filters=length=>3000"])
+    
+    
+    def test_exists_invalid(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Exists()(dgeq, "c:exists", ["path=name"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Exists()(dgeq, "c:exists", ["filters=length=>3000"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Exists()(dgeq, "c:exists", ["path=rivers|filters=length"])
+        with self.assertRaises(UnknownFieldError):
+            commands.Exists()(dgeq, "c:exists", ["path=rivers|filters=unknown=1"])
+
+
+
+class FacetTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+    
+    
+    def test_facet(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Filtering()(dgeq, "country.region.continent.name", ["Asia"])
+        commands.Facet()(dgeq, "c:facet", ["event,field=country.region.name|limit=3"])
+        
+        self.assertEqual({"event", "country.region.name"}, set(dgeq.result["facets"]))
+        self.assertEqual(3, len(dgeq.result["facets"]["country.region.name"]))
+        queryset = Disaster.objects.filter(country__region__continent__name="Asia")
+        for facet in dgeq.result["facets"]["event"]:
+            self.assertEqual(queryset.filter(event=facet["value"]).count(), facet["count"])
+        counts = [f["count"] for f in dgeq.result["facets"]["country.region.name"]]
+        self.assertEqual(sorted(counts, reverse=True), counts)
+    
+    
+    def test_facet_default_limit(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Facet()(dgeq, "c:facet", ["country"])
+        self.assertEqual(DGEQ_FACET_LIMIT, len(dgeq.result["facets"]["country"]))
+    
+    
+    def test_facet_invalid_limit(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Facet()(dgeq, "c:facet", ["field=event|limit=0"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Facet()(dgeq, "c:facet", [f"field=event|limit={DGEQ_MAX_LIMIT + 1}"])
+    
+    
+    def test_facet_missing_field(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Facet()(dgeq, "c:facet", ["limit=3"])
+    
+    
+    def test_facet_sliced(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        dgeq.sliced = True
+        with self.assertRaises(InvalidCommandError):
+            commands.Facet()(dgeq, "c:facet", ["event"])
+
+
+
 class FilteringTestCase(TestCase):
     fixtures = ["tests/django_dummy_app/geography_data.json"]
     
@@ -228,6 +483,129 @@ class FilteringTestCase(TestCase):
         dgeq.sliced = True
         with self.assertRaises(InvalidCommandError):
             commands.Filtering()(dgeq, "population", [">1000000"])
+    
+    
+    def test_filtering_many(self):
+        dgeq = GenericQuery(Forest, QueryDict())
+        commands.Filtering()(dgeq, "countries.region.name", ["South America"])
+        commands.Count()(dgeq, "c:count", ["1"])
+        self.assertEqual(2, dgeq.result["count"])
+        self.assertEqual(
+            set(Forest.objects.filter(countries__region__name="South America")),
+            set(dgeq.queryset)
+        )
+        self.assertNotIn("JOIN", str(dgeq.queryset.query).split("EXISTS")[0])
+    
+    
+    def test_filtering_many_same_row(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Filtering()(dgeq, "rivers.length", [">3000", "<4000"])
+        expected = Country.objects.filter(
+            rivers__length__gt=3000, rivers__length__lt=4000
+        ).distinct()
+        self.assertEqual(set(expected), set(dgeq.queryset))
+        self.assertEqual(expected.count(), dgeq.queryset.count())
+    
+    
+    def test_filtering_many_exclude(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Filtering()(dgeq, "rivers.name", ["~a"])
+        self.assertEqual(
+            set(Country.objects.exclude(rivers__name__icontains="a")), set(dgeq.queryset)
+        )
+
+
+
+class GroupTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+    
+    
+    def test_group(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region.continent.name"])
+        self.assertEqual({"region__continent__name": "region.continent.name"}, dgeq.group_by)
+        self.assertEqual(
+            list(
+                Country.objects.values("region__continent__name")
+                .order_by("region__continent__name").distinct()
+            ),
+            list(dgeq.queryset.distinct())
+        )
+    
+    
+    def test_group_aggregate(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region"])
+        commands.Aggregate()(dgeq, "c:aggregate", ["field=population|func=sum|to=population_sum"])
+        commands.Sort()(dgeq, "c:sort", ["-population_sum"])
+        self.assertIn("population_sum", dgeq.arbitrary_fields)
+        self.assertNotIn("population_sum", dgeq.result)
+        self.assertEqual(
+            list(
+                Country.objects.values("region").annotate(
+                    population_sum=models.Sum("population")
+                ).order_by("-population_sum")
+            ),
+            list(dgeq.queryset)
+        )
+    
+    
+    def test_group_sliced(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        dgeq.sliced = True
+        with self.assertRaises(InvalidCommandError):
+            commands.Group()(dgeq, "c:group", ["region"])
+    
+    
+    def test_group_after_aggregation(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Annotate()(dgeq, "c:annotate", ["field=rivers|func=count|to=rivers_count"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Group()(dgeq, "c:group", ["region"])
+    
+    
+    def test_group_sort_non_grouping_field(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Sort()(dgeq, "c:sort", ["name"])
+
+
+
+class HistogramTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+    
+    
+    def test_histogram(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Histogram()(dgeq, "c:histogram", ["field=population|buckets=4"])
+        commands.Aggregate()(dgeq, "c:aggregate", ["field=id|func=count|to=n"])
+        
+        self.assertEqual({"bucket": "bucket"}, dgeq.group_by)
+        self.assertEqual(4, dgeq.result["histogram"]["buckets"])
+        rows = list(dgeq.queryset)
+        buckets = {r["bucket"] for r in rows}
+        self.assertTrue(buckets <= {0, 1, 2, 3})
+        self.assertIn(0, buckets)
+        self.assertIn(3, buckets)
+        self.assertEqual(Country.objects.count(), sum(r["n"] for r in rows))
+    
+    
+    def test_histogram_sliced(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        dgeq.sliced = True
+        with self.assertRaises(InvalidCommandError):
+            commands.Histogram()(dgeq, "c:histogram", ["field=population"])
 
 
 
@@ -472,3 +850,274 @@ class TimeTestCase(TestCase):
         dgeq = GenericQuery(Country, QueryDict())
         with self.assertRaises(InvalidCommandError):
             commands.Time()(dgeq, "c:time", values)
+
+
+
+class TimeSeriesTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+    
+    
+    def test_timeseries(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.TimeSeries()(dgeq, "c:timeseries", ["field=date|interval=year|to=year"])
+        commands.Aggregate()(dgeq, "c:aggregate", ["field=id|func=count|to=n"])
+        
+        self.assertEqual({"year": "year"}, dgeq.group_by)
+        rows = list(dgeq.queryset)
+        for r in rows:
+            self.assertEqual(Disaster.objects.filter(date__year=r["year"].year).count(), r["n"])
+        self.assertEqual(Disaster.objects.count(), sum(r["n"] for r in rows))
+    
+    
+    def test_timeseries_after_aggregation(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Group()(dgeq, "c:group", ["event"])
+        commands.Aggregate()(dgeq, "c:aggregate", ["field=id|func=count|to=n"])
+        with self.assertRaises(InvalidCommandError):
+            commands.TimeSeries()(dgeq, "c:timeseries", ["field=date"])
+
+
+
+class TopNTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+    
+    
+    def expected(self, n):
+        rows = list()
+        for country in Disaster.objects.values_list("country", flat=True).distinct():
+            disasters = Disaster.objects.filter(country=country).order_by("-date", "pk")
+            rows.extend(disasters[:n])
+        return rows
+    
+    
+    def test_topn_window(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with mock.patch.object(connection.features, "supports_over_clause", True):
+            commands.TopN()(dgeq, "c:topn", ["partition=country|sort=-date|n=2"])
+        self.assertEqual(
+            sorted(self.expected(2), key=lambda d: d.pk), sorted(dgeq.queryset, key=lambda d: d.pk)
+        )
+    
+    
+    def test_topn_subquery(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with mock.patch.object(connection.features, "supports_over_clause", False):
+            commands.TopN()(dgeq, "c:topn", ["partition=country|sort=-date|n=2"])
+        self.assertEqual(
+            sorted(self.expected(2), key=lambda d: d.pk), sorted(dgeq.queryset, key=lambda d: d.pk)
+        )
+    
+    
+    def test_topn_sorted_by_group(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.TopN()(dgeq, "c:topn", ["partition=country|sort=-date|n=3"])
+        rows = list(dgeq.queryset)
+        self.assertEqual(sorted(rows, key=lambda d: (d.country_id, -d.date.timestamp())), rows)
+    
+    
+    def test_topn_many_partition(self):
+        dgeq = GenericQuery(River, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.TopN()(dgeq, "c:topn", ["partition=countries|sort=-length"])
+    
+    
+    def test_topn_invalid_n(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.TopN()(dgeq, "c:topn", ["partition=country|n=0"])
+    
+    
+    def test_topn_missing_partition(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.TopN()(dgeq, "c:topn", ["sort=-date"])
+
+
+
+class OrTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_or(self):
+        dgeq = GenericQuery(River, QueryDict())
+        commands.Or()(dgeq, "c:or", ["length=>5000'discharge=>10000"])
+        expected = River.objects.filter(models.Q(length__gt=5000) | models.Q(discharge__gt=10000))
+        self.assertEqual(set(expected), set(dgeq.queryset))
+    
+    
+    def test_or_groups(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Or()(dgeq, "c:or", ["population=>100000000'area=>5000000,name=^C'name=^I"])
+        commands.Filtering()(dgeq, "region.continent.name", ["!Africa"])
+        expected = Country.objects.filter(
+            models.Q(population__gt=100000000) | models.Q(area__gt=5000000),
+            models.Q(name__startswith="C") | models.Q(name__startswith="I"),
+        ).exclude(region__continent__name="Africa")
+        self.assertTrue(expected.exists())
+        self.assertEqual(set(expected), set(dgeq.queryset))
+    
+    
+    def test_or_case(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Case()(dgeq, "c:case", ["0"])
+        commands.Or()(dgeq, "c:or", ["name=france'name=germany"])
+        self.assertEqual({"France", "Germany"}, {c.name for c in dgeq.queryset})
+    
+    
+    def test_or_list(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Or()(dgeq, "c:or", ["name=@France;Germany'population=>200000000"])
+        expected = Country.objects.filter(
+            models.Q(name__in=["France", "Germany"]) | models.Q(population__gt=200000000)
+        )
+        self.assertEqual(set(expected), set(dgeq.queryset))
+    
+    
+    def test_or_censored(self):
+        dgeq = GenericQuery(Country, QueryDict(), private_fields={Country: ["population"]})
+        with self.assertRaises(UnknownFieldError):
+            commands.Or()(dgeq, "c:or", ["population=>100000000'area=>5000000"])
+    
+    
+    def test_or_invalid(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Or()(dgeq, "c:or", ["population'area=>5000000"])
+        with self.assertRaises(UnknownFieldError):
+            commands.Or()(dgeq, "c:or", ["unknown=1'area=>5000000"])
+
+
+
+class SampleTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_sample(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Sample()(dgeq, "c:sample", ["20"])
+        rows = list(dgeq.queryset)
+        self.assertEqual(20, len(rows))
+        self.assertEqual(20, len({c.pk for c in rows}))
+    
+    
+    def test_sample_seed(self):
+        dgeq1 = GenericQuery(Country, QueryDict())
+        commands.Sample()(dgeq1, "c:sample", ["size=20|seed=42"])
+        dgeq2 = GenericQuery(Country, QueryDict())
+        commands.Sample()(dgeq2, "c:sample", ["size=20|seed=42"])
+        self.assertEqual(list(dgeq1.queryset), list(dgeq2.queryset))
+    
+    
+    def test_sample_filtered(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Filtering()(dgeq, "population", [">10000000"])
+        commands.Sample()(dgeq, "c:sample", ["size=15|seed=1"])
+        rows = list(dgeq.queryset)
+        self.assertEqual(15, len(rows))
+        self.assertTrue(all(c.population > 10000000 for c in rows))
+    
+    
+    def test_sample_bigger_than_rows(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Filtering()(dgeq, "population", [">1000000000"])
+        commands.Sample()(dgeq, "c:sample", ["50"])
+        self.assertEqual(
+            set(Country.objects.filter(population__gt=1000000000)), set(dgeq.queryset)
+        )
+    
+    
+    def test_sample_percent(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Sample()(dgeq, "c:sample", ["10%"])
+        self.assertEqual(round(Country.objects.count() / 10), dgeq.queryset.count())
+    
+    
+    def test_sample_percent_truncated(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with mock.patch("dgeq.constants.DGEQ_MAX_LIMIT", 5):
+            commands.Sample()(dgeq, "c:sample", ["50%"])
+        self.assertEqual(5, dgeq.queryset.count())
+        
+        # Without limit, samples are bounded by the number of parameters
+        dgeq = GenericQuery(Disaster, QueryDict())
+        with mock.patch("dgeq.constants.DGEQ_MAX_LIMIT", 0), \
+                mock.patch.object(connection.features, "max_query_params", 50):
+            commands.Sample()(dgeq, "c:sample", ["100%"])
+            self.assertEqual(50, dgeq.queryset.count())
+            with self.assertRaises(InvalidCommandError):
+                commands.Sample()(GenericQuery(Disaster, QueryDict()), "c:sample", ["51"])
+    
+    
+    def test_sample_tablesample(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            commands.Sample()(dgeq, "c:sample", ["size=10%|seed=3"])
+        self.assertIn("TABLESAMPLE BERNOULLI (10.0) REPEATABLE (3)", str(dgeq.queryset.query))
+    
+    
+    def test_sample_invalid_size(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with self.assertRaises(InvalidCommandError):
+            commands.Sample()(dgeq, "c:sample", ["0"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Sample()(dgeq, "c:sample", [str(DGEQ_MAX_LIMIT + 1)])
+        with self.assertRaises(InvalidCommandError):
+            commands.Sample()(dgeq, "c:sample", ["101%"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Sample()(dgeq, "c:sample", ["size=10|seed=a"])
+    
+    
+    def test_sample_after_slicing(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Subset()(dgeq, "c:limit", ["10"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Sample()(dgeq, "c:sample", ["5"])
+
+
+
+class WindowTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_window(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Window()(dgeq, "c:window", ["to=rank|func=row_number|order=-population"])
+        commands.Filtering()(dgeq, "region.continent.name", ["Europe"])
+        commands.Sort()(dgeq, "c:sort", ["rank"])
+        commands.Subset()(dgeq, "c:start", ["5"])
+        commands.Subset()(dgeq, "c:limit", ["5"])
+        self.assertIn("rank", dgeq.arbitrary_fields)
+        expected = Country.objects.filter(region__continent__name="Europe").order_by("-population")
+        self.assertEqual(list(expected[5:10]), list(dgeq.queryset))
+        self.assertEqual(list(range(6, 11)), [c.rank for c in dgeq.queryset])
+    
+    
+    def test_window_filter(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Window()(dgeq, "c:window", ["to=rank|func=rank|order=-population"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Filtering()(dgeq, "rank", ["<5"])
+    
+    
+    def test_window_not_supported(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        with mock.patch.object(connection.features, "supports_over_clause", False):
+            with self.assertRaises(InvalidCommandError):
+                commands.Window()(dgeq, "c:window", ["to=rank|func=rank|order=-population"])
+    
+    
+    def test_window_after_group(self):
+        dgeq = GenericQuery(Country, QueryDict())
+        commands.Group()(dgeq, "c:group", ["region"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Window()(dgeq, "c:window", ["to=rank|func=rank|order=-population"])
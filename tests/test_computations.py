@@ -0,0 +1,110 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+
+from dgeq.computations import MAX_EXPRESSION_DEPTH, MAX_EXPRESSION_LENGTH, Computation
+from dgeq.exceptions import InvalidCommandError, UnknownFieldError
+from dgeq.utils import Censor
+from django_dummy_app.models import Country, River
+
+
+
+class ComputationTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AnonymousUser()
+        cls.censor = Censor(user=cls.user)
+    
+    
+    def test_apply(self):
+        computation = Computation.from_query_value(
+            "to=density|expr=population/area", Country, self.censor
+        )
+        self.assertEqual("density", computation.to)
+        self.assertEqual(["population", "area"], computation.fields)
+        for c in computation.apply(Country.objects.all())[:20]:
+            self.assertAlmostEqual(c.population / c.area, c.density)
+    
+    
+    def test_operators(self):
+        computation = Computation.from_query_value(
+            "to=value|expr=-(population + 2 * area) / 4 - 1.5 + +area", Country, self.censor
+        )
+        for c in computation.apply(Country.objects.all())[:20]:
+            self.assertAlmostEqual(-(c.population + 2 * c.area) / 4 - 1.5 + c.area, c.value)
+    
+    
+    def test_related_field(self):
+        computation = Computation.from_query_value(
+            "to=share|expr=population / region.continent.id", Country, self.censor
+        )
+        for c in computation.apply(Country.objects.all())[:20]:
+            self.assertAlmostEqual(c.population / c.region.continent.id, c.share)
+    
+    
+    def test_division_by_zero(self):
+        computation = Computation.from_query_value("to=value|expr=area / 0", Country, self.censor)
+        self.assertIsNone(computation.apply(Country.objects.all()).first().value)
+    
+    
+    def test_arbitrary_field(self):
+        computation = Computation.from_query_value(
+            "to=value|expr=total*2", Country, self.censor, {"total"}
+        )
+        self.assertEqual(["total"], computation.fields)
+    
+    
+    def test_unsafe_expression(self):
+        for expr in ["population**2", "__import__('os')", "population.real()", "'a'",
+                     "area if population else 1", "area % 2", "True"]:
+            with self.assertRaises(InvalidCommandError):
+                Computation.from_query_value(f"to=value|expr={expr}", Country, self.censor)
+    
+    
+    def test_invalid_expression(self):
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("to=value|expr=area /", Country, self.censor)
+    
+    
+    def test_expression_too_big(self):
+        expressions = [
+            "area" + "+1" * MAX_EXPRESSION_LENGTH,
+            "area" + "+1" * (MAX_EXPRESSION_DEPTH + 1),
+            "-" * (MAX_EXPRESSION_DEPTH + 1) + "area",
+            "(" * 300 + "area" + ")" * 300,
+        ]
+        for expr in expressions:
+            with self.assertRaises(InvalidCommandError):
+                Computation.from_query_value(f"to=value|expr={expr}", Country, self.censor)
+        Computation.from_query_value(
+            "to=value|expr=area" + "+1" * MAX_EXPRESSION_DEPTH, Country, self.censor
+        )
+    
+    
+    def test_not_numeric(self):
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("to=value|expr=name*2", Country, self.censor)
+    
+    
+    def test_unknown_field(self):
+        with self.assertRaises(UnknownFieldError):
+            Computation.from_query_value("to=value|expr=unknown*2", Country, self.censor)
+    
+    
+    def test_many_field(self):
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("to=value|expr=countries.area", River, self.censor)
+    
+    
+    def test_missing_arguments(self):
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("expr=area*2", Country, self.censor)
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("to=value", Country, self.censor)
+    
+    
+    def test_already_used_to(self):
+        with self.assertRaises(InvalidCommandError):
+            Computation.from_query_value("to=area|expr=area*2", Country, self.censor)
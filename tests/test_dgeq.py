@@ -481,3 +481,25 @@ class DgeqTestCase(TestCase):
     def test_permission_true_user_none(self):
         with self.assertRaises(ValueError):
             GenericQuery(Country, QueryDict(), use_permissions=True)
+    
+    
+    def test_evaluate_groups(self):
+        query_dict = QueryDict(
+            "c:group=region.continent.name&c:aggregate=field=population|func=sum|to=total"
+            "&c:sort=-total&c:count=1&c:limit=2"
+        )
+        res = GenericQuery(Country, query_dict).evaluate()
+        expected = list(
+            Country.objects.values("region__continent__name")
+            .annotate(total=models.Sum("population")).order_by("-total")
+        )
+        self.assertEqual(True, res["status"])
+        self.assertEqual(len(expected), res["count"])
+        self.assertEqual(
+            [
+                {"region.continent.name": r["region__continent__name"],
+                 "total":                 r["total"]}
+                for r in expected[:2]
+            ],
+            res["rows"]
+        )
@@ -1,10 +1,15 @@
+import datetime
 import random
+import sys
 from unittest import mock
 
+from django.contrib.auth.models import User
+from django.db.models.functions import Lower
 from django.test import TestCase
 
-from dgeq.exceptions import SearchModifierError
-from dgeq.filter import DEFAULT_FILTERS_TABLE, Filter
+from dgeq import utils
+from dgeq.exceptions import InvalidValueError, SearchModifierError
+from dgeq.filter import DEFAULT_FILTERS_TABLE, LOWER_FIELDS, Filter, next_prefix
 from django_dummy_app.models import Country, Disaster, River
 
 
@@ -386,6 +391,40 @@ class TypeModifierFilterTestCase(TestCase):
         self.assertEqual(list(expected), list(queryset))
     
     
+    def test_in_int(self):
+        queryset = Country.objects.all()
+        pks = list(queryset.values_list("pk", flat=True)[:5])
+        f = Filter("id", "@" + ";".join(map(str, pks + pks[:2])), False)
+        self.assertEqual(pks, f.value)
+        queryset = f.apply(queryset)
+        
+        self.assertEqual(set(Country.objects.filter(pk__in=pks)), set(queryset))
+    
+    
+    def test_in_str(self):
+        queryset = Country.objects.all()
+        f = Filter("name", "@France;Germany;Unknown", True)
+        queryset = f.apply(queryset)
+        
+        self.assertEqual({"France", "Germany"}, {c.name for c in queryset})
+    
+    
+    def test_in_datetime(self):
+        queryset = Disaster.objects.all()
+        dates = list(queryset.values_list("date", flat=True)[:3])
+        f = Filter("date", "@" + ";".join(d.isoformat() for d in dates), False)
+        queryset = f.apply(queryset)
+        
+        self.assertEqual(set(Disaster.objects.filter(date__in=dates)), set(queryset))
+    
+    
+    def test_in_empty(self):
+        queryset = Country.objects.all()
+        f = Filter("id", "@", False)
+        
+        self.assertEqual([], list(f.apply(queryset)))
+    
+    
     @mock.patch("dgeq.filter.DGEQ_FILTERS_TABLE", {
         **DEFAULT_FILTERS_TABLE, **{('!', int): None}
     })
@@ -394,3 +433,250 @@ class TypeModifierFilterTestCase(TestCase):
         
         with self.assertRaises(SearchModifierError):
             f.get()
+    
+    
+    def test_eq(self):
+        self.assertEqual(Filter("population", ">10", True), Filter("population", ">10", True))
+        self.assertNotEqual(Filter("population", ">10", True), Filter("population", ">11", True))
+        self.assertNotEqual(Filter("population", ">10", True), Filter("population", "<10", True))
+        self.assertNotEqual(Filter("population", ">10", True), Filter("area", ">10", True))
+        self.assertNotEqual(Filter("name", "France", True), Filter("name", "France", False))
+        self.assertNotEqual(Filter("population", ">10", True), ">10")
+
+
+
+
+class TargetFieldFilterTestCase(TestCase):
+    """Test the parsing of values according to the type of the field."""
+    
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_str_field_numeric_value(self):
+        f = Filter("name", "2020", False, utils.target_field("name", Country))
+        
+        self.assertEqual("2020", f.value)
+        self.assertEqual([], list(f.apply(Country.objects.all())))
+    
+    
+    def test_str_field_modifier(self):
+        f = Filter("name", "*1", False, utils.target_field("name", Country))
+        
+        self.assertEqual("1", f.value)
+        self.assertEqual([], list(f.apply(Country.objects.all())))
+    
+    
+    def test_int_field(self):
+        queryset = Country.objects.all()
+        c = queryset[random.randint(0, queryset.count() - 1)]
+        f = Filter(
+            "population", str(c.population), False, utils.target_field("population", Country)
+        )
+        
+        self.assertEqual([c], list(f.apply(queryset)))
+    
+    
+    def test_int_field_invalid_value(self):
+        with self.assertRaises(InvalidValueError):
+            Filter("population", ">abc", False, utils.target_field("population", Country))
+    
+    
+    def test_bool_field(self):
+        User.objects.create_user("active")
+        User.objects.create_user("inactive", is_active=False)
+        target = utils.target_field("is_active", User)
+        
+        f = Filter("is_active", "true", False, target)
+        self.assertIs(True, f.value)
+        self.assertEqual(["active"], [u.username for u in f.apply(User.objects.all())])
+        f = Filter("is_active", "!true", False, target)
+        self.assertEqual(["inactive"], [u.username for u in f.apply(User.objects.all())])
+        f = Filter("is_active", "0", False, target)
+        self.assertEqual(["inactive"], [u.username for u in f.apply(User.objects.all())])
+    
+    
+    def test_related_field_invalid_value(self):
+        with self.assertRaises(InvalidValueError):
+            Filter("region", "abc", False, utils.target_field("region", Country))
+    
+    
+    def test_list_invalid_value(self):
+        with self.assertRaises(InvalidValueError):
+            Filter("id", "@1;abc", False, utils.target_field("id", Country))
+    
+    
+    def test_datetime_field(self):
+        f = Filter("date", "[2010", False, utils.target_field("date", Disaster))
+        queryset = f.apply(Disaster.objects.all())
+        
+        self.assertTrue(f.value.tzinfo is not None)
+        self.assertEqual(
+            set(Disaster.objects.filter(date__year__gte=2010)), set(queryset)
+        )
+    
+    
+    def test_no_target(self):
+        f = Filter("population", "abc", False)
+        
+        self.assertEqual("abc", f.value)
+
+
+
+
+class LookupRewriteTestCase(TestCase):
+    """Test lookups rewritten with `DGEQ_LOOKUP_REWRITES`."""
+    
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["lower"]}})
+    def test_lower(self):
+        f = Filter("name", "fRaNcE", False, utils.target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertIn("LOWER(", str(queryset.query))
+        self.assertEqual([Country.objects.get(name="France")], list(queryset))
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["lower"]}})
+    def test_lower_non_ascii(self):
+        country = Country.objects.first()
+        Country.objects.filter(pk=country.pk).update(name="Équateur")
+        for value in ["Équateur", "*quateu", "$uateur"]:
+            f = Filter("name", value, False, utils.target_field("name", Country))
+            self.assertEqual([country.pk], [c.pk for c in f.apply(Country.objects.all())])
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["lower", "prefix"]}})
+    def test_lower_prefix_non_ascii(self):
+        country = Country.objects.first()
+        Country.objects.filter(pk=country.pk).update(name="Équateur")
+        f = Filter("name", "^Équa", False, utils.target_field("name", Country))
+        self.assertEqual([country.pk], [c.pk for c in f.apply(Country.objects.all())])
+    
+    
+    def test_lower_registered(self):
+        for field in LOWER_FIELDS:
+            self.assertIs(Lower, field.get_lookups().get("lower"))
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["lower"]}})
+    def test_lower_case_sensitive(self):
+        f = Filter("name", "France", True, utils.target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertNotIn("LOWER(", str(queryset.query))
+        self.assertEqual([Country.objects.get(name="France")], list(queryset))
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {
+        "django_dummy_app.Country": {"name": ["prefix"]}
+    })
+    def test_prefix(self):
+        f = Filter("name", "^Fr", True, utils.target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertNotIn("LIKE", str(queryset.query))
+        self.assertEqual(
+            set(Country.objects.filter(name__startswith="Fr")), set(queryset)
+        )
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["lower", "prefix"]}})
+    def test_lower_prefix(self):
+        f = Filter("name", "^fR", False, utils.target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertIn("LOWER(", str(queryset.query))
+        self.assertNotIn("LIKE", str(queryset.query))
+        self.assertEqual(
+            set(Country.objects.filter(name__istartswith="fr")), set(queryset)
+        )
+    
+    
+    @mock.patch("dgeq.filter.DGEQ_LOOKUP_REWRITES", {Country: {"name": ["prefix"]}})
+    def test_prefix_exclude(self):
+        f = Filter("name", "!Fr", True, utils.target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertEqual(set(Country.objects.exclude(name="Fr")), set(queryset))
+    
+    
+    def test_next_prefix(self):
+        self.assertEqual("ab", next_prefix("aa"))
+        self.assertEqual("b", next_prefix("a" + chr(sys.maxunicode)))
+        self.assertEqual("\ue000", next_prefix("\ud7ff"))
+        self.assertIsNone(next_prefix(chr(sys.maxunicode)))
+
+
+
+
+class DatePartFilterTestCase(TestCase):
+    """Test date part filters compiled to half-open ranges."""
+    
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def test_year(self):
+        f = Filter("date", "@year:2010", False, utils.target_field("date", Disaster))
+        queryset = f.apply(Disaster.objects.all())
+        
+        self.assertNotIn("django_datetime_extract", str(queryset.query))
+        self.assertEqual(set(Disaster.objects.filter(date__year=2010)), set(queryset))
+    
+    
+    def test_month(self):
+        f = Filter("date", "@month:2010-12", False, utils.target_field("date", Disaster))
+        queryset = f.apply(Disaster.objects.all())
+        
+        self.assertEqual(
+            set(Disaster.objects.filter(date__year=2010, date__month=12)), set(queryset)
+        )
+    
+    
+    def test_day(self):
+        d = Disaster.objects.first().date
+        f = Filter(
+            "date", f"@day:{d.date().isoformat()}", False, utils.target_field("date", Disaster)
+        )
+        queryset = f.apply(Disaster.objects.all())
+        
+        self.assertIn(Disaster.objects.first(), queryset)
+        self.assertEqual(set(Disaster.objects.filter(date__date=d.date())), set(queryset))
+    
+    
+    def test_multiple(self):
+        f = Filter("date", "@year:2004;2010", False, utils.target_field("date", Disaster))
+        queryset = f.apply(Disaster.objects.all())
+        
+        self.assertEqual(
+            set(Disaster.objects.filter(date__year__in=[2004, 2010])), set(queryset)
+        )
+    
+    
+    def test_truncated(self):
+        f = Filter("date", "@year:2010-05-12", False, utils.target_field("date", Disaster))
+        
+        self.assertEqual(
+            [(datetime.datetime(2010, 1, 1, tzinfo=datetime.timezone.utc),
+              datetime.datetime(2011, 1, 1, tzinfo=datetime.timezone.utc))],
+            f.value
+        )
+    
+    
+    def test_december(self):
+        f = Filter("date", "@month:2010-12", False, utils.target_field("date", Disaster))
+        
+        self.assertEqual(datetime.datetime(2011, 1, 1), f.value[0][1].replace(tzinfo=None))
+    
+    
+    def test_invalid_value(self):
+        with self.assertRaises(InvalidValueError):
+            Filter("date", "@year:abc", False, utils.target_field("date", Disaster))
+    
+    
+    def test_not_a_date_field(self):
+        f = Filter("event", "@year:2010", False, utils.target_field("event", Disaster))
+        
+        self.assertIsNone(f.date_part)
+        self.assertEqual(["year:2010"], f.value)
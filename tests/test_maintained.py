@@ -0,0 +1,234 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+
+from dgeq import GenericQuery, maintained
+from dgeq.management.commands.dgeq_annotations import Command
+from django_dummy_app.models import Continent, Country, Disaster, Forest, Region, River
+
+
+MAINTAINED_ANNOTATIONS = {
+    Country: {
+        "n_rivers": "field=rivers|func=count",
+        "rivers_length": "field=rivers.length|func=sum",
+        "n_long_rivers": "field=rivers|func=count|filters=rivers.length=>2000",
+        "n_disasters": "field=disasters|func=count",
+    },
+    "django_dummy_app.Continent": {
+        "n_countries": "field=regions.countries|func=count",
+    },
+}
+
+COUNTRY_ANNOTATIONS = ",".join([
+    "field=rivers|func=count|to=a",
+    "field=rivers.length|func=sum|to=b",
+    "field=rivers|func=count|filters=rivers.length=>2000|to=c",
+    "field=disasters|func=count|to=d",
+])
+
+
+
+class MaintainedAnnotationTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def setUp(self):
+        patcher = mock.patch(
+            "dgeq.maintained.DGEQ_MAINTAINED_ANNOTATIONS", MAINTAINED_ANNOTATIONS
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        maintained.build_table(Country, connection)
+        maintained.build_table(Continent, connection)
+    
+    
+    def tearDown(self):
+        maintained.drop_table(Country, connection)
+        maintained.drop_table(Continent, connection)
+    
+    
+    def evaluate(self, model, query_string, stored):
+        query = GenericQuery(model, QueryDict(query_string))
+        if stored:
+            result = query.evaluate()
+        else:
+            with mock.patch("dgeq.maintained.DGEQ_MAINTAINED_ANNOTATIONS", {}):
+                result = query.evaluate()
+        return query, result
+    
+    
+    def assertSameResult(self, model, query_string):
+        query, result = self.evaluate(model, query_string, True)
+        self.assertTrue(result["status"], result)
+        self.assertTrue(all(a.strategy == "stored" for a in query.annotations))
+        self.assertEqual(self.evaluate(model, query_string, False)[1], result, query_string)
+    
+    
+    def assertUpToDate(self):
+        self.assertSameResult(
+            Country, f"c:annotate={COUNTRY_ANNOTATIONS}&c:sort=id&c:limit=0&c:show=id,a,b,c,d"
+        )
+        self.assertSameResult(
+            Continent, "c:annotate=field=regions.countries|func=count|to=n&c:show=id,n&c:sort=id"
+        )
+    
+    
+    def test_stored_annotation(self):
+        query_strings = [
+            f"c:annotate={COUNTRY_ANNOTATIONS}&c:sort=-a,id&c:limit=20",
+            "c:annotate=field=rivers|func=count|to=n&n=>2&c:sort=id&c:show=name,n&c:limit=0",
+            "name=*stan&c:annotate=field=rivers|func=count|to=n&c:sort=id&c:show=name,n",
+            "c:annotate=field=rivers|func=count|to=n&c:aggregate=field=n|func=avg|to=avg"
+            "&c:evaluate=0",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, query_string)
+        
+        query, _ = self.evaluate(Country, "c:annotate=field=rivers|func=count|to=n", True)
+        sql = str(query.queryset.query)
+        self.assertIn(maintained.annotation_table(Country), sql)
+        self.assertNotIn("GROUP BY", sql)
+    
+    
+    def test_not_matching(self):
+        query_strings = [
+            "c:annotate=field=rivers|func=count|filters=rivers.length=>1000|to=n",
+            "c:annotate=field=rivers|func=max|to=n",
+            "c:annotate=field=mountains|func=count|to=n",
+        ]
+        for query_string in query_strings:
+            query, _ = self.evaluate(Country, query_string, True)
+            self.assertNotEqual("stored", query.annotations[0].strategy, query_string)
+    
+    
+    def test_table_not_built(self):
+        maintained.drop_table(Country, connection)
+        query, result = self.evaluate(Country, "c:annotate=field=rivers|func=count|to=n", True)
+        self.assertTrue(result["status"])
+        self.assertNotEqual("stored", query.annotations[0].strategy)
+        
+        # Saving must not fail either
+        country = Country.objects.first()
+        country.save()
+    
+    
+    def test_table_not_built_cached(self):
+        maintained.drop_table(Country, connection)
+        Country.objects.first().save()
+        with mock.patch.object(
+            connection.introspection, "table_names", wraps=connection.introspection.table_names
+        ) as table_names:
+            Country.objects.first().save()
+            self.evaluate(Country, "c:annotate=field=rivers|func=count|to=n", True)
+            self.assertEqual(0, table_names.call_count)
+            
+            # Looked for again once the timeout is exceeded
+            with mock.patch("dgeq.maintained.MISSING_TABLE_TIMEOUT", 0):
+                Country.objects.first().save()
+            self.assertEqual(1, table_names.call_count)
+        
+        maintained.build_table(Country, connection)
+        self.assertUpToDate()
+    
+    
+    def test_refresh_upsert(self):
+        country = Country.objects.get(name="France")
+        annotations = maintained.maintained_annotations(Country)
+        queryset = Country.objects.filter(pk=country.pk)
+        country.rivers.clear()
+        
+        # Writing a row already in the side table updates it
+        self.assertEqual(
+            {country.pk},
+            maintained._store(Country, annotations, queryset, connection, upsert=True)
+        )
+        self.assertUpToDate()
+    
+    
+    def test_unwatched_model(self):
+        with mock.patch(
+            "dgeq.maintained._annotated_models", wraps=maintained._annotated_models
+        ) as annotated_models:
+            Forest.objects.first().save()
+            Forest.objects.first().save()
+        self.assertEqual(1, annotated_models.call_count)
+        self.assertEqual([], maintained._watched(Forest, None))
+    
+    
+    def test_m2m_changed(self):
+        country = Country.objects.get(name="France")
+        rivers = list(River.objects.exclude(countries=country)[:3])
+        
+        country.rivers.add(*rivers[:2])
+        self.assertUpToDate()
+        rivers[2].countries.add(country)
+        self.assertUpToDate()
+        country.rivers.remove(rivers[0])
+        self.assertUpToDate()
+        rivers[1].countries.remove(country)
+        self.assertUpToDate()
+        country.rivers.clear()
+        self.assertUpToDate()
+        rivers[2].countries.clear()
+        self.assertUpToDate()
+        country.rivers.set(rivers)
+        self.assertUpToDate()
+    
+    
+    def test_save_and_delete(self):
+        river = River.objects.filter(length__lt=2000).first()
+        river.length = 5000
+        river.save()
+        self.assertUpToDate()
+        river.delete()
+        self.assertUpToDate()
+        
+        disaster = Disaster.objects.first()
+        disaster.country = Country.objects.exclude(pk=disaster.country_id).first()
+        disaster.save()
+        self.assertUpToDate()
+        Disaster.objects.create(
+            event="Storm", date=disaster.date, country=disaster.country, source="Test",
+            comment="Test"
+        )
+        self.assertUpToDate()
+        disaster.delete()
+        self.assertUpToDate()
+        
+        country = Country.objects.create(
+            name="Atlantis", area=1, population=1, region=Region.objects.first()
+        )
+        self.assertUpToDate()
+        country.region = Region.objects.exclude(continent=country.region.continent).first()
+        country.save()
+        self.assertUpToDate()
+        country.delete()
+        self.assertUpToDate()
+        
+        Region.objects.first().delete()
+        self.assertUpToDate()
+    
+    
+    def test_management_command(self):
+        maintained.drop_table(Country, connection)
+        out = StringIO()
+        call_command(Command(), stdout=out)
+        self.assertIn("django_dummy_app.Country", out.getvalue())
+        self.assertIn("django_dummy_app.Continent", out.getvalue())
+        self.assertUpToDate()
+        
+        call_command(Command(), "--drop", stdout=out)
+        with connection.cursor() as cursor:
+            self.assertNotIn(
+                maintained.annotation_table(Country), connection.introspection.table_names(cursor)
+            )
+    
+    
+    @mock.patch("dgeq.maintained.DGEQ_MAINTAINED_ANNOTATIONS", {})
+    def test_management_command_no_annotations(self):
+        with self.assertRaises(CommandError):
+            call_command(Command(), stdout=StringIO())
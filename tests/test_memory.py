@@ -0,0 +1,204 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+
+from dgeq import GenericQuery, memory, versions
+from django_dummy_app.models import Continent, Country, Disaster, Forest, Region, River
+
+
+
+@mock.patch("dgeq.memory.DGEQ_MEMORY_TABLES", [
+    Continent, Region, Country, River, "django_dummy_app.Disaster"
+])
+class MemoryTableTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def tearDown(self):
+        memory.invalidate()
+    
+    
+    def evaluate(self, model, query_string, in_memory):
+        query = GenericQuery(model, QueryDict(query_string))
+        if not in_memory:
+            query.memory = None
+        result = query.evaluate()
+        return query.memory is not None, result
+    
+    
+    def assertSameResult(self, model, query_string, in_memory=True):
+        used_memory, result = self.evaluate(model, query_string, True)
+        _, expected = self.evaluate(model, query_string, False)
+        self.assertTrue(expected["status"], (query_string, expected))
+        # Order of the rows is only defined when sorting
+        if "c:sort" not in query_string and "rows" in expected:
+            expected["rows"].sort(key=lambda r: r["id"])
+            result["rows"].sort(key=lambda r: r["id"])
+        self.assertEqual(expected, result, query_string)
+        self.assertEqual(in_memory, used_memory, query_string)
+    
+    
+    def test_get_table(self):
+        self.assertIs(memory.get_table(Country), memory.get_table(Country))
+        self.assertIsNotNone(memory.get_table(Disaster))
+        self.assertIsNone(memory.get_table(Forest))
+    
+    
+    def test_no_query(self):
+        memory.get_table(Country)
+        with self.assertNumQueries(0):
+            used_memory, result = self.evaluate(Country, "c:limit=0", True)
+        self.assertTrue(used_memory)
+        self.assertEqual(self.evaluate(Country, "c:limit=0", False)[1], result)
+        
+        with self.assertNumQueries(0):
+            used_memory, _ = self.evaluate(Country, "name=*stan&c:count=1&c:sort=-name", True)
+        self.assertTrue(used_memory)
+    
+    
+    def test_filters(self):
+        query_strings = [
+            "", "name=France", "name=!France", "name=>M", "name=[M",
+            "name=<M", "name=]M", "name=*stan", "name=!*stan", "name=^Ma", "name=!^Ma",
+            "name=$ia", "name=!$ia", "name=France&name=Germany", "name=France,Germany",
+            "name=@France;Germany;Spain", "name=!France@Germany", "population=>50000000",
+            "population=]1000000&area=[100000", "region=1", "region=!1", "region=@1;2",
+            "c:case=0&name=france", "c:case=0&name=*STAN", "c:case=0&name=^ma",
+            "c:case=0&name=$IA", "c:case=0&name=!france", "name=*STAN", "name=^ma",
+            "name=*an", "name=~STAN", "name=*ÉUNION", "c:case=0&name=*éunion",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, f"{query_string}&c:sort=id&c:limit=0")
+    
+    
+    def test_filters_null(self):
+        for query_string in ["discharge=", "discharge=!", "discharge=>1000", "discharge=<1000"]:
+            self.assertSameResult(River, f"{query_string}&c:sort=id&c:limit=0")
+    
+    
+    def test_filters_date(self):
+        query_strings = [
+            "date=>2010-01-01", "date=<2000-01-01T12:00:00", "date=@year:2010",
+            "date=@year:2010;2012", "date=@month:2010-03", "date=@day:2010-03-01;2011-04-01",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Disaster, f"{query_string}&c:sort=id&c:limit=0")
+    
+    
+    def test_sort_and_subset(self):
+        query_strings = [
+            "c:sort=name", "c:sort=-name", "c:sort=area,-name&c:limit=0",
+            "c:sort=-population&c:start=5&c:limit=20", "c:sort=name&c:start=150&c:limit=0",
+            "name=*a&c:sort=-area&c:limit=3", "c:sort=name", "c:sort=name&c:start=1000",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, query_string)
+        self.assertSameResult(River, "c:sort=discharge,name&c:limit=0")
+        self.assertSameResult(River, "c:sort=-discharge,name&c:limit=0")
+    
+    
+    def test_show_count_evaluate(self):
+        query_strings = [
+            "c:show=name,region&c:sort=name", "c:hide=rivers,forests,disasters&c:sort=name",
+            "c:count=1&name=*stan&c:limit=0", "c:count=1&c:evaluate=0",
+            "c:count=1&c:sort=name&c:limit=3",
+            "c:evaluate=0&name=France",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, query_string)
+        self.assertSameResult(Continent, "c:show=name,regions&c:sort=name")
+    
+    
+    def test_fallback(self):
+        query_strings = [
+            "region.name=*Europe", "c:sort=region", "rivers.length=>1000", "c:sort=region.name",
+            "c:join=field=region", "c:annotate=field=rivers|func=count|to=n_rivers",
+            "c:sort=rivers", "c:distinct=1", "c:aggregate=field=area|func=sum|to=total",
+            "c:group=region&c:aggregate=field=area|func=sum|to=total&c:sort=region",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Country, query_string, in_memory=False)
+    
+    
+    def test_errors(self):
+        for query_string in ["c:limit=a", "c:count=a", "c:sort=unknown", "unknown=1"]:
+            _, result = self.evaluate(Country, query_string, True)
+            self.assertFalse(result["status"])
+            _, expected = self.evaluate(Country, query_string, False)
+            self.assertEqual(expected, result)
+    
+    
+    def test_other_process(self):
+        table = memory.get_table(Country)
+        versions.increment(Region)
+        self.assertIsNot(table, memory.get_table(Country))
+
+
+
+@mock.patch("dgeq.memory.DGEQ_MEMORY_TABLES", [Country])
+class MemoryInvalidationTestCase(TransactionTestCase):
+    
+    def setUp(self):
+        continent = Continent.objects.create(name="Continent")
+        self.region = Region.objects.create(name="Region", continent=continent)
+        self.country = Country.objects.create(
+            name="Country", area=1, population=1, region=self.region
+        )
+        self.river = River.objects.create(name="River", length=1)
+        self.disaster = Disaster.objects.create(
+            event="Storm", date="2020-01-01T00:00:00Z", country=self.country, source="IFRC",
+            comment="Storm"
+        )
+    
+    
+    def tearDown(self):
+        memory.invalidate()
+    
+    
+    def test_invalidate_on_signal(self):
+        table = memory.get_table(Country)
+        self.country.population += 1
+        self.country.save()
+        self.assertIsNot(table, memory.get_table(Country))
+        result = GenericQuery(Country, QueryDict("name=Country&c:show=population")).evaluate()
+        self.assertEqual([{"population": 2}], result["rows"])
+        
+        table = memory.get_table(Country)
+        self.region.save()
+        self.assertIsNot(table, memory.get_table(Country))
+        
+        table = memory.get_table(Country)
+        self.river.countries.add(self.country)
+        self.assertIsNot(table, memory.get_table(Country))
+        
+        table = memory.get_table(Country)
+        self.disaster.delete()
+        self.assertIsNot(table, memory.get_table(Country))
+        
+        table = memory.get_table(Country)
+        User.objects.create_user("user")
+        self.assertIs(table, memory.get_table(Country))
+    
+    
+    def test_invalidate_on_commit(self):
+        table = memory.get_table(Country)
+        with transaction.atomic():
+            self.country.population += 1
+            self.country.save()
+            self.assertIs(table, memory.get_table(Country))
+        self.assertIsNot(table, memory.get_table(Country))
+        
+        table = memory.get_table(Country)
+        with transaction.atomic():
+            self.country.save()
+            transaction.set_rollback(True)
+        self.assertIs(table, memory.get_table(Country))
+    
+    
+    def test_untracked_model(self):
+        version = versions.current(User)
+        User.objects.create_user("user")
+        self.assertEqual(version, versions.current(User))
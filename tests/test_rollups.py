@@ -0,0 +1,286 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.http import QueryDict
+from django.test import TestCase
+from django.utils import timezone
+
+from dgeq import GenericQuery, rollups
+from dgeq.management.commands.dgeq_rollups import Command
+from django_dummy_app.models import Country, Disaster, Region
+
+
+ROLLUPS = {
+    "django_dummy_app.Disaster": {
+        "by_country_month": {
+            "group":      "country",
+            "timeseries": "field=date|interval=month",
+            "aggregate":  "field=id|func=count|to=disasters,field=date|func=max|to=last",
+        },
+    },
+    Country: {
+        "by_region": {
+            "group":     "region",
+            "aggregate": ",".join([
+                "field=population|func=sum|to=population_sum",
+                "field=population|func=count|to=population_count",
+                "field=area|func=max|to=area_max",
+                "field=area|func=min|to=area_min",
+            ]),
+        },
+    },
+}
+
+DISASTERS = "c:aggregate=field=id|func=count|to=n,field=date|func=max|to=last"
+
+
+
+class RollupTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def setUp(self):
+        patcher = mock.patch("dgeq.rollups.DGEQ_ROLLUPS", ROLLUPS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for model in [Disaster, Country]:
+            for rollup in rollups.declared_rollups(model):
+                rollup.build(DEFAULT_DB_ALIAS)
+    
+    
+    def tearDown(self):
+        for model in [Disaster, Country]:
+            for rollup in rollups.declared_rollups(model):
+                rollup.drop(DEFAULT_DB_ALIAS)
+    
+    
+    def evaluate(self, model, query_string, use_rollups):
+        if use_rollups:
+            return GenericQuery(model, QueryDict(query_string)).evaluate()
+        with mock.patch("dgeq.rollups.DGEQ_ROLLUPS", {}):
+            return GenericQuery(model, QueryDict(query_string)).evaluate()
+    
+    
+    def assertSameResult(self, model, query_string, source=None):
+        result = self.evaluate(model, query_string, True)
+        self.assertTrue(result["status"], result)
+        self.assertEqual(source, result.pop("source", None), query_string)
+        self.assertEqual(self.evaluate(model, query_string, False), result, query_string)
+    
+    
+    def test_routing(self):
+        query_strings = [
+            f"c:group=country&{DISASTERS}&c:limit=0",
+            f"c:timeseries=field=date|interval=year&{DISASTERS}&c:limit=0",
+            f"c:group=country.region.name&c:timeseries=field=date|interval=quarter&{DISASTERS}"
+            f"&c:sort=-n,period&c:limit=0",
+            f"date=@year:2010;2012&c:group=country&{DISASTERS}&c:limit=0",
+            f"date=@month:2010-03-15;2011-04-01&c:group=country&{DISASTERS}&c:limit=0",
+            f"country.name=France&c:timeseries=field=date&{DISASTERS}&c:limit=0",
+            f"c:group=country.region.continent&{DISASTERS}&n=>100&c:count=1&c:sort=-n",
+            f"c:group=country&{DISASTERS}&c:sort=-n,country&c:start=5&c:limit=10&c:time=0",
+            f"c:case=0&country.name=^united&c:group=country&{DISASTERS}&c:evaluate=0&c:count=1",
+        ]
+        for query_string in query_strings:
+            self.assertSameResult(Disaster, query_string, "by_country_month")
+        
+        self.assertSameResult(
+            Country,
+            "c:group=region.continent.name&c:aggregate=field=population|func=sum|to=s,"
+            "field=population|func=avg|to=a,field=area|func=max|to=max,field=area|func=min|to=min"
+            "&c:sort=region.continent.name",
+            "by_region"
+        )
+    
+    
+    def test_not_routed(self):
+        query_strings = [
+            f"c:group=event&{DISASTERS}",
+            f"c:timeseries=field=date|interval=day&{DISASTERS}",
+            f"c:timeseries=field=date|interval=week&{DISASTERS}",
+            f"date=>2010-01-01&c:group=country&{DISASTERS}",
+            f"date=@day:2010-03-01&c:group=country&{DISASTERS}",
+            f"event=Flood&c:group=country&{DISASTERS}",
+            "c:group=country&c:aggregate=field=id|func=dcount|to=n",
+            "c:group=country&c:aggregate=field=id|func=count|to=n|filters=event=Flood",
+            "c:group=country&c:aggregate=field=date|func=min|to=n",
+            "c:group=country.rivers&c:aggregate=field=id|func=count|to=n",
+            "c:sort=id&c:group=country&c:aggregate=field=id|func=count|to=n",
+            "c:group=country&c:count=1&c:aggregate=field=id|func=count|to=n",
+            "c:aggregate=field=id|func=count|to=n&c:evaluate=0",
+            "c:group=country",
+            f"c:group=country&{DISASTERS}&c:group=event",
+            f"c:group=unknown&{DISASTERS}",
+        ]
+        for query_string in query_strings:
+            result = self.evaluate(Disaster, query_string, True)
+            self.assertNotIn("source", result, query_string)
+            self.assertEqual(self.evaluate(Disaster, query_string, False), result, query_string)
+        
+        self.assertNotIn(
+            "source",
+            self.evaluate(Country, "c:group=region&c:aggregate=field=area|func=avg|to=a", True)
+        )
+    
+    
+    def test_table_not_built(self):
+        for rollup in rollups.declared_rollups(Disaster):
+            rollup.drop(DEFAULT_DB_ALIAS)
+        self.assertSameResult(Disaster, f"c:group=country&{DISASTERS}&c:limit=0")
+    
+    
+    def test_table_not_built_cached(self):
+        for rollup in rollups.declared_rollups(Disaster):
+            rollup.drop(DEFAULT_DB_ALIAS)
+        query_string = f"c:group=country&{DISASTERS}&c:limit=0"
+        with mock.patch.object(
+            connection.introspection, "table_names", wraps=connection.introspection.table_names
+        ) as table_names:
+            self.evaluate(Disaster, query_string, True)
+            self.evaluate(Disaster, query_string, True)
+            self.evaluate(Disaster, "c:show=event", True)
+            self.assertEqual(1, table_names.call_count)
+            
+            # Looked for again once the timeout is exceeded
+            with mock.patch("dgeq.rollups.MISSING_TABLE_TIMEOUT", 0):
+                self.evaluate(Disaster, query_string, True)
+            self.assertEqual(2, table_names.call_count)
+    
+    
+    def test_refresh(self):
+        rollup = rollups.declared_rollups(Disaster)[0]
+        query_string = f"c:timeseries=field=date|interval=year&{DISASTERS}&c:limit=0"
+        
+        # Existing and new groups
+        country = Country.objects.get(name="France")
+        date = timezone.make_aware(datetime.datetime(2010, 3, 12))
+        Disaster.objects.create(
+            event="Storm", date=date, country=country, source="Test", comment="Test"
+        )
+        Disaster.objects.create(
+            event="Storm", date=date.replace(year=2021), country=country, source="Test",
+            comment="Test"
+        )
+        # Not answered from the rollup until it is refreshed
+        self.assertFalse(rollup.fresh(connection))
+        self.assertSameResult(Disaster, query_string)
+        
+        self.assertEqual(
+            Disaster.objects.filter(country=country).dates("date", "month").count(),
+            rollup.refresh(DEFAULT_DB_ALIAS)
+        )
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+        self.assertEqual(0, rollup.refresh(DEFAULT_DB_ALIAS))
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+    
+    
+    def test_refresh_updates_and_deletes(self):
+        rollup = rollups.declared_rollups(Disaster)[0]
+        query_string = f"c:group=country&c:timeseries=field=date&{DISASTERS}&c:limit=0"
+        
+        disaster = Disaster.objects.filter(country__name="France").first()
+        disaster.country = Country.objects.get(name="Germany")
+        disaster.save()
+        Disaster.objects.filter(country__name="Spain").first().delete()
+        rollup.refresh(DEFAULT_DB_ALIAS)
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+        
+        country = rollups.declared_rollups(Country)[0]
+        Country.objects.get(name="Germany").delete()
+        self.assertEqual(1, country.refresh(DEFAULT_DB_ALIAS))
+        self.assertSameResult(
+            Country, "c:group=region&c:aggregate=field=population|func=sum|to=s", "by_region"
+        )
+    
+    
+    @mock.patch("dgeq.rollups.DGEQ_ROLLUPS", {Disaster: {"by_year": {
+        "timeseries": "field=date|interval=year", "aggregate": "field=id|func=count|to=n",
+    }}})
+    def test_refresh_not_grouped_by_fields(self):
+        rollup = rollups.declared_rollups(Disaster)[0]
+        self.addCleanup(rollup.drop, DEFAULT_DB_ALIAS)
+        rollup.build(DEFAULT_DB_ALIAS)
+        
+        # Every row is aggregated again
+        Disaster.objects.first().delete()
+        self.assertEqual(
+            Disaster.objects.dates("date", "year").count(), rollup.refresh(DEFAULT_DB_ALIAS)
+        )
+        self.assertEqual(
+            Disaster.objects.count(), sum(rollup.queryset().values_list("n", flat=True))
+        )
+    
+    
+    def test_changes_rolled_back(self):
+        rollup = rollups.declared_rollups(Disaster)[0]
+        with transaction.atomic():
+            Disaster.objects.first().delete()
+            self.assertFalse(rollup.fresh(connection))
+            transaction.set_rollback(True)
+        self.assertTrue(rollup.fresh(connection))
+    
+    
+    def test_rollup_model(self):
+        rollup = rollups.declared_rollups(Country)[0]
+        self.assertEqual(
+            Country.objects.values("region").distinct().count(), rollup.queryset().count()
+        )
+        self.assertNotIn(rollup.rollup_model, [
+            f.related_model for f in Region._meta.get_fields()
+        ])
+        self.assertNotIn(rollup.rollup_model, apps.get_models(include_auto_created=True))
+    
+    
+    def test_invalid_declaration(self):
+        declarations = [
+            {"aggregate": "field=area|func=sum|to=a"},
+            {"group": "rivers", "aggregate": "field=area|func=sum|to=a"},
+            {"group": "region", "aggregate": "field=area|func=avg|to=a"},
+            {"group": "region", "aggregate": "field=area|func=sum|to=a|filters=area=>1"},
+        ]
+        for declaration in declarations:
+            with self.assertRaises(ValueError):
+                rollups.Rollup(Country, "invalid", declaration)
+        with self.assertRaises(ValueError):
+            rollups.Rollup(Country, "in-valid", {"group": "region"})
+    
+    
+    def test_management_command(self):
+        rollup = rollups.declared_rollups(Disaster)[0]
+        rollup.drop(DEFAULT_DB_ALIAS)
+        query_string = f"c:group=country&{DISASTERS}&c:limit=0"
+        out = StringIO()
+        call_command(Command(), stdout=out)
+        self.assertIn("'by_country_month' of 'django_dummy_app.Disaster'", out.getvalue())
+        self.assertIn("'by_region' of 'django_dummy_app.Country'", out.getvalue())
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+        
+        Disaster.objects.filter(country__name="France").delete()
+        call_command(Command(), stdout=out)
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+        
+        # Updates not sending signals are only seen by a full rebuild
+        Disaster.objects.filter(country__name="Spain").update(
+            country=Country.objects.get(name="Germany")
+        )
+        call_command(Command(), stdout=out)
+        self.assertNotEqual(
+            self.evaluate(Disaster, query_string, False),
+            self.evaluate(Disaster, query_string, True),
+        )
+        call_command(Command(), "--full", stdout=out)
+        self.assertSameResult(Disaster, query_string, "by_country_month")
+        
+        call_command(Command(), "--drop", stdout=out)
+        with connection.cursor() as cursor:
+            self.assertNotIn(rollup.table, connection.introspection.table_names(cursor))
+    
+    
+    @mock.patch("dgeq.rollups.DGEQ_ROLLUPS", {})
+    def test_management_command_no_rollups(self):
+        with self.assertRaises(CommandError):
+            call_command(Command(), stdout=StringIO())
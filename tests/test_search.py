@@ -0,0 +1,189 @@
+import re
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+
+from dgeq import GenericQuery, commands
+from dgeq.exceptions import InvalidCommandError, SearchModifierError
+from dgeq.filter import Filter
+from dgeq.management.commands.dgeq_fulltext import Command
+from dgeq.search import build_fts_table, drop_fts_table, fts5_query, is_full_text
+from dgeq.utils import target_field
+from django_dummy_app.models import Continent, Country, Disaster, Region
+
+
+
+def contains_words(text: str, *words: str) -> bool:
+    tokens = set(re.findall(r"\w+", text.lower()))
+    return all(w in tokens for w in words)
+
+
+
+@mock.patch("dgeq.search.DGEQ_FULL_TEXT_FIELDS", {Disaster: ["comment", "source"]})
+class FullTextSearchTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    @classmethod
+    def setUpClass(cls):
+        # SQLite does not support rolling back the creation of a virtual table,
+        # create it before entering the transaction of the test case.
+        build_fts_table(Disaster, ["comment", "source"], connection)
+        super().setUpClass()
+    
+    
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_fts_table(Disaster, connection)
+    
+    
+    def test_is_full_text(self):
+        self.assertTrue(is_full_text(target_field("comment", Disaster)))
+        self.assertFalse(is_full_text(target_field("event", Disaster)))
+        self.assertFalse(is_full_text(None))
+    
+    
+    def test_fts5_query(self):
+        self.assertEqual('"comment" : ("heavy" "rains")', fts5_query("comment", "heavy rains"))
+        self.assertEqual('"comment" : ("a""b" "OR")', fts5_query("comment", 'a"b OR'))
+        self.assertEqual('"comment" : ("")', fts5_query("comment", ""))
+    
+    
+    def test_filter(self):
+        f = Filter("comment", ":Tornadoes hail", False, target_field("comment", Disaster))
+        queryset = f.apply(Disaster.objects.all())
+        
+        expected = {
+            d for d in Disaster.objects.all() if contains_words(d.comment, "tornadoes", "hail")
+        }
+        self.assertTrue(expected)
+        self.assertEqual(expected, set(queryset))
+        self.assertNotIn("LIKE", str(queryset.query))
+    
+    
+    def test_filter_not_enabled(self):
+        f = Filter("event", ":flood", False, target_field("event", Disaster))
+        
+        with self.assertRaises(SearchModifierError):
+            f.get()
+    
+    
+    def test_filter_related(self):
+        f = Filter(
+            "disasters.comment", ":tornadoes", False, target_field("disasters.comment", Country)
+        )
+        queryset = f.apply(Country.objects.all()).distinct()
+        
+        expected = {
+            d.country for d in Disaster.objects.all() if contains_words(d.comment, "tornadoes")
+        }
+        self.assertEqual(expected, set(queryset))
+    
+    
+    def test_triggers(self):
+        d = Disaster.objects.first()
+        d.comment = "A xylophonic tempest"
+        d.save()
+        Disaster.objects.create(
+            event="Storm", date=d.date, country=d.country, source="Test", comment="Xylophonic"
+        )
+        queryset = Filter(
+            "comment", ":xylophonic", False, target_field("comment", Disaster)
+        ).apply(Disaster.objects.all())
+        self.assertEqual(2, queryset.count())
+        
+        d.delete()
+        self.assertEqual(1, queryset.count())
+    
+    
+    def test_command_relevance(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Filtering()(dgeq, "comment", [":tornadoes"])
+        commands.Sort()(dgeq, "c:sort", ["-comment_relevance"])
+        
+        self.assertIn("comment_relevance", dgeq.arbitrary_fields)
+        relevances = [d.comment_relevance for d in dgeq.queryset]
+        self.assertTrue(relevances)
+        self.assertTrue(all(r > 0 for r in relevances))
+        self.assertEqual(sorted(relevances, reverse=True), relevances)
+    
+    
+    def test_command_relevance_already_used(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Compute()(dgeq, "c:compute", ["to=comment_relevance|expr=id*2"])
+        with self.assertRaises(InvalidCommandError):
+            commands.Filtering()(dgeq, "comment", [":tornadoes"])
+    
+    
+    def test_command_created_field(self):
+        dgeq = GenericQuery(Disaster, QueryDict())
+        commands.Compute()(dgeq, "c:compute", ["to=d|expr=id*2"])
+        with self.assertRaises(SearchModifierError):
+            commands.Filtering()(dgeq, "d", [":foo"])
+        with self.assertRaises(SearchModifierError):
+            commands.Or()(dgeq, "c:or", ["d=:foo'id=1"])
+        
+        result = GenericQuery(
+            Disaster, QueryDict("c:compute=to=d|expr=id*2&d=:foo")
+        ).evaluate()
+        self.assertEqual("INVALID_SEARCH_MODIFIER", result["code"])
+    
+    
+    def test_command_not_built(self):
+        # Patched here since the patch of the class would take precedence
+        fields = {Disaster: ["comment", "source"], Country: ["name"]}
+        with mock.patch("dgeq.search.DGEQ_FULL_TEXT_FIELDS", fields):
+            dgeq = GenericQuery(Country, QueryDict())
+            with self.assertRaises(InvalidCommandError):
+                commands.Filtering()(dgeq, "name", [":france"])
+            with self.assertRaises(InvalidCommandError):
+                commands.Or()(dgeq, "c:or", ["name=:france'area=>1"])
+            
+            result = GenericQuery(Country, QueryDict("name=:france")).evaluate()
+            self.assertEqual("INVALID_COMMAND_ERROR", result["code"])
+
+
+
+class FullTextCommandTestCase(TransactionTestCase):
+    
+    @mock.patch("dgeq.search.DGEQ_FULL_TEXT_FIELDS", {Disaster: ["comment", "source"]})
+    def test_management_command(self):
+        continent = Continent.objects.create(name="Continent")
+        region = Region.objects.create(name="Region", continent=continent)
+        country = Country.objects.create(name="Country", area=1, population=1, region=region)
+        Disaster.objects.create(
+            event="Storm", date="2020-01-01T00:00:00Z", country=country, source="IFRC",
+            comment="Xylophonic storm"
+        )
+        Disaster.objects.create(
+            event="Flood", date="2020-01-01T00:00:00Z", country=country, source="OCHA",
+            comment="Flood"
+        )
+        
+        out = StringIO()
+        call_command(Command(), stdout=out)
+        self.assertIn("django_dummy_app.Disaster", out.getvalue())
+        self.assertEqual(
+            1,
+            Filter("comment", ":xylophonic", False, target_field("comment", Disaster)).apply(
+                Disaster.objects.all()
+            ).count()
+        )
+        
+        call_command(Command(), "--drop", stdout=out)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'django_dummy_app_disaster_dgeq%'"
+            )
+            self.assertEqual([], cursor.fetchall())
+    
+    
+    @mock.patch("dgeq.search.DGEQ_FULL_TEXT_FIELDS", {})
+    def test_management_command_no_fields(self):
+        with self.assertRaises(CommandError):
+            call_command(Command(), stdout=StringIO())
@@ -0,0 +1,190 @@
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+
+from dgeq import trigram, versions
+from dgeq.filter import Filter
+from dgeq.utils import target_field
+from django_dummy_app.models import Continent, Country, Region
+
+
+
+@mock.patch("dgeq.trigram.DGEQ_TRIGRAM_INDEXES", {
+    Country: ["name"], "django_dummy_app.Region": ["name"]
+})
+class TrigramIndexTestCase(TestCase):
+    fixtures = ["tests/django_dummy_app/geography_data.json"]
+    
+    
+    def tearDown(self):
+        trigram.invalidate()
+    
+    
+    def test_trigrams(self):
+        self.assertEqual({"abc", "bcd"}, trigram.trigrams("abcd"))
+        self.assertEqual(set(), trigram.trigrams("ab"))
+    
+    
+    def test_get_index(self):
+        index = trigram.get_index(target_field("name", Country))
+        self.assertIs(index, trigram.get_index(target_field("name", Country)))
+        self.assertIsNone(trigram.get_index(target_field("population", Country)))
+        self.assertIsNone(trigram.get_index(target_field("name", Continent)))
+        self.assertIsNone(trigram.get_index(None))
+    
+    
+    def test_search(self):
+        index = trigram.get_index(target_field("name", Country))
+        
+        self.assertEqual(
+            set(Country.objects.filter(name__icontains="ISTAN").values_list("pk", flat=True)),
+            index.search("name", "ISTAN", "icontains"),
+        )
+        # Same case handling as the LIKE of the database
+        self.assertEqual(
+            set(Country.objects.filter(name__contains="ISTAN").values_list("pk", flat=True)),
+            index.search("name", "ISTAN", "contains"),
+        )
+        self.assertEqual(
+            set(Country.objects.filter(name__icontains="RÉUNION").values_list("pk", flat=True)),
+            index.search("name", "RÉUNION", "icontains"),
+        )
+        self.assertEqual(
+            set(Country.objects.filter(name__startswith="Un").values_list("pk", flat=True)),
+            index.search("name", "Un", "startswith"),
+        )
+        self.assertEqual(
+            set(Country.objects.filter(name__istartswith="uNi").values_list("pk", flat=True)),
+            index.search("name", "uNi", "istartswith"),
+        )
+    
+    
+    def test_filter(self):
+        f = Filter("name", "*istan", False, target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertNotIn("LIKE", str(queryset.query))
+        self.assertTrue(queryset.exists())
+        self.assertEqual(set(Country.objects.filter(name__icontains="istan")), set(queryset))
+    
+    
+    def test_filter_exclude(self):
+        f = Filter("name", "~istan", False, target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertEqual(set(Country.objects.exclude(name__icontains="istan")), set(queryset))
+    
+    
+    def test_filter_related(self):
+        f = Filter("region.name", "^south", False, target_field("region.name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertNotIn("LIKE", str(queryset.query))
+        self.assertTrue(queryset.exists())
+        self.assertEqual(
+            set(Country.objects.filter(region__name__istartswith="south")), set(queryset)
+        )
+    
+    
+    def test_filter_too_many_matches(self):
+        f = Filter("name", "*a", False, target_field("name", Country))
+        with mock.patch.object(connection.features, "max_query_params", 50):
+            queryset = f.apply(Country.objects.all())
+        
+        self.assertIn("LIKE", str(queryset.query))
+        self.assertEqual(set(Country.objects.filter(name__icontains="a")), set(queryset))
+    
+    
+    def test_filter_other_lookup(self):
+        f = Filter("name", "France", False, target_field("name", Country))
+        queryset = f.apply(Country.objects.all())
+        
+        self.assertNotIn(Country, trigram._INDEXES)
+        self.assertEqual([Country.objects.get(name="France")], list(queryset))
+    
+    
+    def test_invalidate(self):
+        index = trigram.get_index(target_field("name", Country))
+        trigram.invalidate(Country)
+        
+        self.assertIsNot(index, trigram.get_index(target_field("name", Country)))
+    
+    
+    def test_other_process(self):
+        index = trigram.get_index(target_field("name", Country))
+        versions.increment(Country)
+        
+        self.assertIsNot(index, trigram.get_index(target_field("name", Country)))
+    
+    
+    @mock.patch("dgeq.versions.DGEQ_IN_MEMORY_MAX_AGE", 0)
+    def test_max_age(self):
+        index = trigram.get_index(target_field("name", Country))
+        
+        self.assertIsNot(index, trigram.get_index(target_field("name", Country)))
+
+
+
+@mock.patch("dgeq.trigram.DGEQ_TRIGRAM_INDEXES", {Country: ["name"]})
+class TrigramSignalsTestCase(TransactionTestCase):
+    
+    def setUp(self):
+        continent = Continent.objects.create(name="Continent")
+        region = Region.objects.create(name="Region", continent=continent)
+        self.country = Country.objects.create(
+            name="France", area=1, population=1, region=region
+        )
+    
+    
+    def tearDown(self):
+        trigram.invalidate()
+    
+    
+    def test_signals(self):
+        index = trigram.get_index(target_field("name", Country))
+        c = self.country
+        c.name = "Xylophonia"
+        c.save()
+        
+        self.assertEqual({c.pk}, index.search("name", "lophon", "icontains"))
+        self.assertEqual(set(), index.search("name", "France", "icontains"))
+        self.assertIs(index, trigram.get_index(target_field("name", Country)))
+        
+        pk = c.pk
+        c.delete()
+        self.assertEqual(set(), index.search("name", "lophon", "icontains"))
+        self.assertNotIn(pk, index.search("name", "o", "icontains"))
+        self.assertIs(index, trigram.get_index(target_field("name", Country)))
+    
+    
+    def test_signals_rollback(self):
+        index = trigram.get_index(target_field("name", Country))
+        c = self.country
+        with transaction.atomic():
+            c.name = "Xylophonia"
+            c.save()
+            # Not applied before the commit
+            self.assertEqual(set(), index.search("name", "lophon", "icontains"))
+            transaction.set_rollback(True)
+        
+        self.assertEqual(set(), index.search("name", "lophon", "icontains"))
+        self.assertEqual({c.pk}, index.search("name", "France", "icontains"))
+    
+    
+    def test_signals_other_process(self):
+        index = trigram.get_index(target_field("name", Country))
+        versions.increment(Country)
+        self.country.name = "Xylophonia"
+        self.country.save()
+        
+        # The index missed a change, it is built again
+        self.assertIsNot(index, trigram.get_index(target_field("name", Country)))
+    
+    
+    def test_signals_no_index(self):
+        version = versions.current(Country)
+        self.country.name = "Xylophonia"
+        self.country.save()
+        
+        self.assertEqual(version + 1, versions.current(Country))
@@ -1,6 +1,8 @@
 import datetime
 
+from django.db import models
 from django.test import TestCase
+from django.utils import timezone
 
 from dgeq import types
 
@@ -24,6 +26,18 @@ class TypeTestCase(TestCase):
         self.assertEqual(..., types.float_parser("string"))
     
     
+    def test_bool_parser(self):
+        self.assertEqual(True, types.bool_parser("true"))
+        self.assertEqual(False, types.bool_parser("False"))
+        self.assertEqual(..., types.bool_parser("1"))
+        self.assertEqual(..., types.bool_parser(""))
+    
+    
+    def test_str_parser(self):
+        self.assertEqual("2020", types.str_parser("2020"))
+        self.assertEqual("", types.str_parser(""))
+    
+    
     def test_int_parser(self):
         self.assertEqual(0.0, types.int_parser("0"))
         self.assertEqual(..., types.int_parser("0.0"))
@@ -67,3 +81,58 @@ class TypeTestCase(TestCase):
         self.assertEqual(..., types.datetime_parser("0.0"))
         self.assertEqual(..., types.datetime_parser(""))
         self.assertEqual(..., types.datetime_parser("string"))
+    
+    
+    def test_aware_datetime_parser(self):
+        self.assertEqual(
+            timezone.make_aware(datetime.datetime(2020, 8, 20, 0, 0)),
+            types.aware_datetime_parser("2020-08-20")
+        )
+        self.assertEqual(
+            datetime.datetime(2020, 8, 20, 14, 20, 47, tzinfo=datetime.timezone.utc),
+            types.aware_datetime_parser("2020-08-20T14:20:47Z")
+        )
+        self.assertEqual(..., types.aware_datetime_parser("string"))
+
+
+
+class FieldParserTestCase(TestCase):
+    """Test `dgeg.types.field_parser()`."""
+    
+    
+    def test_char_field(self):
+        parser = types.field_parser(models.CharField)
+        self.assertEqual("2020", parser("2020"))
+        self.assertEqual(None, parser(""))
+    
+    
+    def test_integer_field(self):
+        parser = types.field_parser(models.IntegerField)
+        self.assertEqual(2020, parser("2020"))
+        self.assertEqual(20.5, parser("20.5"))
+        self.assertEqual(..., parser("string"))
+    
+    
+    def test_subclass(self):
+        self.assertEqual(2020, types.field_parser(models.BigIntegerField)("2020"))
+        self.assertEqual("2020", types.field_parser(models.SlugField)("2020"))
+    
+    
+    def test_date_field(self):
+        parser = types.field_parser(models.DateField)
+        self.assertEqual(datetime.datetime(2020, 1, 1, 0, 0), parser("2020"))
+        self.assertEqual(..., parser("string"))
+    
+    
+    def test_boolean_field(self):
+        parser = types.field_parser(models.BooleanField)
+        self.assertEqual(True, parser("true"))
+        self.assertEqual(0, parser("0"))
+        self.assertEqual(..., parser("string"))
+    
+    
+    def test_generic(self):
+        self.assertEqual(types.generic_parser, types.field_parser(None))
+        self.assertEqual(types.generic_parser, types.field_parser(models.JSONField))
+        self.assertEqual(2020, types.generic_parser("2020"))
+        self.assertEqual("string", types.generic_parser("string"))
@@ -9,7 +9,7 @@ from dgeq.constants import DGEQ_MAX_NESTED_FIELD_DEPTH
 from dgeq.exceptions import FieldDepthError, NotARelatedFieldError, UnknownFieldError
 from dgeq.joins import JoinQuery
 from dgeq.utils import Censor
-from django_dummy_app.models import Country, River
+from django_dummy_app.models import Country, Region, River
 from tests.dummy import DummyCallable
 
 
@@ -81,6 +81,19 @@ class CheckFieldTestCase(TestCase):
 
 
 
+class LikeFoldTestCase(TestCase):
+    
+    def test_like_fold_sqlite(self):
+        self.assertEqual("réunion", utils.like_fold("Réunion", True, "sqlite"))
+        self.assertEqual("rÉunion", utils.like_fold("RÉUNION", False, "sqlite"))
+    
+    
+    def test_like_fold_other(self):
+        self.assertEqual("RÉUNION", utils.like_fold("RÉUNION", True, "postgresql"))
+        self.assertEqual("réunion", utils.like_fold("RÉUNION", False, "postgresql"))
+
+
+
 class ImportClassTestCase(TestCase):
     
     def test_import_class(self):
@@ -268,6 +281,32 @@ class SplitListStringTestCase(TestCase):
 
 
 
+class SpansManyTestCase(TestCase):
+    
+    def test(self):
+        self.assertFalse(utils.spans_many("name", Country))
+        self.assertFalse(utils.spans_many("region.continent.name", Country))
+        self.assertTrue(utils.spans_many("rivers", Country))
+        self.assertTrue(utils.spans_many("region.countries.name", Country))
+        self.assertTrue(utils.spans_many("countries.region", River))
+        self.assertFalse(utils.spans_many("rivers_count", Country, ["rivers_count"]))
+
+
+
+class TargetFieldTestCase(TestCase):
+    
+    def test(self):
+        self.assertEqual(utils.get_field("name", Country), utils.target_field("name", Country))
+        self.assertEqual(
+            utils.get_field("length", River), utils.target_field("rivers.length", Country)
+        )
+        self.assertEqual(Region._meta.pk, utils.target_field("region", Country))
+        self.assertEqual(River._meta.pk, utils.target_field("rivers", Country))
+        self.assertEqual(Country._meta.pk, utils.target_field("countries", Region))
+        self.assertIsNone(utils.target_field("rivers_count", Country, ["rivers_count"]))
+
+
+
 class SerializeRowTestCase(TestCase):
     fixtures = ["tests/django_dummy_app/geography_data.json"]
     